@@ -0,0 +1,350 @@
+"""
+Central scheduler of the Google API requests.
+
+Every request goes through call() (or call_async() for the async transport),
+which:
+
+- waits for a token in the bucket of the request, one bucket per API kind
+  (Drive/Docs, read/write) and per user, refilled at the sustained rate the
+  quota allows;
+- caps the number of requests in flight per API;
+- retries quota errors (429, 403 rateLimitExceeded), server errors and
+  connection errors with exponential backoff and full jitter, honouring
+  Retry-After. Methods that create files are only retried on quota errors:
+  after a server or connection error the file may exist already, and a retry
+  would leak a second one;
+- adapts the rate: a quota error halves the rate of its bucket, every success
+  raises it back towards the configured rate.
+
+get_quota_report() exposes the observed headroom of each bucket.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from googleapiclient.errors import HttpError
+from config import (
+    API_RATE_DRIVE_WRITE,
+    API_RATE_DRIVE_READ,
+    API_RATE_DOCS_WRITE,
+    API_RATE_DOCS_READ,
+    API_BURST,
+    API_MAX_CONCURRENCY,
+    API_MAX_RETRIES,
+    API_MAX_BACKOFF,
+)
+
+logger = logging.getLogger(__name__)
+
+# Reasons Google reports with a 403 when a quota is exhausted
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Server errors worth retrying
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+# Methods that are not idempotent: each successful call creates a file
+NON_IDEMPOTENT_METHODS = ('drive.files.copy', 'drive.files.create')
+
+# Sustained requests per second of each bucket
+BUCKET_RATES = {
+    'drive_write': API_RATE_DRIVE_WRITE,
+    'drive_read': API_RATE_DRIVE_READ,
+    'docs_write': API_RATE_DOCS_WRITE,
+    'docs_read': API_RATE_DOCS_READ,
+}
+# Drive methods that count as writes
+_DRIVE_WRITE_METHODS = ('copy', 'create', 'delete', 'update', 'emptyTrash')
+
+# User the quotas are accounted to; set it to schedule several Google
+# accounts independently
+quota_user = contextvars.ContextVar('quota_user', default='default')
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive refill rate (additive increase,
+    multiplicative decrease).
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.recent = deque()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost=1):
+        """
+        Take tokens, possibly in advance.
+
+        Args:
+            cost (int): Number of tokens, one per request
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= cost
+            self.requests += cost
+            self.recent.extend([now] * cost)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.throttled += 1
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def report(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            return {
+                'rate_limit_per_minute': self.max_rate * 60,
+                'current_rate_per_minute': self.rate * 60,
+                'available_tokens': max(self.tokens, 0.0),
+                'requests_last_minute': len(self.recent),
+                'headroom_per_minute': max(self.max_rate * 60 - len(self.recent), 0.0),
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'retries': self.retries,
+            }
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_semaphores = {}
+_async_semaphores = {}
+
+def bucket_name(method_id):
+    """
+    Get the bucket of an API method.
+
+    Args:
+        method_id (str): API method id, e.g. 'drive.files.copy'
+
+    Returns:
+        str: One of the BUCKET_RATES keys
+    """
+    api, _, method = method_id.partition('.')
+    if api == 'docs':
+        return 'docs_write' if method.endswith('batchUpdate') else 'docs_read'
+    return 'drive_write' if method.rsplit('.', 1)[-1] in _DRIVE_WRITE_METHODS else 'drive_read'
+
+def _get_bucket(method_id):
+    key = (bucket_name(method_id), quota_user.get())
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(key, TokenBucket(key[0], BUCKET_RATES[key[0]], API_BURST))
+    return bucket
+
+def _get_semaphore(method_id):
+    api = method_id.partition('.')[0]
+    with _buckets_lock:
+        return _semaphores.setdefault(api, threading.BoundedSemaphore(API_MAX_CONCURRENCY))
+
+def _get_async_semaphore(method_id):
+    # The async transport runs on a single event loop, created before any call
+    api = method_id.partition('.')[0]
+    return _async_semaphores.setdefault(api, asyncio.Semaphore(API_MAX_CONCURRENCY))
+
+def is_rate_limit_error(error):
+    """
+    Check whether an exception is a Google API quota error.
+
+    Args:
+        error (Exception): The exception raised by a request
+
+    Returns:
+        bool: True for 429 responses and 403 rateLimitExceeded responses
+    """
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status == 429:
+        return True
+    if status == 403:
+        content = error.content.decode('utf-8', errors='replace') if isinstance(error.content, bytes) else str(error.content)
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+def is_retryable(error, method_id=None):
+    """
+    Check whether a failed request is worth retrying.
+
+    Args:
+        error (Exception): The exception raised by a request
+        method_id (str, optional): API method id of the request
+
+    Returns:
+        bool: True for quota errors, and for server errors and connection
+            errors unless the method is in NON_IDEMPOTENT_METHODS
+    """
+    if method_id in NON_IDEMPOTENT_METHODS:
+        # Google guarantees nothing happened only when the quota refused the request
+        return is_rate_limit_error(error)
+    if isinstance(error, HttpError):
+        return is_rate_limit_error(error) or error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+def _backoff(attempt, error):
+    retry_after = getattr(getattr(error, 'resp', None), 'get', lambda _: None)('retry-after')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(API_MAX_BACKOFF, 2 ** attempt))
+
+def _on_error(bucket, method_id, attempt, error):
+    """
+    Record a failed attempt and return the delay before the next one, or
+    None if the error must be raised.
+    """
+    if attempt >= API_MAX_RETRIES or not is_retryable(error, method_id):
+        return None
+    if is_rate_limit_error(error):
+        bucket.on_throttle()
+    with bucket.lock:
+        bucket.retries += 1
+    delay = _backoff(attempt, error)
+    logger.warning(f"{method_id} failed ({error}), retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+    return delay
+
+def call(method_id, send, cost=1):
+    """
+    Send a request through the scheduler.
+
+    Args:
+        method_id (str): API method id, e.g. 'drive.files.copy'
+        send (callable): Sends the request and returns its response
+        cost (int): Number of API requests sent, e.g. the size of a batch
+
+    Returns:
+        The response returned by send
+    """
+    bucket = _get_bucket(method_id)
+    semaphore = _get_semaphore(method_id)
+    attempt = 0
+    while True:
+        delay = bucket.reserve(cost)
+        if delay:
+            time.sleep(delay)
+        try:
+            with semaphore:
+                response = send()
+            bucket.on_success()
+            return response
+        except Exception as error:
+            delay = _on_error(bucket, method_id, attempt, error)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+async def call_async(method_id, send):
+    """
+    Send a request of the async transport through the scheduler.
+
+    Args:
+        method_id (str): API method id, e.g. 'drive.files.copy'
+        send (callable): Returns a coroutine sending the request
+
+    Returns:
+        The response returned by the coroutine
+    """
+    bucket = _get_bucket(method_id)
+    semaphore = _get_async_semaphore(method_id)
+    attempt = 0
+    while True:
+        delay = bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            async with semaphore:
+                response = await send()
+            bucket.on_success()
+            return response
+        except Exception as error:
+            delay = _on_error(bucket, method_id, attempt, error)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+def call_batch(method_id, items, send):
+    """
+    Send a batch of requests through the scheduler.
+
+    Each request of the batch takes a token. The requests of the batch that
+    failed with a retryable error are sent again, in a smaller batch, after a
+    backoff.
+
+    Args:
+        method_id (str): API method id of the requests
+        items (list): The requests of the batch
+        send (callable): Sends a list of requests in one batch and returns,
+            for each request, its response or the exception it raised
+
+    Returns:
+        list: For each item, its response or the exception it raised
+    """
+    bucket = _get_bucket(method_id)
+    results = [None] * len(items)
+    pending = list(range(len(items)))
+    attempt = 0
+    while pending:
+        batch = pending
+        responses = call(method_id, lambda: send([items[index] for index in batch]), cost=len(batch))
+        pending = []
+        for index, response in zip(batch, responses):
+            results[index] = response
+            if isinstance(response, Exception) and attempt < API_MAX_RETRIES and is_retryable(response, method_id):
+                pending.append(index)
+        if not pending:
+            break
+
+        errors = [results[index] for index in pending]
+        if any(is_rate_limit_error(error) for error in errors):
+            bucket.on_throttle()
+        with bucket.lock:
+            bucket.retries += len(pending)
+        delay = _backoff(attempt, errors[0])
+        logger.warning(f"{len(pending)} {method_id} requests of a batch failed ({errors[0]}), "
+                       f"retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+    return results
+
+def get_quota_report():
+    """
+    Get the observed quota headroom of every bucket used so far.
+
+    Returns:
+        dict: '<bucket>/<user>' -> counters (configured and current rate per
+            minute, available tokens, requests in the last minute, headroom
+            per minute, total requests, throttled requests and retries)
+    """
+    with _buckets_lock:
+        buckets = list(_buckets.items())
+    return {f"{name}/{user}": bucket.report() for (name, user), bucket in sorted(buckets)}
@@ -1,31 +1,177 @@
 import streamlit as st
 import os
-import pandas as pd
+import re
+from datetime import datetime, time, timedelta
 import logging
-from document_service import replace_variables, create_document_copy, delete_document
-from pdf_service import export_as_pdf
-from config import DOCUMENT_ID, OUTPUT_FILENAME, COVER_LETTER_DOCUMENT_ID, COVER_LETTER_OUTPUT_FILENAME
-from db_service import init_db, save_document, get_all_documents
+from generation_service import iter_generation, TEMPLATES, DATABASE_RESULT
+from batch_service import load_rows, run_batch
+from google_api import ApiCallCounts
+from db_service import init_db, list_documents, search_documents, get_documents_marker, HIGHLIGHT_START, HIGHLIGHT_STOP
+from config import OUTPUT_DIR, RENDER_BACKEND, BUNDLE_FILENAME, JOB_QUEUE_ENABLED
+from job_service import enqueue_job, get_job
+from output_service import create_output_dir, write_zip
+import copy_pool
+import tracing
 from skills_config import SKILLS, SKILL_OPTIONS
 
-# Define output directory
-OUTPUT_DIR = "output"
-# Ensure output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the database
-try:
+@st.cache_resource
+def initialize():
+    """
+    One-time initialization of the process, skipped on every rerun.
+
+    A failure is not cached, so the next rerun tries again.
+    """
+    # Ensure output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Serve the step duration histograms if tracing is enabled
+    tracing.start_metrics_server()
+
+    # Keep ready copies of the templates so that generation does not wait for
+    # Drive; with the job queue, the workers generate and keep their own
+    if RENDER_BACKEND == 'google' and not JOB_QUEUE_ENABLED:
+        copy_pool.warm([template['template_id'] for template in TEMPLATES])
+
+    # Initialize the database
     init_db()
     logger.info("Database initialized successfully")
+
+try:
+    initialize()
 except Exception as e:
     logger.error(f"Failed to initialize database: {e}")
     st.error(f"Erreur de connexion à la base de données: {e}")
     st.warning("L'application fonctionnera sans enregistrement en base de données.")
 
+@st.cache_resource(max_entries=32)
+def load_file(path, mtime_ns):
+    """
+    Read a generated file once and share its bytes across reruns and sessions.
+
+    The modification time is part of the cache key, so a regenerated file is
+    read again.
+    """
+    with open(path, "rb") as file:
+        return file.read()
+
+def documents_table(cursor, entreprise, poste, source, date_from, date_to):
+    """
+    Query a page of applications and build its table.
+
+    Returns:
+        tuple: (DataFrame, or None if the page is empty, next page cursor)
+    """
+    logger.info("Retrieving a page of documents for display")
+    documents, next_cursor = list_documents(
+        cursor=cursor,
+        entreprise=entreprise,
+        poste=poste,
+        source=source,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    if not documents:
+        return None, next_cursor
+
+    # Imported here, once the rest of the page has been sent
+    import pandas as pd
+
+    # Create a DataFrame with company, position, base line, salary, url, and skills columns
+    df = pd.DataFrame([(
+        doc['created_at'],
+        doc['entreprise'],
+        doc['poste'],
+        doc.get('base_line', ''),
+        doc.get('salaire', ''),
+        doc.get('url', ''),
+        doc.get('skill1', ''),
+        doc.get('skill2', ''),
+        doc.get('skill3', ''),
+        doc.get('skill4', ''),
+        doc.get('skill5', ''),
+        doc.get('skill6', '')
+    ) for doc in documents],
+                      columns=['Date', 'Entreprise', 'Poste', 'Base Line', 'Salaire', 'URL', 'Compétence 1', 'Compétence 2', 'Compétence 3', 'Compétence 4', 'Compétence 5', 'Compétence 6'])
+    return df, next_cursor
+
+# The TTL only bounds how long an empty page caused by a database error is kept
+@st.cache_data(max_entries=64, ttl=60, show_spinner=False)
+def cached_documents_table(marker, *args):
+    """
+    documents_table() cached until the documents marker changes, so reruns
+    that do not insert anything (e.g. typing in the "Postuler" form) reuse
+    the table without querying the database.
+    """
+    return documents_table(*args)
+
+@st.cache_data(max_entries=64, ttl=60, show_spinner=False)
+def cached_search(marker, text):
+    """
+    search_documents() cached until the documents marker changes.
+    """
+    return search_documents(text)
+
+# Characters with a meaning in Streamlit Markdown
+_MARKDOWN_SPECIAL = re.compile(r'([\\`*_{}\[\]()#+\-.!|<>~$:])')
+
+def highlight_markdown(text):
+    """
+    Render a search highlight as Markdown: the stored text is escaped and the
+    matched words are set in bold.
+    """
+    escaped = _MARKDOWN_SPECIAL.sub(r'\\\1', text)
+    return escaped.replace(HIGHLIGHT_START, '**').replace(HIGHLIGHT_STOP, '**')
+
+JOB_STATUS_LABELS = {
+    'queued': "en file d'attente",
+    'running': "en cours",
+}
+
+@st.fragment(run_every=1)
+def show_job_status(job_id):
+    """
+    Poll a queued generation every second until a worker finished it, then
+    rerun the whole page to show its outcome and downloads.
+    """
+    job = get_job(job_id)
+    if job is None:
+        st.warning(f"Génération {job_id} introuvable.")
+        return
+    if job['status'] in JOB_STATUS_LABELS:
+        st.info(f"Génération {JOB_STATUS_LABELS[job['status']]}...")
+        return
+
+    result = job['result'] or {}
+    st.session_state.current_job = None
+    st.session_state.job_outcome = job
+    st.session_state.generated_documents = {
+        name: task['output_path'] for name, task in result.get('results', {}).items() if task.get('output_path')
+    }
+    if result.get('bundle'):
+        st.session_state.generated_documents['bundle'] = result['bundle']
+    st.rerun()
+
+def show_job_outcome(job):
+    """
+    Report the outcome of a finished generation job.
+    """
+    results = (job['result'] or {}).get('results', {})
+    if job['status'] == 'failed':
+        st.error(f"Une erreur est survenue: {job['error']}")
+        return
+
+    db_result = results.get(DATABASE_RESULT, {})
+    if db_result.get('error'):
+        st.warning(f"Documents générés avec succès, mais erreur lors de l'enregistrement en base de données: {db_result['error']}")
+    elif db_result.get('document_id'):
+        st.success(f"Documents générés avec succès et enregistrés dans la base de données (ID: {db_result['document_id']})!")
+    else:
+        st.warning("Documents générés avec succès, mais non enregistrés dans la base de données. Vérifiez la connexion à la base de données.")
+
 st.title("Postulator")
 
 # Create tabs for different sections
@@ -77,144 +223,243 @@ with tab1:
     # Submit button
     if st.button("Générer les documents"):
         if entreprise and poste:  # Basic validation
-            with st.spinner("Génération des documents en cours..."):
-                # Create variables dictionary with all fields
-                variables = {
-                    "entreprise": entreprise,
-                    "poste": poste,
-                    "base_line": base_line,
-                    "source": source,
-                    "identifiant": identifiant,
-                    "url": url,
-                    "salaire": salaire,
-                    "description": description,
-                    "skills_text": skills_text,
-                    "skill1": SKILLS[skill1],
-                    "skill2": SKILLS[skill2],
-                    "skill3": SKILLS[skill3],
-                    "skill4": SKILLS[skill4],
-                    "skill5": SKILLS[skill5],
-                    "skill6": SKILLS[skill6]
+            # Create variables dictionary with all fields
+            variables = {
+                "entreprise": entreprise,
+                "poste": poste,
+                "base_line": base_line,
+                "source": source,
+                "identifiant": identifiant,
+                "url": url,
+                "salaire": salaire,
+                "description": description,
+                "skills_text": skills_text,
+                "skill1": SKILLS[skill1],
+                "skill2": SKILLS[skill2],
+                "skill3": SKILLS[skill3],
+                "skill4": SKILLS[skill4],
+                "skill5": SKILLS[skill5],
+                "skill6": SKILLS[skill6]
+            }
+
+            if JOB_QUEUE_ENABLED:
+                # Run by a worker process: the generation survives reruns and disconnects
+                job_id = enqueue_job(variables, create_output_dir())
+                if job_id is None:
+                    st.error("Impossible de mettre la génération en file d'attente. Vérifiez la connexion à la base de données.")
+                else:
+                    st.session_state.current_job = job_id
+                    st.session_state.job_outcome = None
+                    st.session_state.generated_documents = None
+            else:
+                results = {}
+                api_calls = ApiCallCounts()
+                with st.status("Génération des documents en cours...", expanded=True) as status:
+                    # CV, cover letter and database insert run in parallel;
+                    # report each one as soon as it finishes
+                    # A directory per request, so concurrent users never overwrite each other's files
+                    output_dir = create_output_dir()
+                    for result in iter_generation(variables, output_dir, api_calls=api_calls):
+                        results[result['name']] = result
+                        if result['error'] is not None:
+                            status.write(f"❌ {result['label']} : {result['error']}")
+                        else:
+                            details = f"{result['duration']:.1f}s"
+                            if 'api_calls' in result:
+                                details += f", {result['api_calls']} appels API"
+                            status.write(f"✅ {result['label']} ({details})")
+                    status.write(f"{sum(api_calls.values())} appels API Google en {api_calls.round_trips} allers-retours HTTP")
+
+                    failed = [result for name, result in results.items()
+                              if name != DATABASE_RESULT and result['error'] is not None]
+                    if failed:
+                        status.update(label="Génération terminée avec des erreurs", state="error")
+                    else:
+                        status.update(label="Documents générés", state="complete")
+
+                for result in failed:
+                    st.error(f"Une erreur est survenue ({result['label']}): {str(result['error'])}")
+
+                if not failed:
+                    # Report the database insert
+                    db_result = results[DATABASE_RESULT]
+                    document_id = db_result['document_id']
+                    if db_result['error'] is not None:
+                        st.warning(f"Documents générés avec succès, mais erreur lors de l'enregistrement en base de données: {db_result['error']}")
+                    elif document_id:
+                        logger.info(f"Document saved to database with ID: {document_id}")
+                        st.success(f"Documents générés avec succès et enregistrés dans la base de données (ID: {document_id})!")
+                    else:
+                        logger.warning("Failed to save document to database - save_document returned None")
+                        st.warning("Documents générés avec succès, mais non enregistrés dans la base de données. Vérifiez la connexion à la base de données.")
+
+                # Keep the generated files so the download buttons survive reruns
+                generated_documents = {
+                    template['name']: results[template['name']]['output_path'] for template in TEMPLATES
                 }
+                if not failed:
+                    # CV and cover letter in a single download
+                    generated_documents['bundle'] = write_zip(
+                        {template['output_filename']: generated_documents[template['name']] for template in TEMPLATES},
+                        os.path.join(output_dir, BUNDLE_FILENAME),
+                    )
+                st.session_state.generated_documents = generated_documents
+        else:
+            st.error("Veuillez remplir au moins les champs 'Entreprise' et 'Poste'.")
 
-                try:
-                    # Process CV document
-                    logger.info("Processing CV document")
-                    # Store the original template ID for reference
-                    cv_template_id = DOCUMENT_ID
-
-                    # Create a copy of the template document
-                    cv_copy_id = create_document_copy(cv_template_id)
-
-                    # Ensure copy_id is different from template_id
-                    if cv_copy_id == cv_template_id:
-                        raise ValueError("CV Copy ID is the same as template ID")
-
-                    # Replace variables in the copy, not the template
-                    # Pass template_id to ensure we're not modifying the original template
-                    replace_variables(cv_copy_id, variables, template_id=cv_template_id)
-
-                    # Export the copy as PDF
-                    cv_output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILENAME)
-                    export_as_pdf(cv_copy_id, cv_output_path)
-
-                    # Delete the copy as it's no longer needed
-                    delete_document(cv_copy_id)
-
-                    # Process Cover Letter document
-                    logger.info("Processing Cover Letter document")
-                    # Store the original template ID for reference
-                    cover_letter_template_id = COVER_LETTER_DOCUMENT_ID
-
-                    # Create a copy of the template document
-                    cover_letter_copy_id = create_document_copy(cover_letter_template_id)
-
-                    # Ensure copy_id is different from template_id
-                    if cover_letter_copy_id == cover_letter_template_id:
-                        raise ValueError("Cover Letter Copy ID is the same as template ID")
-
-                    # Replace variables in the copy, not the template
-                    # Pass template_id to ensure we're not modifying the original template
-                    replace_variables(cover_letter_copy_id, variables, template_id=cover_letter_template_id)
+    # Follow the queued generation, if any
+    if st.session_state.get('current_job'):
+        show_job_status(st.session_state.current_job)
+    elif st.session_state.get('job_outcome'):
+        show_job_outcome(st.session_state.job_outcome)
+
+    # Provide download links for the documents that were generated
+    generated_documents = st.session_state.get('generated_documents')
+    if generated_documents:
+        download_columns = st.columns(len(TEMPLATES))
+        for column, template in zip(download_columns, TEMPLATES):
+            output_path = generated_documents.get(template['name'])
+            with column:
+                if output_path and os.path.exists(output_path):
+                    btn = st.download_button(
+                        label=template['download_label'],
+                        data=load_file(output_path, os.stat(output_path).st_mtime_ns),
+                        file_name=template['output_filename'],
+                        mime="application/pdf"
+                    )
+        bundle_path = generated_documents.get('bundle')
+        if bundle_path and os.path.exists(bundle_path):
+            st.download_button(
+                label="Télécharger les deux documents (ZIP)",
+                data=load_file(bundle_path, os.stat(bundle_path).st_mtime_ns),
+                file_name=BUNDLE_FILENAME,
+                mime="application/zip"
+            )
+
+    # Batch generation from a CSV/JSONL file
+    with st.expander("Génération par lot"):
+        st.markdown("Un fichier CSV ou JSONL avec une candidature par ligne, mêmes colonnes que le formulaire "
+                    "(`entreprise`, `poste`, ..., `skill1` à `skill6` avec le nom de la compétence).")
+        batch_file = st.file_uploader("Fichier de candidatures", type=["csv", "jsonl"])
+        if batch_file is not None and st.button("Générer le lot"):
+            try:
+                rows = load_rows(batch_file, batch_file.name)
+                progress_bar = st.progress(0.0, text="Génération du lot en cours...")
+
+                def update_progress(done, total):
+                    progress_bar.progress(done / total, text=f"{done}/{total} documents traités")
+
+                batch_result = run_batch(rows, create_output_dir(), on_progress=update_progress)
+                progress_bar.empty()
+
+                failed = [report for report in batch_result['reports'] if report['status'] != 'ok']
+                message = (f"{len(batch_result['reports']) - len(failed)} candidatures générées sur {len(batch_result['reports'])} "
+                           f"({batch_result['docs_per_minute']:.1f} documents/minute)")
+                if failed:
+                    st.warning(message)
+                else:
+                    st.success(message)
+
+                # Imported here: pandas is slow to import and only needed for tables
+                import pandas as pd
+                st.dataframe(pd.DataFrame([(
+                    report['row'],
+                    report['entreprise'],
+                    report['poste'],
+                    report['status'],
+                    report['document_id'],
+                    ' | '.join(report['errors'])
+                ) for report in batch_result['reports']],
+                    columns=['Ligne', 'Entreprise', 'Poste', 'Statut', 'ID', 'Erreurs']), use_container_width=True)
+
+                with open(batch_result['zip_path'], "rb") as file:
+                    st.download_button(
+                        label="Télécharger le lot (ZIP)",
+                        data=file,
+                        file_name=os.path.basename(batch_result['zip_path']),
+                        mime="application/zip"
+                    )
+            except Exception as e:
+                logger.error(f"Error during batch generation: {e}")
+                st.error(f"Une erreur est survenue pendant la génération du lot: {str(e)}")
 
-                    # Export the copy as PDF
-                    cover_letter_output_path = os.path.join(OUTPUT_DIR, COVER_LETTER_OUTPUT_FILENAME)
-                    export_as_pdf(cover_letter_copy_id, cover_letter_output_path)
+# Tab 2: View records
+def reset_documents_pages():
+    # Filters changed: start again from the first page
+    st.session_state.documents_cursors = [None]
 
-                    # Delete the copy as it's no longer needed
-                    delete_document(cover_letter_copy_id)
+def next_documents_page(cursor):
+    st.session_state.documents_cursors.append(cursor)
 
-                    # Save document data to the database
-                    try:
-                        logger.info("Attempting to save document to database")
-                        document_id = save_document(variables)
-                        if document_id:
-                            logger.info(f"Document saved to database with ID: {document_id}")
-                            st.success(f"Documents générés avec succès et enregistrés dans la base de données (ID: {document_id})!")
-                        else:
-                            logger.warning("Failed to save document to database - save_document returned None")
-                            st.warning("Documents générés avec succès, mais non enregistrés dans la base de données. Vérifiez la connexion à la base de données.")
-                    except Exception as db_error:
-                        logger.error(f"Error saving document to database: {db_error}")
-                        st.warning(f"Documents générés avec succès, mais erreur lors de l'enregistrement en base de données: {db_error}")
-
-                    # Provide download links
-                    col1, col2 = st.columns(2)
-
-                    with col1:
-                        if os.path.exists(cv_output_path):
-                            with open(cv_output_path, "rb") as file:
-                                btn = st.download_button(
-                                    label="Télécharger le CV",
-                                    data=file,
-                                    file_name=OUTPUT_FILENAME,
-                                    mime="application/pdf"
-                                )
-
-                    with col2:
-                        if os.path.exists(cover_letter_output_path):
-                            with open(cover_letter_output_path, "rb") as file:
-                                btn = st.download_button(
-                                    label="Télécharger la Lettre de Motivation",
-                                    data=file,
-                                    file_name=COVER_LETTER_OUTPUT_FILENAME,
-                                    mime="application/pdf"
-                                )
-                except Exception as e:
-                    st.error(f"Une erreur est survenue: {str(e)}")
-        else:
-            st.error("Veuillez remplir au moins les champs 'Entreprise' et 'Poste'.")
+def previous_documents_page():
+    st.session_state.documents_cursors.pop()
 
-# Tab 2: View records
 with tab2:
     try:
-        # Get all documents from the database
-        logger.info("Retrieving all documents for display")
-        documents = get_all_documents()
-
-        if documents:
-            # Create a DataFrame with company, position, base line, salary, url, and skills columns
-            df = pd.DataFrame([(
-                doc['entreprise'], 
-                doc['poste'], 
-                doc.get('base_line', ''), 
-                doc.get('salaire', ''),
-                doc.get('url', ''),
-                doc.get('skill1', ''),
-                doc.get('skill2', ''),
-                doc.get('skill3', ''),
-                doc.get('skill4', ''),
-                doc.get('skill5', ''),
-                doc.get('skill6', '')
-            ) for doc in documents], 
-                            columns=['Entreprise', 'Poste', 'Base Line', 'Salaire', 'URL', 'Compétence 1', 'Compétence 2', 'Compétence 3', 'Compétence 4', 'Compétence 5', 'Compétence 6'])
+        if 'documents_cursors' not in st.session_state:
+            # Cursor of every page visited so far, the last one is displayed
+            st.session_state.documents_cursors = [None]
+
+        # Full-text search over company, position, skills and description
+        search_text = st.text_input("Rechercher", placeholder="ex : mlops kubernetes")
+        # Cheap marker of the documents table, None if the database is unreachable
+        marker = get_documents_marker()
+
+        if search_text.strip():
+            search_results = cached_search(marker, search_text) if marker is not None else search_documents(search_text)
+            if search_results:
+                st.caption(f"{len(search_results)} résultat(s)")
+                for result in search_results:
+                    st.markdown(f"{highlight_markdown(result['entreprise_highlight'])} — "
+                                f"{highlight_markdown(result['poste_highlight'])} "
+                                f"· {result['created_at']:%d/%m/%Y}")
+                    extracts = [highlight_markdown(text) for text in (result['skills_highlight'], result['description_highlight']) if text]
+                    if extracts:
+                        st.caption(" … ".join(extracts))
+            else:
+                st.info("Aucune candidature ne correspond à la recherche.")
+            st.divider()
+
+        # Filters applied by the database
+        filter_col1, filter_col2, filter_col3 = st.columns(3)
+        with filter_col1:
+            filter_entreprise = st.text_input("Filtrer par entreprise", on_change=reset_documents_pages)
+        with filter_col2:
+            filter_poste = st.text_input("Filtrer par poste", on_change=reset_documents_pages)
+        with filter_col3:
+            filter_source = st.text_input("Filtrer par source", on_change=reset_documents_pages)
+        filter_dates = st.date_input("Période", value=(), on_change=reset_documents_pages)
+
+        date_from = date_to = None
+        if len(filter_dates) >= 1:
+            date_from = datetime.combine(filter_dates[0], time.min)
+        if len(filter_dates) == 2:
+            # The end date is inclusive
+            date_to = datetime.combine(filter_dates[1] + timedelta(days=1), time.min)
+
+        page_args = (st.session_state.documents_cursors[-1], filter_entreprise, filter_poste, filter_source, date_from, date_to)
+        if marker is not None:
+            df, next_cursor = cached_documents_table(marker, *page_args)
+        else:
+            df, next_cursor = documents_table(*page_args)
 
+        if df is not None:
             # Display the DataFrame as a table
             st.dataframe(df, use_container_width=True)
-            logger.info(f"Displayed {len(documents)} documents")
+            logger.info(f"Displayed {len(df)} documents")
         else:
             st.info("Aucun enregistrement trouvé dans la base de données.")
             logger.info("No documents found in database")
+
+        # Page navigation
+        page_number = len(st.session_state.documents_cursors)
+        nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+        with nav_col1:
+            st.button("← Précédent", disabled=page_number == 1, on_click=previous_documents_page)
+        with nav_col2:
+            st.markdown(f"Page {page_number}")
+        with nav_col3:
+            st.button("Suivant →", disabled=next_cursor is None, on_click=next_documents_page, args=(next_cursor,))
     except Exception as e:
         logger.error(f"Error retrieving documents: {e}")
         st.error(f"Erreur lors de la récupération des enregistrements: {e}")
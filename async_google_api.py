@@ -0,0 +1,280 @@
+"""
+Asyncio transport for the Google API endpoints used by the application.
+
+googleapiclient is blocking: every call holds a thread for the whole round
+trip. This module talks to the handful of endpoints we use (files.copy,
+files.delete, files.export, documents.get, documents.batchUpdate) through one
+httpx.AsyncClient, which shares an HTTP/2 keep-alive connection pool, so many
+documents can be in flight on a single event loop.
+
+The coroutines mirror document_service and pdf_service. Synchronous code uses
+them through run() and submit(), which execute them on a background event
+loop; with GOOGLE_API_TRANSPORT=async the functions of document_service and
+pdf_service do exactly that, so their signatures do not change, and
+generation_service.render_templates() submits whole pipelines, see
+render_template().
+
+Requests are paced and retried by api_scheduler, like the ones of the
+googleapiclient transport.
+"""
+import asyncio
+import logging
+import threading
+import httpx
+import httplib2
+import api_scheduler
+import tracing
+from googleapiclient.errors import HttpError
+from auth import refresh_credentials
+from google_api import get_shared_credentials, record_api_call, api_call_trackers
+from document_service import copy_body, check_copy, build_replace_requests, COPY_FIELDS
+from pdf_service import atomic_output, PDF_MIME_TYPE
+from config import STRICT_TEMPLATE_CHECKS, COPY_POOL_SIZE, DOWNLOAD_CHUNK_SIZE, ASYNC_MAX_CONNECTIONS, ASYNC_REQUEST_TIMEOUT, GOOGLE_API_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+DRIVE_URL = f'{GOOGLE_API_ENDPOINT}/drive/v3' if GOOGLE_API_ENDPOINT else 'https://www.googleapis.com/drive/v3'
+DOCS_URL = f'{GOOGLE_API_ENDPOINT}/v1' if GOOGLE_API_ENDPOINT else 'https://docs.googleapis.com/v1'
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+# The credentials of auth, which refreshes them in place
+_credentials = None
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='google-api-loop', daemon=True).start()
+    return _loop
+
+async def _with_trackers(coro, trackers, parent_span):
+    # Count the calls in the track_api_calls() blocks of the calling thread,
+    # and trace them as children of its current span
+    api_call_trackers.set(trackers)
+    tracing.current_span.set(parent_span)
+    return await coro
+
+def submit(coro):
+    """
+    Start a coroutine of this module from synchronous code.
+
+    All coroutines run on one background event loop, so calls made from many
+    threads share the same connection pool, and many submitted coroutines
+    are in flight together.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        concurrent.futures.Future: The future of its result
+    """
+    return asyncio.run_coroutine_threadsafe(
+        _with_trackers(coro, api_call_trackers.get(), tracing.current_span.get()), _get_loop()
+    )
+
+def run(coro):
+    """
+    Run a coroutine of this module from synchronous code and wait for it.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        The result of the coroutine
+    """
+    return submit(coro).result()
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+            timeout=ASYNC_REQUEST_TIMEOUT,
+        )
+    return _client
+
+async def _get_token(rejected_token=None):
+    global _credentials
+    # The credentials are shared with the googleapiclient transport and the
+    # refresh thread of auth, so they are only refreshed through auth, under
+    # its lock. Loading or refreshing them blocks: keep it off the event loop.
+    if rejected_token is not None:
+        _credentials = await asyncio.to_thread(refresh_credentials, rejected_token)
+    elif _credentials is None or not _credentials.valid:
+        _credentials = await asyncio.to_thread(get_shared_credentials)
+    return _credentials.token
+
+async def _authorized(method_id, send):
+    """
+    Send one request, retrying once with a refreshed token on 401.
+
+    Args:
+        method_id (str): API method id, counted once per HTTP request
+        send (callable): Takes the request headers and returns a coroutine
+            sending the request and returning its response
+
+    Returns:
+        httpx.Response: The response
+    """
+    token = await _get_token()
+    for attempt in range(2):
+        record_api_call(method_id)
+        try:
+            response = await send({'Authorization': f'Bearer {token}'})
+        except httpx.TransportError as error:
+            # Retried by the scheduler like the connection errors of httplib2
+            raise ConnectionError(str(error)) from error
+        if response.status_code != 401 or attempt:
+            return response
+        token = await _get_token(rejected_token=token)
+
+def _raise_for_status(response, content):
+    if response.status_code >= 400:
+        # Same exception as googleapiclient, so callers handle both transports alike
+        headers = {'status': str(response.status_code)}
+        if 'retry-after' in response.headers:
+            headers['retry-after'] = response.headers['retry-after']
+        raise HttpError(httplib2.Response(headers), content, uri=str(response.url))
+
+async def _send(method_id, method, url, **kwargs):
+    """
+    Send one authorized request, retrying once with fresh credentials on 401.
+    """
+    client = _get_client()
+    response = await _authorized(method_id, lambda headers: client.request(method, url, headers=headers, **kwargs))
+    _raise_for_status(response, response.content)
+    return response.json() if response.content else None
+
+async def _request(method_id, method, url, **kwargs):
+    """
+    Send one request through the scheduler.
+    """
+    with tracing.span(method_id):
+        return await api_scheduler.call_async(method_id, lambda: _send(method_id, method, url, **kwargs))
+
+async def create_document_copy(document_id, copy_title=None, strict=None):
+    """
+    Create a copy of a Google Doc, see document_service.create_document_copy().
+    """
+    if strict is None:
+        strict = STRICT_TEMPLATE_CHECKS
+
+    original_id = document_id
+    if strict:
+        original_doc = await _request('docs.documents.get', 'GET', f'{DOCS_URL}/documents/{document_id}',
+                                      params={'fields': 'documentId'})
+        original_id = original_doc.get('documentId')
+        if original_id != document_id:
+            raise ValueError(f"Original document ID mismatch: expected {document_id}, got {original_id}")
+
+    copied_file = await _request('drive.files.copy', 'POST', f'{DRIVE_URL}/files/{document_id}/copy',
+                                 params={'fields': COPY_FIELDS}, json=copy_body(copy_title))
+    copy_id = check_copy(copied_file, original_id)
+
+    if strict:
+        copy_doc = await _request('docs.documents.get', 'GET', f'{DOCS_URL}/documents/{copy_id}',
+                                  params={'fields': 'documentId'})
+        verified_copy_id = copy_doc.get('documentId')
+        if verified_copy_id != copy_id:
+            raise ValueError(f"Copy document ID mismatch: expected {copy_id}, got {verified_copy_id}")
+
+    return copy_id
+
+async def delete_document(document_id):
+    """
+    Delete a Google Doc, see document_service.delete_document().
+    """
+    await _request('drive.files.delete', 'DELETE', f'{DRIVE_URL}/files/{document_id}')
+
+async def replace_variables(document_id, replacements, template_id=None, strict=None):
+    """
+    Replace variables in a Google Doc, see document_service.replace_variables().
+    """
+    if strict is None:
+        strict = STRICT_TEMPLATE_CHECKS
+
+    doc_id = document_id
+    if strict:
+        doc = await _request('docs.documents.get', 'GET', f'{DOCS_URL}/documents/{document_id}',
+                             params={'fields': 'documentId'})
+        doc_id = doc.get('documentId')
+        if doc_id != document_id:
+            raise ValueError(f"Document ID mismatch: expected {document_id}, got {doc_id}")
+
+    if template_id and doc_id == template_id:
+        raise ValueError(f"Cannot modify template document: {template_id}")
+
+    requests = build_replace_requests(replacements)
+    if requests:
+        await _request('docs.documents.batchUpdate', 'POST', f'{DOCS_URL}/documents/{doc_id}:batchUpdate',
+                       json={'requests': requests})
+
+async def export_as_pdf(document_id, output_filename):
+    """
+    Export a Google Doc as PDF, streaming it to disk, see pdf_service.export_as_pdf().
+    """
+    client = _get_client()
+
+    async def stream(headers):
+        async with client.stream('GET', f'{DRIVE_URL}/files/{document_id}/export',
+                                 params={'mimeType': PDF_MIME_TYPE}, headers=headers) as response:
+            if response.status_code == 401:
+                # Retried by _authorized() with a refreshed token
+                return response
+            if response.status_code >= 400:
+                _raise_for_status(response, await response.aread())
+            with atomic_output(output_filename) as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            return response
+
+    async def send():
+        response = await _authorized('drive.files.export', stream)
+        if response.status_code == 401:
+            _raise_for_status(response, b'')
+
+    with tracing.span('drive.files.export'):
+        await api_scheduler.call_async('drive.files.export', send)
+
+async def _template_copy(template_id):
+    # Same rules as document_service.create_document_copy()
+    if COPY_POOL_SIZE > 0 and not STRICT_TEMPLATE_CHECKS:
+        # Imported here: copy_pool makes its copies through document_service
+        import copy_pool
+        copy_id = await asyncio.to_thread(copy_pool.take, template_id)
+        if copy_id is not None:
+            return copy_id
+    return await create_document_copy(template_id)
+
+async def render_template(template_id, variables, output_path):
+    """
+    Copy a template, fill the copy, export it and delete it, even if a step
+    fails.
+
+    The copy is taken from the copy pool when possible. The variables are
+    all sent: keep the ones the template uses beforehand, see
+    placeholder_service.filter_replacements().
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+        variables (dict): Dictionary of variables and their replacement values
+        output_path (str): Path of the PDF file to write
+
+    Returns:
+        str: The path of the written PDF
+    """
+    copy_id = await _template_copy(template_id)
+    try:
+        await replace_variables(copy_id, variables, template_id=template_id)
+        await export_as_pdf(copy_id, output_path)
+    finally:
+        try:
+            await delete_document(copy_id)
+        except Exception as error:
+            # Do not hide the error of the pipeline, the janitor reclaims the copy later
+            logger.warning(f"Could not delete copy {copy_id}: {error}")
+    return output_path
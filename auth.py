@@ -1,113 +1,242 @@
+"""
+Google API credentials.
+
+The credentials are loaded from TOKEN_FILE once per process and kept in
+memory. A background thread refreshes the access token TOKEN_REFRESH_MARGIN
+seconds before it expires, so callers never wait for a refresh, and the
+token file is rewritten atomically only when the token changed.
+
+The interactive OAuth consent flow is never started by the application: run
+`python auth.py` once to create the token file.
+"""
 import os
+import re
 import json
+import time
+import logging
 import tempfile
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+import threading
+from datetime import datetime
 import config
+import tracing
+
+logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive']
 
+_lock = threading.Lock()
+_credentials = None
+# Last token written to (or read from) TOKEN_FILE
+_saved_token = None
+_refresher = None
+
+def _parse_client_config():
+    """
+    Parse the OAuth client configuration of the CREDENTIALS_JSON environment variable.
+
+    Returns:
+        dict: The client configuration
+    """
+    if not config.CREDENTIALS_JSON:
+        # No credentials provided
+        raise ValueError("CREDENTIALS_JSON environment variable is not set. Please provide Google API credentials.")
+
+    # Try to fix common JSON formatting issues
+    credentials_json = config.CREDENTIALS_JSON
+
+    # If the JSON string starts with a single quote, it might be a string representation
+    # that needs to be evaluated
+    if credentials_json.startswith("'") and credentials_json.endswith("'"):
+        credentials_json = credentials_json[1:-1]
+
+    try:
+        # Try different approaches to parse the JSON
+        try:
+            # First try to parse as is
+            return json.loads(credentials_json)
+        except json.JSONDecodeError:
+            try:
+                # If that fails, try to replace single quotes with double quotes
+                # Replace single quotes that are likely to be for property names or string values
+                # This regex looks for patterns like 'property': or 'value'
+                fixed_json = re.sub(r"'([^']*)':", r'"\1":', credentials_json)
+                fixed_json = re.sub(r":'([^']*)'", r':"\1"', fixed_json)
+
+                # Now try to parse again
+                return json.loads(fixed_json)
+            except json.JSONDecodeError:
+                try:
+                    # If that still fails, it might be a Python dictionary literal
+                    # Try to safely evaluate it (this is risky but we're in a controlled environment)
+                    import ast
+                    # Only attempt this if it looks like a dictionary
+                    if credentials_json.strip().startswith('{') and credentials_json.strip().endswith('}'):
+                        # Use ast.literal_eval which is safer than eval()
+                        return ast.literal_eval(credentials_json)
+                    # If it doesn't look like a dictionary, re-raise the original error
+                    raise
+                except Exception:
+                    # If all attempts fail, raise a more helpful error
+                    raise json.JSONDecodeError(
+                        "Could not parse CREDENTIALS_JSON. Ensure it's a valid JSON string with double quotes.",
+                        credentials_json, 0
+                    )
+    except json.JSONDecodeError as e:
+        # Provide a more detailed error message with debugging information
+        error_msg = f"Invalid JSON in CREDENTIALS_JSON environment variable: {str(e)}"
+
+        # Add debugging information about the JSON string
+        # Only show a snippet to avoid exposing sensitive information
+        if credentials_json:
+            # Show the first 50 characters with sensitive parts masked
+            snippet = credentials_json[:50] + "..." if len(credentials_json) > 50 else credentials_json
+            # Mask any potential client secrets or IDs
+            snippet = re.sub(r'"client_secret":"[^"]*"', '"client_secret":"***"', snippet)
+            snippet = re.sub(r'"client_id":"[^"]*"', '"client_id":"***"', snippet)
+            error_msg += f"\nJSON snippet (masked): {snippet}"
+
+        # Provide guidance on how to format the JSON correctly
+        error_msg += "\nEnsure that the JSON is properly formatted with double quotes around property names and string values."
+        error_msg += "\nExample format: {\"property\": \"value\"}"
+
+        raise ValueError(error_msg)
+
+def _save_token(creds):
+    """
+    Write the token file atomically, only when the token changed.
+    """
+    global _saved_token
+    token = creds.to_json()
+    if token == _saved_token:
+        return
+
+    directory = os.path.dirname(os.path.abspath(config.TOKEN_FILE))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(token)
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, config.TOKEN_FILE)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    _saved_token = token
+
+@tracing.traced('auth.refresh')
+def _refresh(creds):
+    # Refreshes in place, so every client holding the credentials sees the new token
+    from google.auth.transport.requests import Request
+    logger.info("Refreshing Google API access token")
+    creds.refresh(Request())
+    _save_token(creds)
+
+def _seconds_until_refresh(creds):
+    if creds.expiry is None:
+        return None
+    # google-auth expiries are naive UTC datetimes
+    return (creds.expiry - datetime.utcnow()).total_seconds() - config.TOKEN_REFRESH_MARGIN
+
+def _refresh_loop():
+    while True:
+        with _lock:
+            delay = _seconds_until_refresh(_credentials)
+        if delay is None:
+            return
+        if delay > 0:
+            time.sleep(delay)
+            continue
+        try:
+            with _lock:
+                _refresh(_credentials)
+        except Exception as error:
+            # Callers refresh on demand if the token expires anyway
+            logger.error(f"Error refreshing Google API access token: {error}")
+            time.sleep(60)
+
+@tracing.traced('auth.load')
+def _load():
+    global _saved_token
+    # Imported on first use, it pulls in google.auth and is slow to import
+    from google.oauth2.credentials import Credentials
+    if not os.path.exists(config.TOKEN_FILE):
+        raise ValueError(
+            f"No Google API token found in {config.TOKEN_FILE}. "
+            "Run `python auth.py` once to authorize the application."
+        )
+    with open(config.TOKEN_FILE) as token_file:
+        _saved_token = token_file.read()
+    creds = Credentials.from_authorized_user_info(json.loads(_saved_token), SCOPES)
+    if not creds.valid and not creds.refresh_token:
+        raise ValueError(
+            f"The Google API token in {config.TOKEN_FILE} expired and cannot be refreshed. "
+            "Run `python auth.py` to authorize the application again."
+        )
+    return creds
+
 def get_credentials():
     """
-    Get or refresh Google API credentials.
+    Get the process-wide Google API credentials.
 
-    Credentials are provided via the CREDENTIALS_JSON environment variable.
+    The token file is read once; afterwards this only returns the in-memory
+    credentials, which a background thread keeps fresh. Never starts an
+    interactive authorization, see authorize().
 
     Returns:
         Credentials: Google API credentials
     """
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        # Check if credentials are provided via environment variable
-        if config.CREDENTIALS_JSON:
-            # Validate JSON format before writing to file
-            try:
-                # Try to fix common JSON formatting issues
-                credentials_json = config.CREDENTIALS_JSON
+    global _credentials, _refresher
+    creds = _credentials
+    if creds is not None and creds.valid:
+        return creds
 
-                # If the JSON string starts with a single quote, it might be a string representation
-                # that needs to be evaluated
-                if credentials_json.startswith("'") and credentials_json.endswith("'"):
-                    credentials_json = credentials_json[1:-1]
+    with _lock:
+        if _credentials is None:
+            _credentials = _load()
+        if not _credentials.valid:
+            _refresh(_credentials)
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_loop, name='token-refresh', daemon=True)
+            _refresher.start()
+        return _credentials
 
-                # Try different approaches to parse the JSON
-                try:
-                    # First try to parse as is
-                    json_obj = json.loads(credentials_json)
-                except json.JSONDecodeError:
-                    try:
-                        # If that fails, try to replace single quotes with double quotes
-                        import re
-                        # Replace single quotes that are likely to be for property names or string values
-                        # This regex looks for patterns like 'property': or 'value'
-                        fixed_json = re.sub(r"'([^']*)':", r'"\1":', credentials_json)
-                        fixed_json = re.sub(r":'([^']*)'", r':"\1"', fixed_json)
-
-                        # Now try to parse again
-                        json_obj = json.loads(fixed_json)
-                    except json.JSONDecodeError:
-                        try:
-                            # If that still fails, it might be a Python dictionary literal
-                            # Try to safely evaluate it (this is risky but we're in a controlled environment)
-                            import ast
-                            # Only attempt this if it looks like a dictionary
-                            if credentials_json.strip().startswith('{') and credentials_json.strip().endswith('}'):
-                                # Use ast.literal_eval which is safer than eval()
-                                dict_obj = ast.literal_eval(credentials_json)
-                                # Convert the dictionary to a JSON string
-                                json_obj = dict_obj
-                            else:
-                                # If it doesn't look like a dictionary, re-raise the original error
-                                raise
-                        except Exception:
-                            # If all attempts fail, raise a more helpful error
-                            raise json.JSONDecodeError(
-                                "Could not parse CREDENTIALS_JSON. Ensure it's a valid JSON string with double quotes.",
-                                credentials_json, 0
-                            )
-
-                # Convert back to a properly formatted JSON string
-                valid_json = json.dumps(json_obj)
-
-                # Create a temporary file with the validated credentials JSON content
-                with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                    temp_file.write(valid_json)
-                    temp_credentials_path = temp_file.name
+def refresh_credentials(rejected_token):
+    """
+    Refresh the process-wide access token after the API rejected it.
 
-                try:
-                    flow = InstalledAppFlow.from_client_secrets_file(temp_credentials_path, SCOPES)
-                    creds = flow.run_local_server(port=0)
-                finally:
-                    # Clean up the temporary file
-                    if os.path.exists(temp_credentials_path):
-                        os.unlink(temp_credentials_path)
-            except json.JSONDecodeError as e:
-                # Provide a more detailed error message with debugging information
-                error_msg = f"Invalid JSON in CREDENTIALS_JSON environment variable: {str(e)}"
-
-                # Add debugging information about the JSON string
-                # Only show a snippet to avoid exposing sensitive information
-                if credentials_json:
-                    # Show the first 50 characters with sensitive parts masked
-                    snippet = credentials_json[:50] + "..." if len(credentials_json) > 50 else credentials_json
-                    # Mask any potential client secrets or IDs
-                    import re
-                    snippet = re.sub(r'"client_secret":"[^"]*"', '"client_secret":"***"', snippet)
-                    snippet = re.sub(r'"client_id":"[^"]*"', '"client_id":"***"', snippet)
-                    error_msg += f"\nJSON snippet (masked): {snippet}"
-
-                # Provide guidance on how to format the JSON correctly
-                error_msg += "\nEnsure that the JSON is properly formatted with double quotes around property names and string values."
-                error_msg += "\nExample format: {\"property\": \"value\"}"
-
-                raise ValueError(error_msg)
-        else:
-            # No credentials provided
-            raise ValueError("CREDENTIALS_JSON environment variable is not set. Please provide Google API credentials.")
-
-        # Save the token for future use
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    Holds the same lock as the background refresh, so concurrent callers
+    rejected with the same token refresh it once.
+
+    Args:
+        rejected_token (str): The access token the API rejected
+
+    Returns:
+        Credentials: Google API credentials
+    """
+    creds = get_credentials()
+    with _lock:
+        if creds.token == rejected_token:
+            _refresh(creds)
+        return creds
+
+def authorize():
+    """
+    Run the interactive OAuth consent flow and write the token file.
+
+    Opens a browser and waits for the user, so only call it from a terminal.
+
+    Returns:
+        Credentials: Google API credentials
+    """
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    flow = InstalledAppFlow.from_client_config(_parse_client_config(), SCOPES)
+    creds = flow.run_local_server(port=0)
+    with _lock:
+        _save_token(creds)
     return creds
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    authorize()
+    print(f"✓ Token written to {config.TOKEN_FILE}")
@@ -0,0 +1,46 @@
+"""
+Command line entry point for batch generation.
+
+Usage:
+    python batch.py applications.csv [--output-dir output] [--workers 4] [--no-save]
+"""
+import argparse
+import logging
+from batch_service import load_rows, run_batch
+from config import OUTPUT_DIR, BATCH_MAX_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate CVs and cover letters for every row of a CSV/JSONL file.")
+    parser.add_argument('input', help="CSV or JSONL file with one application per row")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Directory where the PDFs and the ZIP are written")
+    parser.add_argument('--workers', type=int, default=BATCH_MAX_WORKERS, help="Number of pipelines run in parallel")
+    parser.add_argument('--no-save', action='store_true', help="Do not save the rows to the database")
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as file:
+        rows = load_rows(file, args.input)
+
+    result = run_batch(rows, args.output_dir, save=not args.no_save, max_workers=args.workers)
+
+    for report in result['reports']:
+        status = "✓" if report['status'] == 'ok' else "✗"
+        line = f"{status} Row {report['row']}: {report['entreprise']} - {report['poste']}"
+        if report['errors']:
+            line += f" ({'; '.join(report['errors'])})"
+        print(line)
+
+    failed = sum(1 for report in result['reports'] if report['status'] != 'ok')
+    print(f"ZIP archive: {result['zip_path']}")
+    print(f"{len(result['reports']) - failed} rows succeeded, {failed} failed")
+    print(f"{result['documents']} documents in {result['duration']:.1f}s: {result['docs_per_minute']:.1f} docs/minute")
+    for bucket, quota in result['quota'].items():
+        print(f"{bucket}: {quota['requests']} requests, {quota['throttled']} throttled, {quota['retries']} retries, "
+              f"{quota['current_rate_per_minute']:.0f}/{quota['rate_limit_per_minute']:.0f} requests/minute, "
+              f"headroom {quota['headroom_per_minute']:.0f} requests/minute")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
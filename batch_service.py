@@ -0,0 +1,230 @@
+"""
+Batch generation of applications from a CSV or JSONL file.
+
+Each row holds the same keys as the variables of the Streamlit form. The
+skill1 ... skill6 columns reference SKILLS by name and are expanded to their
+description, exactly like the select boxes of the form.
+"""
+import io
+import os
+import re
+import csv
+import json
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from generation_service import render_template, render_templates, TEMPLATES
+from db_service import save_documents
+from api_scheduler import get_quota_report
+from output_service import write_zip
+from skills_config import SKILLS
+from config import BATCH_MAX_WORKERS, RENDER_BACKEND, GOOGLE_API_TRANSPORT
+
+logger = logging.getLogger(__name__)
+
+# Keys of the variables dictionary filled from each row
+VARIABLE_KEYS = ['entreprise', 'poste', 'base_line', 'source', 'identifiant', 'url', 'salaire', 'description', 'skills_text']
+SKILL_KEYS = ['skill1', 'skill2', 'skill3', 'skill4', 'skill5', 'skill6']
+
+# Columns of the per-row report
+REPORT_COLUMNS = ['row', 'entreprise', 'poste', 'status', 'document_id', 'files', 'errors']
+
+def load_rows(file, filename):
+    """
+    Read the rows of a CSV or JSONL file.
+
+    Args:
+        file: A binary or text file object
+        filename (str): Name of the file, its extension selects the format
+
+    Returns:
+        list: List of dictionaries, one per row
+    """
+    content = file.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return list(csv.DictReader(io.StringIO(content)))
+    if extension in ('.jsonl', '.ndjson'):
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    raise ValueError(f"Unsupported batch file format: {filename} (expected .csv or .jsonl)")
+
+def build_variables(row):
+    """
+    Build the variables dictionary of a row.
+
+    Args:
+        row (dict): A row read by load_rows()
+
+    Returns:
+        dict: Dictionary of variables and their replacement values
+    """
+    variables = {key: str(row.get(key) or '').strip() for key in VARIABLE_KEYS}
+    if not variables['entreprise'] or not variables['poste']:
+        raise ValueError("'entreprise' and 'poste' are required")
+
+    for key in SKILL_KEYS:
+        skill = str(row.get(key) or '').strip()
+        if skill and skill not in SKILLS:
+            raise ValueError(f"Unknown skill for {key}: '{skill}'")
+        variables[key] = SKILLS[skill] if skill else ''
+    return variables
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', text).strip('_')[:40] or 'document'
+
+def _write_report(report_path, reports):
+    with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        for report in reports:
+            writer.writerow({
+                'row': report['row'],
+                'entreprise': report['entreprise'],
+                'poste': report['poste'],
+                'status': report['status'],
+                'document_id': report['document_id'] or '',
+                'files': ' '.join(os.path.basename(path) for path in report['files'].values()),
+                'errors': ' | '.join(report['errors']),
+            })
+
+def run_batch(rows, output_dir, templates=None, save=True, max_workers=BATCH_MAX_WORKERS, on_progress=None):
+    """
+    Render every template for every row and package the PDFs in a ZIP.
+
+    Template pipelines of all rows share one bounded thread pool, or with
+    the async transport are all in flight at once on its event loop; Google
+    API quotas and retries are handled by api_scheduler. Rows whose
+    documents were all generated are then saved with a single multi-row
+    INSERT.
+
+    Args:
+        rows (list): Rows read by load_rows()
+        output_dir (str): Directory where the batch directory and ZIP are written
+        templates (list, optional): Templates to render, defaults to TEMPLATES
+        save (bool): Whether to save the successful rows to the database
+        max_workers (int): Maximum number of pipelines run at the same time
+            by the thread pool
+        on_progress (callable, optional): Called with (done, total) after each
+            pipeline, from the calling thread
+
+    Returns:
+        dict: 'reports' (one dict per row), 'zip_path', 'documents' (number
+            of generated PDFs), 'duration' in seconds, 'docs_per_minute' and
+            'quota' (see api_scheduler.get_quota_report())
+    """
+    if templates is None:
+        templates = TEMPLATES
+
+    start = time.monotonic()
+    batch_name = f"batch_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    batch_dir = os.path.join(output_dir, batch_name)
+
+    reports = []
+    tasks = []
+    for index, row in enumerate(rows, start=1):
+        report = {
+            'row': index,
+            'entreprise': str(row.get('entreprise') or ''),
+            'poste': str(row.get('poste') or ''),
+            'status': 'ok',
+            'document_id': None,
+            'files': {},
+            'errors': [],
+            'variables': None,
+        }
+        reports.append(report)
+        try:
+            report['variables'] = build_variables(row)
+        except ValueError as error:
+            report['errors'].append(str(error))
+            continue
+
+        row_dir = os.path.join(batch_dir, f"{index:04d}_{_slug(report['entreprise'])}_{_slug(report['poste'])}")
+        os.makedirs(row_dir, exist_ok=True)
+        for template in templates:
+            tasks.append((report, template, os.path.join(row_dir, template['output_filename'])))
+
+    logger.info(f"Batch {batch_name}: {len(reports)} rows, {len(tasks)} documents to generate")
+
+    done = []
+
+    def finish(task, error):
+        report, template, output_path = task
+        if error is None:
+            report['files'][template['name']] = output_path
+        else:
+            logger.error(f"Batch row {report['row']}: error generating {template['label']}: {error}")
+            report['errors'].append(f"{template['label']}: {error}")
+        done.append(task)
+        if on_progress is not None:
+            on_progress(len(done), len(tasks))
+
+    if tasks and RENDER_BACKEND == 'google' and GOOGLE_API_TRANSPORT == 'async':
+        jobs = [(template['template_id'], report['variables'], output_path) for report, template, output_path in tasks]
+        finished = set()
+
+        def on_done(index, error):
+            finished.add(index)
+            finish(tasks[index], error)
+
+        try:
+            render_templates(jobs, on_done=on_done)
+        except Exception as error:
+            for index, task in enumerate(tasks):
+                if index not in finished:
+                    finish(task, error)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch') as executor:
+            futures = {
+                executor.submit(render_template, template['template_id'], report['variables'], output_path): (report, template, output_path)
+                for report, template, output_path in tasks
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    error = None
+                except Exception as task_error:
+                    error = task_error
+                finish(futures[future], error)
+
+    for report in reports:
+        if report['errors']:
+            report['status'] = 'error'
+
+    successful = [report for report in reports if report['status'] == 'ok']
+    if save and successful:
+        document_ids, errors = save_documents(report['variables'] for report in successful)
+        for index, (report, document_id) in enumerate(zip(successful, document_ids)):
+            report['document_id'] = document_id
+            if index in errors:
+                report['status'] = 'error'
+                report['errors'].append(f"Database insert failed: {errors[index]}")
+
+    os.makedirs(batch_dir, exist_ok=True)
+    report_path = os.path.join(batch_dir, 'report.csv')
+    _write_report(report_path, reports)
+    files = {
+        os.path.relpath(path, output_dir): path
+        for report in reports
+        for path in report['files'].values()
+    }
+    files['report.csv'] = report_path
+    zip_path = write_zip(files, os.path.join(output_dir, f"{batch_name}.zip"))
+
+    duration = time.monotonic() - start
+    documents = sum(len(report['files']) for report in reports)
+    docs_per_minute = documents / duration * 60 if duration > 0 else 0.0
+    logger.info(f"Batch {batch_name}: {documents} documents in {duration:.1f}s ({docs_per_minute:.1f} docs/minute)")
+
+    return {
+        'reports': reports,
+        'zip_path': zip_path,
+        'documents': documents,
+        'duration': duration,
+        'docs_per_minute': docs_per_minute,
+        'quota': get_quota_report(),
+    }
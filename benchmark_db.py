@@ -0,0 +1,66 @@
+"""
+Benchmark of the document insert paths: save_document() called once per row
+against a single save_documents() call.
+
+Usage:
+    python benchmark_db.py [--rows 1000] [--page-size 500] [--keep]
+
+Rows are inserted in the configured database and deleted afterwards unless
+--keep is given.
+"""
+import argparse
+import logging
+import time
+from db_service import init_db, save_document, save_documents, get_connection
+from config import DB_BULK_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+def _make_rows(count, label):
+    return [{
+        "entreprise": f"Benchmark {label} {index}",
+        "poste": "Benchmark",
+        "source": "benchmark_db.py",
+        "identifiant": str(index),
+        "description": "Lorem ipsum dolor sit amet. " * 20,
+        "skills_text": "Python, PostgreSQL",
+    } for index in range(count)]
+
+def _delete(document_ids):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM documents WHERE id = ANY(%s)", ([i for i in document_ids if i is not None],))
+        conn.commit()
+        cur.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-row and bulk document inserts.")
+    parser.add_argument('--rows', type=int, default=1000, help="Number of rows inserted by each path")
+    parser.add_argument('--page-size', type=int, default=DB_BULK_PAGE_SIZE, help="Rows per INSERT for save_documents()")
+    parser.add_argument('--keep', action='store_true', help="Keep the inserted rows")
+    args = parser.parse_args()
+
+    # Keep the per-row INFO logs of save_document() out of the measurement
+    logging.basicConfig(level=logging.WARNING, force=True)
+    init_db()
+
+    rows = _make_rows(args.rows, "single")
+    start = time.perf_counter()
+    single_ids = [save_document(variables) for variables in rows]
+    single_duration = time.perf_counter() - start
+
+    rows = _make_rows(args.rows, "bulk")
+    start = time.perf_counter()
+    bulk_ids, errors = save_documents(rows, page_size=args.page_size)
+    bulk_duration = time.perf_counter() - start
+
+    print(f"save_document  x{args.rows}: {single_duration:.2f}s, {args.rows / single_duration:,.0f} rows/sec")
+    print(f"save_documents x{args.rows}: {bulk_duration:.2f}s, {args.rows / bulk_duration:,.0f} rows/sec "
+          f"(page size {args.page_size}, {len(errors)} rejected)")
+    print(f"Speedup: {single_duration / bulk_duration:.1f}x")
+
+    if not args.keep:
+        _delete(single_ids + bulk_ids)
+
+if __name__ == "__main__":
+    main()
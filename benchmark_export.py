@@ -0,0 +1,83 @@
+"""
+Benchmark of the PDF export memory footprint: the whole export buffered in
+memory (the former request.execute() path) against export_as_pdf(), which
+streams it to disk.
+
+Usage:
+    python benchmark_export.py [--document-id ID] [--runs 3]
+
+Each mode runs in its own process so that peak RSS values are comparable.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+
+def _run_mode(mode, document_id, runs):
+    # Imported here so the parent process does not load the Google client
+    from google_api import get_drive_service
+    from pdf_service import export_as_pdf
+
+    # Build the client before measuring, it is shared by both modes
+    get_drive_service()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, 'export.pdf')
+        for _ in range(runs):
+            if mode == 'buffered':
+                request = get_drive_service().files().export_media(fileId=document_id, mimeType='application/pdf')
+                with open(output_path, 'wb') as f:
+                    f.write(request.execute())
+            else:
+                export_as_pdf(document_id, output_path)
+            size = os.path.getsize(output_path)
+    duration = (time.perf_counter() - start) / runs
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({
+        'mode': mode,
+        'size': size,
+        'seconds_per_export': duration,
+        'python_peak_bytes': peak,
+        # ru_maxrss is in kilobytes on Linux
+        'rss_growth_bytes': (rss_after - rss_before) * 1024,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare buffered and streamed PDF export memory usage.")
+    parser.add_argument('--document-id', help="Google Doc to export, defaults to the CV template DOCUMENT_ID")
+    parser.add_argument('--runs', type=int, default=3, help="Exports per mode")
+    parser.add_argument('--mode', choices=['buffered', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.document_id is None:
+        from config import DOCUMENT_ID
+        args.document_id = DOCUMENT_ID
+
+    if args.mode:
+        _run_mode(args.mode, args.document_id, args.runs)
+        return
+
+    for mode in ('buffered', 'streaming'):
+        completed = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--document-id', args.document_id, '--runs', str(args.runs)],
+            capture_output=True, text=True, check=True,
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"{mode:>9}: {result['size'] / 1024:,.0f} KiB PDF, {result['seconds_per_export']:.2f}s/export, "
+              f"Python peak {result['python_peak_bytes'] / 1024:,.0f} KiB, "
+              f"RSS growth {result['rss_growth_bytes'] / 1024:,.0f} KiB")
+
+if __name__ == "__main__":
+    main()
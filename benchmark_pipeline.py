@@ -0,0 +1,363 @@
+"""
+End-to-end benchmark of the generation pipelines, run offline.
+
+Usage:
+    python benchmark_pipeline.py [--runs 20] [--concurrency 4] [--batch-rows 20]
+                                 [--latency-ms 50] [--jitter-ms 20] [--rate-limit-ratio 0.02]
+                                 [--postgres docker|server] [--trace] [--json]
+
+The Google APIs are replaced by fake_google_server.py, started in its own
+process with the given latency and 429 injection, and the database by a
+disposable Postgres: a postgres container (--postgres docker, the default)
+or a temporary database created on the DB_* server (--postgres server).
+Both are removed at the end.
+
+Three scenarios are measured with the real application code, after a
+first cold generation:
+    cold        the first generation of the process, which also builds the
+                clients, looks up the template revisions and discovers the
+                placeholders (one more documents.get round trip)
+    single      generations one after the other (generate_documents)
+    concurrent  --concurrency generations at a time (generate_documents)
+    batch       one run_batch() of --batch-rows rows
+
+For each, the p50/p95/p99 latency of a generation, the documents per second,
+the API calls served by the fake server and the batchUpdate payload bytes
+per document are reported; --no-placeholder-discovery sends every variable
+to compare payloads. The scheduler
+quotas are lifted unless --real-quotas is given, so that the numbers measure
+the code rather than the rate limits; the render cache and the copy pool are
+disabled. With --trace, the time spent in each step (API method, database
+query, render) is reported too, from the tracing histograms.
+"""
+import os
+import sys
+import json
+import time
+import math
+import uuid
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+POSTGRES_IMAGE = 'postgres:14'
+POSTGRES_PASSWORD = 'benchmark'
+
+# Templates served by the fake server
+CV_TEMPLATE_ID = 'benchmark-cv-template'
+COVER_LETTER_TEMPLATE_ID = 'benchmark-cover-letter-template'
+
+def _percentile(values, percent):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+def _variables(index):
+    return {
+        'entreprise': f'Entreprise {index}',
+        'poste': 'Développeur Python',
+        'base_line': 'Développeur backend',
+        'source': 'benchmark',
+        'identifiant': f'BENCH-{index}',
+        'url': f'https://example.com/offres/{index}',
+        'salaire': '50k',
+        'description': 'Offre générée par benchmark_pipeline.py',
+        'skills_text': '',
+        **{f'skill{number}': f'Compétence {number}' for number in range(1, 7)},
+    }
+
+def start_fake_server(args):
+    """
+    Start fake_google_server.py in its own process.
+
+    Returns:
+        tuple: (process, root URL)
+    """
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_google_server.py'),
+        '--port', '0',
+        '--latency-ms', str(args.latency_ms),
+        '--jitter-ms', str(args.jitter_ms),
+        '--rate-limit-ratio', str(args.rate_limit_ratio),
+        '--pdf-kb', str(args.pdf_kb),
+    ]
+    if args.retry_after is not None:
+        command += ['--retry-after', str(args.retry_after)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("The fake Google server did not start")
+    return process, url
+
+def _server_call(url, path, method='GET'):
+    with urllib.request.urlopen(urllib.request.Request(url + path, method=method)) as response:
+        content = response.read()
+    return json.loads(content) if content else None
+
+def _wait_for_postgres(dsn, timeout):
+    import psycopg2
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            psycopg2.connect(**dsn).close()
+            return
+        except psycopg2.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+def start_postgres(mode):
+    """
+    Create a disposable database and point the DB_* variables at it.
+
+    Args:
+        mode (str): 'docker' to run a postgres container, 'server' to create
+            a temporary database on the server of the DB_* variables
+
+    Returns:
+        callable: Removes the database
+    """
+    if mode == 'docker':
+        container = subprocess.run(
+            ['docker', 'run', '-d', '--rm', '-e', f'POSTGRES_PASSWORD={POSTGRES_PASSWORD}',
+             '-e', 'POSTGRES_DB=postulator', '-p', '127.0.0.1::5432', POSTGRES_IMAGE],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+
+        def remove():
+            subprocess.run(['docker', 'stop', container], capture_output=True)
+
+        try:
+            port = subprocess.run(['docker', 'port', container, '5432/tcp'], capture_output=True, text=True,
+                                  check=True).stdout.splitlines()[0].rsplit(':', 1)[1]
+            os.environ.update(DB_HOST='127.0.0.1', DB_PORT=port, DB_NAME='postulator',
+                              DB_USER='postgres', DB_PASSWORD=POSTGRES_PASSWORD)
+            _wait_for_postgres({'host': '127.0.0.1', 'port': port, 'dbname': 'postulator',
+                                'user': 'postgres', 'password': POSTGRES_PASSWORD}, timeout=60)
+        except BaseException:
+            remove()
+            raise
+        return remove
+
+    import psycopg2
+    # Same defaults as config.py, which cannot be imported before DB_NAME is set
+    dsn = {
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'port': os.environ.get('DB_PORT', '5432'),
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'password': os.environ.get('DB_PASSWORD', 'postulator_password'),
+        'dbname': 'postgres',
+    }
+    database = f'postulator_benchmark_{uuid.uuid4().hex[:8]}'
+
+    def execute(statement):
+        conn = psycopg2.connect(**dsn)
+        conn.autocommit = True
+        try:
+            conn.cursor().execute(statement)
+        finally:
+            conn.close()
+
+    execute(f'CREATE DATABASE {database}')
+    os.environ['DB_NAME'] = database
+    return lambda: execute(f'DROP DATABASE IF EXISTS {database}')
+
+def configure(args, server_url, work_dir):
+    """
+    Point the application at the fake server and the work directory.
+
+    Must run before the application modules are imported.
+    """
+    token_file = os.path.join(work_dir, 'token.json')
+    with open(token_file, 'w') as f:
+        # Never expires, so it is never refreshed against the real Google
+        json.dump({'token': 'benchmark', 'refresh_token': 'benchmark', 'client_id': 'benchmark',
+                   'client_secret': 'benchmark', 'expiry': '2099-01-01T00:00:00Z'}, f)
+
+    os.environ.update(
+        GOOGLE_API_ENDPOINT=server_url,
+        TOKEN_FILE=token_file,
+        DOCUMENT_ID=CV_TEMPLATE_ID,
+        OUTPUT_FILENAME='CV.pdf',
+        COVER_LETTER_DOCUMENT_ID=COVER_LETTER_TEMPLATE_ID,
+        COVER_LETTER_OUTPUT_FILENAME='Lettre_de_motivation.pdf',
+        OUTPUT_DIR=os.path.join(work_dir, 'output'),
+        RENDER_BACKEND='google',
+        RENDER_CACHE_ENABLED='false',
+        COPY_POOL_SIZE='0',
+        GOOGLE_API_TRANSPORT=args.transport,
+        BATCH_HTTP_REQUESTS='true' if args.batch_http else 'false',
+        TRACING_ENABLED='true' if args.trace else 'false',
+        PLACEHOLDER_DISCOVERY='true' if args.placeholder_discovery else 'false',
+    )
+    os.environ.setdefault('CREDENTIALS_JSON', '{}')
+    if not args.real_quotas:
+        for name in ('API_RATE_DRIVE_WRITE', 'API_RATE_DRIVE_READ', 'API_RATE_DOCS_WRITE', 'API_RATE_DOCS_READ'):
+            os.environ[name] = '100000'
+        os.environ['API_BURST'] = '100000'
+
+def _timed_generation(index):
+    from generation_service import generate_documents, DATABASE_RESULT
+    from output_service import create_output_dir
+
+    start = time.perf_counter()
+    results = generate_documents(_variables(index), create_output_dir())
+    duration = time.perf_counter() - start
+    errors = [str(task['error']) for task in results.values() if task['error'] is not None]
+    # The database insert is a task too, but not a document
+    documents = sum(1 for name, task in results.items() if name != DATABASE_RESULT and task['error'] is None)
+    return duration, documents, errors
+
+def run_generations(runs, concurrency):
+    """
+    Run generations, concurrency at a time.
+
+    Returns:
+        dict: 'latencies', 'documents', 'errors' and wall-clock 'duration'
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(_timed_generation, range(runs)))
+    return {
+        'latencies': [duration for duration, _, _ in outcomes],
+        'documents': sum(documents for _, documents, _ in outcomes),
+        'errors': [error for _, _, errors in outcomes for error in errors],
+        'duration': time.perf_counter() - start,
+    }
+
+def run_batch_scenario(rows):
+    """
+    Run one batch of rows through batch_service.run_batch().
+
+    Returns:
+        dict: 'latencies' (empty: the batch is measured as a whole),
+            'documents', 'errors' and 'duration'
+    """
+    from batch_service import run_batch
+    from output_service import create_output_dir
+
+    result = run_batch([_variables(index) for index in range(rows)], create_output_dir())
+    return {
+        'latencies': [],
+        'documents': result['documents'],
+        'errors': [error for report in result['reports'] for error in report['errors']],
+        'duration': result['duration'],
+    }
+
+def summarize(name, outcome, stats, steps):
+    latencies = outcome['latencies']
+    summary = {
+        'scenario': name,
+        'generations': len(latencies),
+        'documents': outcome['documents'],
+        'errors': len(outcome['errors']),
+        'duration': outcome['duration'],
+        'docs_per_second': outcome['documents'] / outcome['duration'] if outcome['duration'] > 0 else 0.0,
+        'api_calls': sum(stats['calls'].values()),
+        'round_trips': stats['round_trips'],
+        'rate_limited': stats['rate_limited'],
+        'request_bytes': sum(stats['request_bytes'].values()),
+        'update_bytes': stats['request_bytes'].get('docs.documents.batchUpdate', 0),
+        'update_bytes_per_document': (stats['request_bytes'].get('docs.documents.batchUpdate', 0) / outcome['documents']
+                                      if outcome['documents'] else 0.0),
+        'steps': {
+            step: {'count': histogram['count'], 'mean': histogram['mean'], 'max': histogram['max']}
+            for step, histogram in steps.items()
+        },
+    }
+    for percent in (50, 95, 99):
+        summary[f'p{percent}'] = _percentile(latencies, percent) if latencies else None
+    return summary
+
+def _format_seconds(value):
+    return f"{value * 1000:8.0f}ms" if value is not None else f"{'-':>10}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipelines against a fake Google API.")
+    parser.add_argument('--runs', type=int, default=20, help="Generations of the single and concurrent scenarios")
+    parser.add_argument('--concurrency', type=int, default=4, help="Generations at a time in the concurrent scenario")
+    parser.add_argument('--batch-rows', type=int, default=20, help="Rows of the batch scenario")
+    parser.add_argument('--scenarios', default='single,concurrent,batch', help="Comma-separated scenarios to run")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Latency of each fake API round trip")
+    parser.add_argument('--jitter-ms', type=float, default=20, help="Maximum random latency added to each round trip")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Share of API calls failing with 429")
+    parser.add_argument('--retry-after', type=float, help="Retry-After of the injected 429s, in seconds")
+    parser.add_argument('--pdf-kb', type=int, default=64, help="Size of the exported PDFs")
+    parser.add_argument('--transport', choices=['httplib2', 'async'], default='httplib2', help="Google API transport")
+    parser.add_argument('--no-batch-http', dest='batch_http', action='store_false', help="Disable HTTP batch requests")
+    parser.add_argument('--no-placeholder-discovery', dest='placeholder_discovery', action='store_false',
+                        help="Send every variable instead of the ones the templates use")
+    parser.add_argument('--real-quotas', action='store_true', help="Keep the configured scheduler quotas")
+    parser.add_argument('--postgres', choices=['docker', 'server'], default='docker',
+                        help="Run a postgres container or use a temporary database on the DB_* server")
+    parser.add_argument('--trace', action='store_true', help="Report the time spent in each step")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='postulator-benchmark-')
+    server, server_url = start_fake_server(args)
+    remove_database = None
+    try:
+        remove_database = start_postgres(args.postgres)
+        configure(args, server_url, work_dir)
+
+        from db_service import init_db, close_pool
+        import tracing
+        init_db()
+
+        scenarios = {
+            'single': lambda: run_generations(args.runs, 1),
+            'concurrent': lambda: run_generations(args.runs, args.concurrency),
+            'batch': lambda: run_batch_scenario(args.batch_rows),
+        }
+        # One generation first, so that client building, imports and
+        # placeholder discovery are not measured by the scenarios
+        _server_call(server_url, '/_reset', 'POST')
+        tracing.reset()
+        outcome = run_generations(1, 1)
+        summaries = [summarize('cold', outcome, _server_call(server_url, '/_stats'), tracing.get_histograms())]
+        for name in args.scenarios.split(','):
+            _server_call(server_url, '/_reset', 'POST')
+            tracing.reset()
+            outcome = scenarios[name.strip()]()
+            summaries.append(summarize(name.strip(), outcome, _server_call(server_url, '/_stats'), tracing.get_histograms()))
+            if outcome['errors']:
+                print(f"{name}: {len(outcome['errors'])} errors, first: {outcome['errors'][0]}", file=sys.stderr)
+        close_pool()
+    finally:
+        server.terminate()
+        server.wait()
+        if remove_database is not None:
+            remove_database()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return 0
+
+    print(f"Fake API latency {args.latency_ms:.0f}ms +{args.jitter_ms:.0f}ms, 429 ratio {args.rate_limit_ratio}, "
+          f"transport {args.transport}, batch requests {'on' if args.batch_http else 'off'}, "
+          f"placeholder discovery {'on' if args.placeholder_discovery else 'off'}")
+    print(f"{'scenario':<11} {'gens':>5} {'docs':>5} {'errors':>6} {'p50':>10} {'p95':>10} {'p99':>10} "
+          f"{'docs/s':>7} {'calls':>6} {'trips':>6} {'429s':>5} {'upd B/doc':>9}")
+    for summary in summaries:
+        print(f"{summary['scenario']:<11} {summary['generations']:>5} {summary['documents']:>5} {summary['errors']:>6} "
+              f"{_format_seconds(summary['p50'])} {_format_seconds(summary['p95'])} {_format_seconds(summary['p99'])} "
+              f"{summary['docs_per_second']:>7.2f} {summary['api_calls']:>6} {summary['round_trips']:>6} "
+              f"{summary['rate_limited']:>5} {summary['update_bytes_per_document']:>9.0f}")
+    if args.placeholder_discovery:
+        print("cold: includes one documents.get round trip discovering the placeholders of the template revisions")
+    for summary in summaries:
+        if summary['steps']:
+            print(f"\n{summary['scenario']} steps:")
+            print(f"  {'step':<36} {'count':>6} {'mean':>10} {'max':>10}")
+            for step, timing in summary['steps'].items():
+                print(f"  {step:<36} {timing['count']:>6} {_format_seconds(timing['mean'])} {_format_seconds(timing['max'])}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Benchmark of the import time of the Streamlit app modules.
+
+Usage:
+    python benchmark_startup.py [--runs 3] [--top 15] [--budget-ms 1000]
+
+Imports the modules app.py imports in a fresh interpreter with
+`python -X importtime`, reports the slowest top-level imports and checks
+that pandas and googleapiclient.discovery stay off the startup path. Exits
+with status 1 when the best run exceeds the budget or a lazy module was
+imported.
+"""
+import sys
+import argparse
+import subprocess
+
+# Modules imported by app.py at startup (streamlit excepted, it imports app.py)
+APP_MODULES = ['generation_service', 'batch_service', 'google_api', 'db_service', 'copy_pool', 'config', 'skills_config']
+# Modules that must only be imported when first needed
+LAZY_MODULES = ['pandas', 'googleapiclient.discovery', 'httpx']
+
+def _import_times(modules):
+    """
+    Import modules in a fresh interpreter.
+
+    Returns:
+        list: (module, self microseconds, cumulative microseconds, depth)
+            tuples in import order
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the Streamlit app modules.")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters to measure, the best run is kept")
+    parser.add_argument('--top', type=int, default=15, help="Number of slowest top-level imports to show")
+    parser.add_argument('--budget-ms', type=float, default=1000, help="Maximum import time of the app modules")
+    args = parser.parse_args()
+
+    runs = [_import_times(APP_MODULES) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: sum(self_us for _, self_us, _, _ in times))
+    total_ms = sum(self_us for _, self_us, _, _ in best) / 1000
+
+    print(f"Slowest top-level imports (best of {args.runs} runs):")
+    top_level = sorted((entry for entry in best if entry[3] == 0), key=lambda entry: entry[2], reverse=True)
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    imported = {name for name, _, _, _ in best}
+    eager = [module for module in LAZY_MODULES if module in imported]
+    for module in LAZY_MODULES:
+        print(f"{'✗' if module in eager else '✓'} {module} {'imported at startup' if module in eager else 'not imported at startup'}")
+
+    within_budget = total_ms <= args.budget_ms
+    print(f"{'✓' if within_budget else '✗'} Total import time: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    return 0 if within_budget and not eager else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -62,3 +62,142 @@ logger.info(f"Database configuration: Host={DB_HOST}, Port={DB_PORT}, Name={DB_N
 
 # Database connection string
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Database connection pool configuration: MIN connections are opened upfront,
+# and up to MAX returned connections are kept open for reuse
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+# Idle connections older than this (seconds) are pinged before being handed out
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+
+# Maximum number of document pipelines (and database inserts) run in parallel
+GENERATION_MAX_WORKERS = int(os.environ.get('GENERATION_MAX_WORKERS', '4'))
+
+# Re-read documents through the Docs API to double check template protection.
+# Off by default: the checks are then done on the Drive copy response only.
+STRICT_TEMPLATE_CHECKS = os.environ.get('STRICT_TEMPLATE_CHECKS', 'false').lower() in ('1', 'true', 'yes')
+
+# Directory where generated PDFs are written
+OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'output')
+
+# Render cache: generated PDFs keyed on template revision + variables
+RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(OUTPUT_DIR, 'cache'))
+# Total size of cached PDFs before least recently used entries are evicted
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+# Seconds a template revision lookup is trusted before asking Drive again
+RENDER_CACHE_REVISION_TTL = float(os.environ.get('RENDER_CACHE_REVISION_TTL', '30'))
+
+# Rendering backend: 'google' fills a Drive copy of the template and exports
+# it, 'local' fills a cached DOCX export of the template and converts it to
+# PDF with LibreOffice
+RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'google').lower()
+if RENDER_BACKEND not in ('google', 'local'):
+    raise ValueError(f"Invalid RENDER_BACKEND '{RENDER_BACKEND}', expected 'google' or 'local'")
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(OUTPUT_DIR, 'templates'))
+# Seconds the export of a previous template revision is kept once a newer one
+# exists, so that renders still reading it, in any process, can finish
+TEMPLATE_CACHE_TTL = float(os.environ.get('TEMPLATE_CACHE_TTL', '600'))
+LIBREOFFICE_BINARY = os.environ.get('LIBREOFFICE_BINARY', 'soffice')
+# Seconds allowed for one LibreOffice conversion
+LIBREOFFICE_TIMEOUT = float(os.environ.get('LIBREOFFICE_TIMEOUT', '60'))
+
+# Batch generation: parallel template pipelines
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '4'))
+
+# Rows sent per INSERT statement by db_service.save_documents()
+DB_BULK_PAGE_SIZE = int(os.environ.get('DB_BULK_PAGE_SIZE', '500'))
+
+# Number of applications shown per page in the "Candidatures" tab
+DOCUMENTS_PAGE_SIZE = int(os.environ.get('DOCUMENTS_PAGE_SIZE', '50'))
+# Seconds the documents change marker is trusted before asking the database
+# again; inserts made by this process invalidate it immediately
+DOCUMENTS_MARKER_TTL = float(os.environ.get('DOCUMENTS_MARKER_TTL', '5'))
+
+# Maximum number of results returned by the full-text search
+SEARCH_RESULTS_LIMIT = int(os.environ.get('SEARCH_RESULTS_LIMIT', '20'))
+
+# Bytes requested per chunk when downloading exports from Drive
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+
+# Transport of the Google API calls: 'httplib2' (googleapiclient, one blocking
+# keep-alive connection per thread) or 'async' (one asyncio event loop with a
+# shared HTTP/2 connection pool, see async_google_api)
+GOOGLE_API_TRANSPORT = os.environ.get('GOOGLE_API_TRANSPORT', 'httplib2').lower()
+if GOOGLE_API_TRANSPORT not in ('httplib2', 'async'):
+    raise ValueError(f"Invalid GOOGLE_API_TRANSPORT '{GOOGLE_API_TRANSPORT}', expected 'httplib2' or 'async'")
+# Maximum number of connections of the async transport
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', '20'))
+# Seconds before an async Google API request times out
+ASYNC_REQUEST_TIMEOUT = float(os.environ.get('ASYNC_REQUEST_TIMEOUT', '60'))
+# Root URL serving both the Drive and Docs APIs instead of Google, e.g. the
+# fake server of fake_google_server.py (empty: the real Google endpoints)
+GOOGLE_API_ENDPOINT = os.environ.get('GOOGLE_API_ENDPOINT', '').rstrip('/')
+
+# Google API request scheduler: sustained requests per second per user and
+# bucket (Drive allows ~3 sustained writes/s, Docs 60 writes/min and 300
+# reads/min per user), burst size, in-flight requests per API and retries
+API_RATE_DRIVE_WRITE = float(os.environ.get('API_RATE_DRIVE_WRITE', '3'))
+API_RATE_DRIVE_READ = float(os.environ.get('API_RATE_DRIVE_READ', '20'))
+API_RATE_DOCS_WRITE = float(os.environ.get('API_RATE_DOCS_WRITE', '1'))
+API_RATE_DOCS_READ = float(os.environ.get('API_RATE_DOCS_READ', '5'))
+API_BURST = int(os.environ.get('API_BURST', '10'))
+API_MAX_CONCURRENCY = int(os.environ.get('API_MAX_CONCURRENCY', '8'))
+API_MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', '5'))
+# Cap of the exponential backoff between retries, in seconds
+API_MAX_BACKOFF = float(os.environ.get('API_MAX_BACKOFF', '32'))
+
+# Pre-made template copies kept per template so that files.copy is off the
+# critical path of a generation (0 disables the pool)
+COPY_POOL_SIZE = int(os.environ.get('COPY_POOL_SIZE', '2'))
+# Seconds after which a leftover Copy_<timestamp> file is deleted by the
+# janitor; pooled copies are renewed after half of it
+COPY_MAX_AGE = float(os.environ.get('COPY_MAX_AGE', '3600'))
+# Seconds between two janitor runs of the copy pool
+COPY_JANITOR_INTERVAL = float(os.environ.get('COPY_JANITOR_INTERVAL', '600'))
+
+# Coalesce the independent Google API calls of a generation (copies,
+# batchUpdates, deletes of every template) into HTTP batch requests
+BATCH_HTTP_REQUESTS = os.environ.get('BATCH_HTTP_REQUESTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Read the placeholders of each template revision once and only send the
+# replaceAllText requests of the variables the template uses
+PLACEHOLDER_DISCOVERY = os.environ.get('PLACEHOLDER_DISCOVERY', 'true').lower() in ('1', 'true', 'yes')
+
+# OAuth token written by `python auth.py` and refreshed by the application
+TOKEN_FILE = os.environ.get('TOKEN_FILE', 'token.json')
+# Seconds before expiry at which the access token is refreshed in the background
+TOKEN_REFRESH_MARGIN = float(os.environ.get('TOKEN_REFRESH_MARGIN', '300'))
+
+# Every generation writes to its own directory under GENERATIONS_DIR, removed
+# once older than OUTPUT_TTL seconds
+GENERATIONS_DIR = os.environ.get('GENERATIONS_DIR', os.path.join(OUTPUT_DIR, 'generations'))
+OUTPUT_TTL = float(os.environ.get('OUTPUT_TTL', '3600'))
+# Name of the ZIP bundling the documents of a generation
+BUNDLE_FILENAME = os.environ.get('BUNDLE_FILENAME', 'candidature.zip')
+
+# Background job queue: when enabled, the app enqueues generations in the
+# database and worker.py processes run them
+JOB_QUEUE_ENABLED = os.environ.get('JOB_QUEUE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Worker processes started by worker.py
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', '2'))
+# Seconds a worker waits before looking for a job again when the queue is empty
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+# Seconds between two heartbeats of the worker running a job
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '10'))
+# Seconds without heartbeat after which a running job is considered abandoned
+# by a dead worker
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', '60'))
+# Attempts of a job before it is marked as failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+# Tracing of the pipeline steps, see tracing.py. Off by default: a disabled
+# span costs one flag check
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# JSON lines file the finished spans are appended to (empty: not exported)
+TRACING_EXPORT_FILE = os.environ.get('TRACING_EXPORT_FILE', '')
+# Port of the Prometheus /metrics endpoint of the span histograms (0: not
+# served); worker process N of worker.py listens on this port + N
+TRACING_METRICS_PORT = int(os.environ.get('TRACING_METRICS_PORT', '0'))
@@ -0,0 +1,169 @@
+"""
+Pool of pre-made template copies.
+
+files.copy is the slowest step of the Google pipeline. A background thread
+keeps COPY_POOL_SIZE ready copies of every template in use, so that
+document_service.create_document_copy() hands one out without waiting for
+Drive. Copies are tagged with the template revision they were made from and
+dropped as soon as the template changes.
+
+Only the long-lived processes start the pool, with warm(): app.py and
+worker.py. In the other ones (batch.py, the benchmarks, the tests), take()
+finds no pool and the copies are made on demand, so short-lived processes
+never make copies only to trash them at exit.
+
+The same thread runs the janitor, which deletes Copy_<timestamp> documents
+left behind by crashed processes once they are older than COPY_MAX_AGE.
+Pooled copies are renewed after half of that age, so the janitor of another
+process never deletes a copy that is still pooled.
+"""
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from document_service import create_document_copy, delete_document, delete_documents
+from janitor import reclaim_copies
+from render_cache import get_template_revision
+from config import COPY_POOL_SIZE, COPY_MAX_AGE, COPY_JANITOR_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# template ID -> deque of (copy ID, template revision, creation time)
+_pools = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_thread = None
+_last_janitor_run = None
+
+def _ensure_started():
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='copy-pool', daemon=True)
+            _thread.start()
+            atexit.register(drain)
+
+def warm(template_ids):
+    """
+    Start keeping ready copies of templates, starting the pool thread and
+    its exit drain on first call.
+
+    Args:
+        template_ids (list): IDs of the Google Doc templates
+    """
+    if COPY_POOL_SIZE <= 0:
+        return
+    with _lock:
+        for template_id in template_ids:
+            _pools.setdefault(template_id, deque())
+    _ensure_started()
+    _wakeup.set()
+
+def take(template_id):
+    """
+    Take a ready copy of a template.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+
+    Returns:
+        str: The ID of a copy of the current template revision, or None if
+            the pool of the template is empty or was never warmed
+    """
+    with _lock:
+        if template_id not in _pools:
+            return None
+    revision = get_template_revision(template_id)
+    now = time.time()
+    copy_id = None
+    stale = []
+    with _lock:
+        pool = _pools[template_id]
+        while pool:
+            candidate, candidate_revision, created = pool.popleft()
+            if candidate_revision == revision and now - created < COPY_MAX_AGE / 2:
+                copy_id = candidate
+                break
+            stale.append(candidate)
+    _wakeup.set()
+
+    for stale_id in stale:
+        _delete(stale_id)
+    if copy_id is None:
+        logger.info(f"Copy pool of template {template_id} is empty")
+    return copy_id
+
+def _delete(copy_id):
+    try:
+        delete_document(copy_id)
+    except Exception as error:
+        # Left to the janitor
+        logger.warning(f"Could not delete copy {copy_id}: {error}")
+
+def _refill(template_id):
+    revision = get_template_revision(template_id)
+    now = time.time()
+    with _lock:
+        pool = _pools[template_id]
+        stale = [entry for entry in pool if entry[1] != revision or now - entry[2] >= COPY_MAX_AGE / 2]
+        for entry in stale:
+            pool.remove(entry)
+        missing = COPY_POOL_SIZE - len(pool)
+
+    for copy_id, _, _ in stale:
+        _delete(copy_id)
+
+    for _ in range(missing):
+        copy_id = create_document_copy(template_id, use_pool=False)
+        with _lock:
+            _pools[template_id].append((copy_id, revision, time.time()))
+    if missing > 0:
+        logger.info(f"Copy pool of template {template_id} refilled with {missing} copies")
+
+def _pooled_ids():
+    with _lock:
+        return {copy_id for pool in _pools.values() for copy_id, _, _ in pool}
+
+def run_janitor(max_age=COPY_MAX_AGE):
+    """
+    Delete the Copy_<timestamp> documents older than max_age, except the
+    pooled ones.
+
+    Args:
+        max_age (float): Minimum age of the deleted copies, in seconds
+
+    Returns:
+        int: Number of deleted copies
+    """
+    return reclaim_copies(max_age, exclude=_pooled_ids())['reclaimed']
+
+def _run():
+    global _last_janitor_run
+    while True:
+        _wakeup.wait(timeout=min(COPY_JANITOR_INTERVAL, COPY_MAX_AGE / 4))
+        _wakeup.clear()
+        with _lock:
+            template_ids = list(_pools)
+        for template_id in template_ids:
+            try:
+                _refill(template_id)
+            except Exception as error:
+                logger.error(f"Error refilling the copy pool of template {template_id}: {error}")
+
+        if _last_janitor_run is None or time.monotonic() - _last_janitor_run >= COPY_JANITOR_INTERVAL:
+            _last_janitor_run = time.monotonic()
+            try:
+                run_janitor()
+            except Exception as error:
+                logger.error(f"Error running the copy janitor: {error}")
+
+def drain():
+    """
+    Delete every pooled copy, e.g. when the process exits.
+    """
+    with _lock:
+        copies = [copy_id for pool in _pools.values() for copy_id, _, _ in pool]
+        for pool in _pools.values():
+            pool.clear()
+    delete_documents(copies)
@@ -2,15 +2,85 @@
 Database service for storing and retrieving document data.
 """
 import os
+import re
+import threading
+import time
+from itertools import islice
+from contextlib import contextmanager
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import logging
-from config import DATABASE_URL
+import tracing
+from config import (
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_INTERVAL,
+    DB_BULK_PAGE_SIZE,
+    DOCUMENTS_PAGE_SIZE,
+    DOCUMENTS_MARKER_TTL,
+    SEARCH_RESULTS_LIMIT,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-wide connection pool. Streamlit re-executes app.py on every rerun but
+# keeps imported modules in sys.modules, so this pool is shared by all reruns
+# and sessions served by the same process.
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of blocking when exhausted, so a
+# semaphore sized to the pool makes callers wait for a free connection.
+_pool_slots = None
+# Connection id -> last time it was returned to the pool, for the connections
+# the pool holds idle
+_last_used = {}
+_pool_stats = {
+    'checkouts': 0,
+    'hits': 0,
+    'misses': 0,
+    'reconnects': 0,
+    'waits': 0,
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0,
+    'timeouts': 0,
+}
+_stats_lock = threading.Lock()
+
+# Bumped by every insert made by this process, see get_documents_marker()
+_documents_version = 0
+# (marker, time it was fetched, _documents_version it was fetched at)
+_documents_marker = None
+_marker_lock = threading.Lock()
+
+class _KeepAlivePool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool keeping up to maxconn idle connections open.
+
+    The base pool closes a returned connection as soon as it holds minconn
+    idle ones, so every checkout beyond minconn opened a new connection.
+    Raising minconn instead would open every connection upfront.
+    """
+
+    def _putconn(self, conn, key=None, close=False):
+        # Called with the pool lock held, see ThreadedConnectionPool.putconn()
+        minconn = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+        if any(pooled is conn for pooled in self._pool):
+            _last_used[id(conn)] = time.monotonic()
+        else:
+            # Closed: a later connection may get the same id()
+            _last_used.pop(id(conn), None)
+
 def get_database_url():
     """
     Get the database URL based on the environment.
@@ -31,73 +101,208 @@ def get_database_url():
 
     return db_url
 
-def init_db():
+def get_pool():
+    """
+    Get the process-wide connection pool, creating it on first use.
+
+    Returns:
+        ThreadedConnectionPool: The shared connection pool
     """
-    Initialize the database by creating the necessary tables if they don't exist.
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logger.info(f"Creating database connection pool (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+                _pool = _KeepAlivePool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, get_database_url())
+    return _pool
+
+def close_pool():
+    """
+    Close every connection held by the pool and discard it.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _pool_slots = None
+            _last_used.clear()
+            logger.info("Database connection pool closed")
+
+def get_pool_stats():
+    """
+    Get the connection pool counters, useful to size the pool under load.
+
+    A hit is a checkout served by a connection that was used before, a miss
+    is the first checkout of a freshly opened connection. Wait times are in
+    seconds.
+
+    Returns:
+        dict: Pool counters and configured sizes
+    """
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    stats['min_size'] = DB_POOL_MIN_SIZE
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+    return stats
+
+def _record_stat(name, value=1):
+    with _stats_lock:
+        _pool_stats[name] += value
+
+def _is_healthy(conn):
+    """
+    Check that a pooled connection is still usable.
+
+    Connections that were used recently are trusted; older ones are pinged so
+    sockets dropped by the server or a proxy are detected before use.
     """
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < DB_POOL_HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+        logger.warning(f"Discarding stale database connection: {error}")
+        return False
+
+@tracing.traced('db.pool_wait')
+def _acquire_slot():
+    if _pool_slots.acquire(blocking=False):
+        return
+    start = time.monotonic()
+    acquired = _pool_slots.acquire(timeout=DB_POOL_TIMEOUT)
+    waited = time.monotonic() - start
+    with _stats_lock:
+        _pool_stats['waits'] += 1
+        _pool_stats['wait_time_total'] += waited
+        _pool_stats['wait_time_max'] = max(_pool_stats['wait_time_max'], waited)
+        if not acquired:
+            _pool_stats['timeouts'] += 1
+    if not acquired:
+        raise PoolError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+
+@contextmanager
+def get_connection():
+    """
+    Check a connection out of the shared pool.
+
+    The connection is health-checked on checkout, reconnected if its socket
+    went stale, rolled back if the block raises and always returned to the
+    pool afterwards.
+
+    Yields:
+        connection: An open psycopg2 connection
+    """
+    pool = get_pool()
+    _acquire_slot()
     conn = None
     try:
-        # Get the database URL
-        db_url = get_database_url()
+        conn = pool.getconn()
+        reused = id(conn) in _last_used
+        while reused and not _is_healthy(conn):
+            # Stale socket: drop it and let the pool hand out (or open) another one
+            pool.putconn(conn, close=True)
+            conn = None
+            _record_stat('reconnects')
+            conn = pool.getconn()
+            reused = id(conn) in _last_used
+        _record_stat('hits' if reused else 'misses')
+        _record_stat('checkouts')
+
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=conn.closed)
+        _pool_slots.release()
 
-        # Connect to the database
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
+@tracing.traced('db.init')
+def init_db():
+    """
+    Initialize the database by applying the pending schema migrations.
 
-        # Create documents table if it doesn't exist
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS documents (
-                id SERIAL PRIMARY KEY,
-                entreprise TEXT NOT NULL,
-                poste TEXT NOT NULL,
-                source TEXT,
-                identifiant TEXT,
-                base_line TEXT,
-                salaire TEXT,
-                description TEXT,
-                skills_text TEXT,
-                skill1 TEXT,
-                skill2 TEXT,
-                skill3 TEXT,
-                skill4 TEXT,
-                skill5 TEXT,
-                skill6 TEXT,
-                url TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    When the schema is current this costs a single query, see migration_service.
 
-        # Check for all required columns and add them if they don't exist
-        required_columns = ['entreprise', 'poste', 'source', 'identifiant', 'base_line', 'salaire', 'description', 'skills_text', 'skill1', 'skill2', 'skill3', 'skill4', 'skill5', 'skill6', 'url']
+    Returns:
+        int: The schema version
+    """
+    # Imported here because migration_service itself uses get_connection()
+    from migration_service import run_migrations
 
-        # Get existing columns
-        cur.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='documents'
-        """)
-        existing_columns = [row[0] for row in cur.fetchall()]
-
-        # Add any missing columns
-        for column in required_columns:
-            if column not in existing_columns:
-                logger.info(f"Adding missing '{column}' column to documents table")
-                cur.execute(f"""
-                    ALTER TABLE documents 
-                    ADD COLUMN {column} TEXT
-                """)
-                logger.info(f"Added '{column}' column successfully")
-
-        conn.commit()
-        cur.close()
+    try:
+        version = run_migrations()
         logger.info("Database initialized successfully")
+        return version
     except (Exception, psycopg2.DatabaseError) as error:
         logger.error(f"Error initializing database: {error}")
         raise
-    finally:
-        if conn is not None:
-            conn.close()
 
+# Columns written when saving a document, in insertion order
+DOCUMENT_COLUMNS = ['entreprise', 'poste', 'source', 'identifiant', 'base_line', 'salaire', 'description', 'skills_text', 'skill1', 'skill2', 'skill3', 'skill4', 'skill5', 'skill6', 'url']
+
+def _documents_changed():
+    global _documents_version
+    with _marker_lock:
+        _documents_version += 1
+
+def get_documents_marker(max_age=DOCUMENTS_MARKER_TTL):
+    """
+    Get a cheap marker of the content of the documents table.
+
+    The marker changes whenever a document is inserted, so it can key caches
+    of query results. Inserts made by this process change it immediately;
+    inserts made by other processes are seen once the marker is older than
+    max_age, which costs one index-only MAX(id) query.
+
+    Args:
+        max_age (float): Seconds a marker fetched from the database is trusted
+
+    Returns:
+        tuple: The marker, or None if the database could not be queried
+    """
+    global _documents_marker
+    now = time.monotonic()
+    with _marker_lock:
+        version = _documents_version
+        cached = _documents_marker
+    if cached is not None and cached[2] == version and now - cached[1] < max_age:
+        return cached[0]
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT MAX(id) FROM documents")
+            max_id = cur.fetchone()[0]
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error retrieving the documents marker: {error}")
+        return None
+
+    marker = (max_id, version)
+    with _marker_lock:
+        _documents_marker = (marker, now, version)
+    return marker
+
+def _document_values(variables):
+    """
+    Build the row inserted for a document, in DOCUMENT_COLUMNS order.
+    """
+    return tuple(variables.get(column, '') for column in DOCUMENT_COLUMNS)
+
+@tracing.traced('db.save_document')
 def save_document(variables):
     """
     Save document data to the database.
@@ -108,83 +313,156 @@ def save_document(variables):
     Returns:
         int: ID of the inserted record, or None if an error occurred
     """
-    conn = None
     document_id = None
     try:
-        # Get the database URL
-        db_url = get_database_url()
+        with get_connection() as conn:
+            cur = conn.cursor()
 
-        # Log connection attempt
-        logger.info(f"Attempting to connect to database for document save operation")
+            # Insert document data
+            query = sql.SQL("""
+                INSERT INTO documents (entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """)
 
-        # Connect to the database
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
+            # Log the document data being saved (without sensitive information)
+            logger.info(f"Saving document for company: {variables.get('entreprise', '')}, position: {variables.get('poste', '')}")
 
-        # Insert document data
-        query = sql.SQL("""
-            INSERT INTO documents (entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """)
+            # Prepare values for insertion
+            values = _document_values(variables)
 
-        # Log the document data being saved (without sensitive information)
-        logger.info(f"Saving document for company: {variables.get('entreprise', '')}, position: {variables.get('poste', '')}")
-
-        # Prepare values for insertion
-        values = (
-            variables.get('entreprise', ''),
-            variables.get('poste', ''),
-            variables.get('source', ''),
-            variables.get('identifiant', ''),
-            variables.get('base_line', ''),
-            variables.get('salaire', ''),
-            variables.get('description', ''),
-            variables.get('skills_text', ''),
-            variables.get('skill1', ''),
-            variables.get('skill2', ''),
-            variables.get('skill3', ''),
-            variables.get('skill4', ''),
-            variables.get('skill5', ''),
-            variables.get('skill6', ''),
-            variables.get('url', '')
-        )
-
-        # Log the query execution
-        logger.info(f"Executing INSERT query with values: {values}")
+            # Log the query execution
+            logger.debug(f"Executing INSERT query with values: {values}")
 
-        cur.execute(query, values)
+            cur.execute(query, values)
 
-        # Fetch the ID of the inserted record
-        result = cur.fetchone()
-        if result is None:
-            logger.error("No ID returned after INSERT operation")
-            conn.rollback()
-            return None
+            # Fetch the ID of the inserted record
+            result = cur.fetchone()
+            if result is None:
+                logger.error("No ID returned after INSERT operation")
+                conn.rollback()
+                return None
 
-        document_id = result[0]
+            document_id = result[0]
 
-        # Commit the transaction
-        logger.info(f"Committing transaction for document ID: {document_id}")
-        conn.commit()
-        cur.close()
+            # Commit the transaction
+            logger.info(f"Committing transaction for document ID: {document_id}")
+            conn.commit()
+            cur.close()
+        _documents_changed()
 
         logger.info(f"Document saved successfully with ID: {document_id}")
     except (Exception, psycopg2.DatabaseError) as error:
+        # get_connection() has already rolled the transaction back
         logger.error(f"Error saving document: {error}")
-        # Rollback the transaction if an error occurred
-        if conn is not None:
-            conn.rollback()
-            logger.info("Transaction rolled back due to error")
+        document_id = None
         # Don't raise the exception here to maintain backward compatibility
         # Just return None to indicate failure
-    finally:
-        if conn is not None:
-            conn.close()
-            logger.info("Database connection closed")
 
     return document_id
 
+@tracing.traced('db.save_documents')
+def save_documents(variables_iterable, page_size=DB_BULK_PAGE_SIZE):
+    """
+    Save many documents in one transaction with multi-row INSERTs.
+
+    Rows are consumed lazily and sent page_size at a time through
+    execute_values. Each page runs in a savepoint: if it fails, its rows are
+    retried one by one so that only the offending rows are rejected.
+
+    Args:
+        variables_iterable (iterable): Dictionaries containing document variables
+        page_size (int): Number of rows per INSERT statement
+
+    Returns:
+        tuple: (document_ids, errors) where document_ids lists the ID of every
+            input row in input order (None for rejected rows) and errors maps
+            the index of each rejected row to its error message
+    """
+    document_ids = []
+    errors = {}
+    rows = iter(variables_iterable)
+    consumed = 0
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            while True:
+                page = [_document_values(variables) for variables in islice(rows, page_size)]
+                if not page:
+                    break
+                consumed += len(page)
+                document_ids.extend(_insert_page(cur, page, len(document_ids), errors))
+
+            conn.commit()
+            cur.close()
+        _documents_changed()
+    except (Exception, psycopg2.DatabaseError) as error:
+        # get_connection() has already rolled the transaction back, so no row was saved
+        logger.error(f"Error saving documents: {error}")
+        consumed += sum(1 for _ in rows)
+        return [None] * consumed, {index: str(error) for index in range(consumed)}
+
+    saved = len(document_ids) - len(errors)
+    logger.info(f"Saved {saved} documents successfully, {len(errors)} rejected")
+    return document_ids, errors
+
+def insert_documents(cur, variables_list):
+    """
+    Insert documents with a cursor of the caller's transaction.
+
+    Unlike save_documents(), nothing is committed, so the caller can record
+    the IDs in the same transaction.
+
+    Args:
+        cur (cursor): Cursor of an open transaction
+        variables_list (list): Dictionaries containing document variables
+
+    Returns:
+        list: IDs of the inserted records, in input order
+    """
+    return _insert_rows(cur, [_document_values(variables) for variables in variables_list])
+
+def _insert_rows(cur, rows):
+    # Number the rows and insert them in that order: the serial IDs are then
+    # assigned in input order, whatever order RETURNING reports them in.
+    query = """
+        INSERT INTO documents (entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url)
+        SELECT entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url
+        FROM (VALUES %s) AS v (ord, entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url)
+        ORDER BY ord
+        RETURNING id
+    """
+    numbered = [(ordinal,) + row for ordinal, row in enumerate(rows)]
+    returned = execute_values(cur, query, numbered, page_size=len(numbered), fetch=True)
+    return sorted(row[0] for row in returned)
+
+def _insert_page(cur, page, offset, errors):
+    """
+    Insert a page of rows, isolating the failing rows if the page is rejected.
+    """
+    cur.execute("SAVEPOINT save_documents_page")
+    try:
+        document_ids = _insert_rows(cur, page)
+        cur.execute("RELEASE SAVEPOINT save_documents_page")
+        return document_ids
+    except psycopg2.DatabaseError as error:
+        logger.warning(f"Page of {len(page)} documents rejected, retrying row by row: {error}")
+        cur.execute("ROLLBACK TO SAVEPOINT save_documents_page")
+
+    document_ids = []
+    for index, row in enumerate(page, start=offset):
+        cur.execute("SAVEPOINT save_documents_row")
+        try:
+            document_ids.extend(_insert_rows(cur, [row]))
+            cur.execute("RELEASE SAVEPOINT save_documents_row")
+        except psycopg2.DatabaseError as error:
+            cur.execute("ROLLBACK TO SAVEPOINT save_documents_row")
+            logger.warning(f"Document at index {index} rejected: {error}")
+            errors[index] = str(error).strip()
+            document_ids.append(None)
+    return document_ids
+
+@tracing.traced('db.get_document')
 def get_document(document_id):
     """
     Retrieve document data from the database.
@@ -195,60 +473,53 @@ def get_document(document_id):
     Returns:
         dict: Document data as a dictionary, or None if not found
     """
-    conn = None
     document = None
     try:
-        # Get the database URL
-        db_url = get_database_url()
-
-        # Connect to the database
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-
-        query = sql.SQL("""
-            SELECT id, entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url, created_at
-            FROM documents
-            WHERE id = %s
-        """)
-
-        logger.info(f"Retrieving document with ID: {document_id}")
-
-        cur.execute(query, (document_id,))
-        row = cur.fetchone()
-
-        if row:
-            document = {
-                'id': row[0],
-                'entreprise': row[1],
-                'poste': row[2],
-                'source': row[3],
-                'identifiant': row[4],
-                'base_line': row[5],
-                'salaire': row[6],
-                'description': row[7],
-                'skills_text': row[8],
-                'skill1': row[9],
-                'skill2': row[10],
-                'skill3': row[11],
-                'skill4': row[12],
-                'skill5': row[13],
-                'skill6': row[14],
-                'url': row[15],
-                'created_at': row[16]
-            }
-            logger.info(f"Document retrieved successfully: {document['entreprise']}, {document['poste']}")
-        else:
-            logger.info(f"No document found with ID: {document_id}")
-
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            query = sql.SQL("""
+                SELECT id, entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url, created_at
+                FROM documents
+                WHERE id = %s
+            """)
+
+            logger.info(f"Retrieving document with ID: {document_id}")
+
+            cur.execute(query, (document_id,))
+            row = cur.fetchone()
+
+            if row:
+                document = {
+                    'id': row[0],
+                    'entreprise': row[1],
+                    'poste': row[2],
+                    'source': row[3],
+                    'identifiant': row[4],
+                    'base_line': row[5],
+                    'salaire': row[6],
+                    'description': row[7],
+                    'skills_text': row[8],
+                    'skill1': row[9],
+                    'skill2': row[10],
+                    'skill3': row[11],
+                    'skill4': row[12],
+                    'skill5': row[13],
+                    'skill6': row[14],
+                    'url': row[15],
+                    'created_at': row[16]
+                }
+                logger.info(f"Document retrieved successfully: {document['entreprise']}, {document['poste']}")
+            else:
+                logger.info(f"No document found with ID: {document_id}")
+
+            cur.close()
     except (Exception, psycopg2.DatabaseError) as error:
         logger.error(f"Error retrieving document: {error}")
-    finally:
-        if conn is not None:
-            conn.close()
 
     return document
 
+@tracing.traced('db.get_all_documents')
 def get_all_documents():
     """
     Retrieve all documents from the database.
@@ -256,55 +527,216 @@ def get_all_documents():
     Returns:
         list: List of dictionaries containing document data
     """
-    conn = None
     documents = []
     try:
-        # Get the database URL
-        db_url = get_database_url()
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            query = sql.SQL("""
+                SELECT id, entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url, created_at
+                FROM documents
+                ORDER BY created_at DESC
+            """)
+
+            logger.info("Retrieving all documents")
+
+            cur.execute(query)
+            rows = cur.fetchall()
+
+            for row in rows:
+                document = {
+                    'id': row[0],
+                    'entreprise': row[1],
+                    'poste': row[2],
+                    'source': row[3],
+                    'identifiant': row[4],
+                    'base_line': row[5],
+                    'salaire': row[6],
+                    'description': row[7],
+                    'skills_text': row[8],
+                    'skill1': row[9],
+                    'skill2': row[10],
+                    'skill3': row[11],
+                    'skill4': row[12],
+                    'skill5': row[13],
+                    'skill6': row[14],
+                    'url': row[15],
+                    'created_at': row[16]
+                }
+                documents.append(document)
+
+            logger.info(f"Retrieved {len(documents)} documents successfully")
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error retrieving documents: {error}")
 
-        # Connect to the database
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
+    return documents
+
+# Columns returned by list_documents(): everything but the large text fields
+LIST_COLUMNS = ['id', 'entreprise', 'poste', 'source', 'identifiant', 'base_line', 'salaire', 'skill1', 'skill2', 'skill3', 'skill4', 'skill5', 'skill6', 'url', 'created_at']
 
+def _contains(value):
+    # ILIKE pattern matching value anywhere, with its wildcards escaped
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+@tracing.traced('db.list_documents')
+def list_documents(limit=DOCUMENTS_PAGE_SIZE, cursor=None, entreprise=None, poste=None, source=None, date_from=None, date_to=None):
+    """
+    Retrieve one page of documents, most recent first.
+
+    Pages are fetched with keyset pagination on (created_at, id), so every
+    page costs the same whatever its position. The description and
+    skills_text fields are not returned, use get_document() for those.
+
+    Args:
+        limit (int): Maximum number of documents returned
+        cursor (tuple, optional): Cursor returned with the previous page, None for the first page
+        entreprise (str, optional): Only documents whose company contains this text
+        poste (str, optional): Only documents whose position contains this text
+        source (str, optional): Only documents whose source contains this text
+        date_from (datetime, optional): Only documents created at or after this time
+        date_to (datetime, optional): Only documents created before this time
+
+    Returns:
+        tuple: (documents, next_cursor) where documents is a list of
+            dictionaries and next_cursor is None on the last page
+    """
+    documents = []
+    next_cursor = None
+    try:
+        conditions = []
+        params = []
+        for column, value in (('entreprise', entreprise), ('poste', poste), ('source', source)):
+            if value:
+                conditions.append(sql.SQL("{} ILIKE %s").format(sql.Identifier(column)))
+                params.append(_contains(value))
+        if date_from is not None:
+            conditions.append(sql.SQL("created_at >= %s"))
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append(sql.SQL("created_at < %s"))
+            params.append(date_to)
+        if cursor is not None:
+            conditions.append(sql.SQL("(created_at, id) < (%s, %s)"))
+            params.extend(cursor)
+
+        where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
         query = sql.SQL("""
-            SELECT id, entreprise, poste, source, identifiant, base_line, salaire, description, skills_text, skill1, skill2, skill3, skill4, skill5, skill6, url, created_at
+            SELECT {columns}
             FROM documents
-            ORDER BY created_at DESC
-        """)
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """).format(
+            columns=sql.SQL(', ').join(sql.Identifier(column) for column in LIST_COLUMNS),
+            where=where,
+        )
+        # Fetch one extra row to know whether there is a next page
+        params.append(limit + 1)
 
-        logger.info("Retrieving all documents")
-
-        cur.execute(query)
-        rows = cur.fetchall()
-
-        for row in rows:
-            document = {
-                'id': row[0],
-                'entreprise': row[1],
-                'poste': row[2],
-                'source': row[3],
-                'identifiant': row[4],
-                'base_line': row[5],
-                'salaire': row[6],
-                'description': row[7],
-                'skills_text': row[8],
-                'skill1': row[9],
-                'skill2': row[10],
-                'skill3': row[11],
-                'skill4': row[12],
-                'skill5': row[13],
-                'skill6': row[14],
-                'url': row[15],
-                'created_at': row[16]
-            }
-            documents.append(document)
-
-        logger.info(f"Retrieved {len(documents)} documents successfully")
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            cur.close()
+
+        for row in rows[:limit]:
+            documents.append(dict(zip(LIST_COLUMNS, row)))
+        if len(rows) > limit:
+            next_cursor = (documents[-1]['created_at'], documents[-1]['id'])
+
+        logger.info(f"Retrieved a page of {len(documents)} documents")
     except (Exception, psycopg2.DatabaseError) as error:
         logger.error(f"Error retrieving documents: {error}")
-    finally:
-        if conn is not None:
-            conn.close()
 
-    return documents
+    return documents, next_cursor
+
+# Markers around the matched words in search highlights: control characters,
+# which typed text does not contain, so callers can escape the text for their
+# output format before turning the markers into its own markup
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+_HIGHLIGHT_OPTIONS = (f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}", '
+                      'MaxFragments=2, MaxWords=20, MinWords=5, FragmentDelimiter=" … "')
+
+def _prefix_tsquery(text):
+    """
+    Turn free text into a tsquery matching every word as a prefix.
+
+    Every word is matched as a prefix so that results show up while a word is
+    still being typed. Only word characters are kept, which makes the query
+    safe to pass to to_tsquery().
+    """
+    words = re.findall(r'\w+', text)
+    return ' & '.join(f"{word}:*" for word in words)
+
+@tracing.traced('db.search_documents')
+def search_documents(text, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Full-text search over the company, position, skills and description.
+
+    Results are ranked with ts_rank_cd (company and position weigh more than
+    skills, which weigh more than the description) and come with highlighted
+    extracts in which matched words are wrapped in HIGHLIGHT_START and
+    HIGHLIGHT_STOP. The extracts are raw stored text, to be escaped by the caller.
+
+    Args:
+        text (str): The search text
+        limit (int): Maximum number of results
+
+    Returns:
+        list: List of dictionaries with id, entreprise, poste, source, url,
+            created_at, rank and the highlighted entreprise_highlight,
+            poste_highlight, skills_highlight and description_highlight
+    """
+    results = []
+    tsquery = _prefix_tsquery(text)
+    if not tsquery:
+        return results
+
+    try:
+        # ts_headline is expensive, so it only runs on the top ranked rows
+        query = sql.SQL("""
+            SELECT id, entreprise, poste, source, url, created_at, rank,
+                   ts_headline('french', coalesce(entreprise, ''), q, %(options)s),
+                   ts_headline('french', coalesce(poste, ''), q, %(options)s),
+                   ts_headline('french', coalesce(skills_text, ''), q, %(options)s),
+                   ts_headline('french', coalesce(description, ''), q, %(options)s)
+            FROM (
+                SELECT id, entreprise, poste, source, url, created_at, skills_text, description, q,
+                       ts_rank_cd(search_vector, q) AS rank
+                FROM documents, to_tsquery('french', %(tsquery)s) AS q
+                WHERE search_vector @@ q
+                ORDER BY rank DESC, created_at DESC
+                LIMIT %(limit)s
+            ) AS top
+            ORDER BY rank DESC, created_at DESC
+        """)
+
+        logger.info(f"Searching documents for: {text}")
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, {'tsquery': tsquery, 'limit': limit, 'options': _HIGHLIGHT_OPTIONS})
+            for row in cur.fetchall():
+                results.append({
+                    'id': row[0],
+                    'entreprise': row[1],
+                    'poste': row[2],
+                    'source': row[3],
+                    'url': row[4],
+                    'created_at': row[5],
+                    'rank': row[6],
+                    'entreprise_highlight': row[7],
+                    'poste_highlight': row[8],
+                    'skills_highlight': row[9],
+                    'description_highlight': row[10],
+                })
+            cur.close()
+
+        logger.info(f"Found {len(results)} documents")
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error searching documents: {error}")
+
+    return results
@@ -1,60 +1,212 @@
-from googleapiclient.discovery import build
-from auth import get_credentials
+from google_api import get_drive_service, get_docs_service, execute, execute_batch
+from googleapiclient.errors import HttpError
+from placeholder_service import filter_replacements
+from config import STRICT_TEMPLATE_CHECKS, GOOGLE_API_TRANSPORT, COPY_POOL_SIZE, PLACEHOLDER_DISCOVERY
+import re
 import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
 
-def create_document_copy(document_id, copy_title=None):
+logger = logging.getLogger(__name__)
+
+# MIME type of native Google Docs documents
+GOOGLE_DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+
+# Fields requested from files().copy, enough for the template protection checks
+COPY_FIELDS = 'id,mimeType'
+
+# Name given to temporary copies: Copy_<timestamp>
+COPY_NAME_PREFIX = 'Copy_'
+_COPY_NAME = re.compile(rf'^{COPY_NAME_PREFIX}\d+$')
+
+def copy_body(copy_title=None):
+    """
+    Build the files().copy request body.
+
+    Args:
+        copy_title (str, optional): The title for the copy. If None, a timestamp will be added.
+
+    Returns:
+        dict: The copy metadata
+    """
+    if copy_title is None:
+        # Generate a title with timestamp if none provided
+        timestamp = int(time.time())
+        copy_title = f"{COPY_NAME_PREFIX}{timestamp}"
+
+    return {
+        'name': copy_title,
+        'parents': []  # Copy to the same folder as the original
+    }
+
+def check_copy(copied_file, original_id):
+    """
+    Check the files().copy response before the copy gets modified.
+
+    Args:
+        copied_file (dict): The files().copy response, with COPY_FIELDS
+        original_id (str): The ID of the copied template
+
+    Returns:
+        str: The ID of the copy
+    """
+    copy_id = copied_file['id']
+
+    if copy_id == original_id:
+        raise ValueError(f"Copy has the same ID as the original: {copy_id}")
+
+    if copied_file.get('mimeType') != GOOGLE_DOC_MIME_TYPE:
+        raise ValueError(f"Copy {copy_id} is not a Google Doc: {copied_file.get('mimeType')}")
+
+    return copy_id
+
+def build_replace_requests(replacements):
+    """
+    Build the batchUpdate requests replacing the `{{ key }}` placeholders.
+
+    Args:
+        replacements (dict): Dictionary of variables and their replacement values
+
+    Returns:
+        list: The replaceAllText requests
+    """
+    requests = []
+    for key, value in replacements.items():
+        requests.append({
+            'replaceAllText': {
+                'containsText': {
+                    'text': f'{{{{ {key} }}}}',
+                    'matchCase': True,
+                },
+                'replaceText': value,
+            }
+        })
+    return requests
+
+def _run_async(function_name, *args, **kwargs):
+    """
+    Run the async_google_api version of a function through its sync facade.
+    """
+    # Imported here: async_google_api imports this module, and httpx is only
+    # needed by the async transport
+    import async_google_api
+    return async_google_api.run(getattr(async_google_api, function_name)(*args, **kwargs))
+
+def create_document_copy(document_id, copy_title=None, strict=None, use_pool=None):
     """
     Create a copy of a Google Doc.
 
+    By default the copy is checked from the files().copy response alone. In
+    strict mode both the original and the copy are also read back through
+    the Docs API to verify their IDs.
+
+    Untitled, non-strict copies are taken from the copy pool when it holds a
+    copy of the current template revision, see copy_pool.
+
     Args:
         document_id (str): The ID of the Google Doc to copy
         copy_title (str, optional): The title for the copy. If None, a timestamp will be added.
+        strict (bool, optional): Enable the Docs API read-back checks. Defaults to STRICT_TEMPLATE_CHECKS.
+        use_pool (bool, optional): Take the copy from the copy pool. Defaults to COPY_POOL_SIZE > 0.
 
     Returns:
         str: The ID of the newly created copy
     """
-    creds = get_credentials()
-    drive_service = build('drive', 'v3', credentials=creds)
-    docs_service = build('docs', 'v1', credentials=creds)
+    if use_pool is None:
+        use_pool = COPY_POOL_SIZE > 0
+    if use_pool and copy_title is None and not (STRICT_TEMPLATE_CHECKS if strict is None else strict):
+        # Imported here: copy_pool makes its copies through this module
+        import copy_pool
+        copy_id = copy_pool.take(document_id)
+        if copy_id is not None:
+            return copy_id
 
-    # First, verify we can access the original document
-    original_doc = docs_service.documents().get(documentId=document_id).execute()
-    original_id = original_doc.get('documentId')
+    if GOOGLE_API_TRANSPORT == 'async':
+        return _run_async('create_document_copy', document_id, copy_title, strict)
 
-    if original_id != document_id:
-        raise ValueError(f"Original document ID mismatch: expected {document_id}, got {original_id}")
+    if strict is None:
+        strict = STRICT_TEMPLATE_CHECKS
 
-    if copy_title is None:
-        # Generate a title with timestamp if none provided
-        timestamp = int(time.time())
-        copy_title = f"Copy_{timestamp}"
+    drive_service = get_drive_service()
+
+    original_id = document_id
+    if strict:
+        # First, verify we can access the original document
+        original_doc = execute(get_docs_service().documents().get(documentId=document_id, fields='documentId'))
+        original_id = original_doc.get('documentId')
+
+        if original_id != document_id:
+            raise ValueError(f"Original document ID mismatch: expected {document_id}, got {original_id}")
 
     # Create a copy of the document
-    copy_metadata = {
-        'name': copy_title,
-        'parents': []  # Copy to the same folder as the original
-    }
+    copy_metadata = copy_body(copy_title)
 
-    copied_file = drive_service.files().copy(
+    copied_file = execute(drive_service.files().copy(
         fileId=document_id,
-        body=copy_metadata
-    ).execute()
+        body=copy_metadata,
+        fields=COPY_FIELDS
+    ))
 
     # Ensure we're using the ID of the copy, not the original
-    copy_id = copied_file['id']
-
-    # Verify the copy exists and is different from the original
-    copy_doc = docs_service.documents().get(documentId=copy_id).execute()
-    verified_copy_id = copy_doc.get('documentId')
+    copy_id = check_copy(copied_file, original_id)
 
-    if verified_copy_id != copy_id:
-        raise ValueError(f"Copy document ID mismatch: expected {copy_id}, got {verified_copy_id}")
+    if strict:
+        # Verify the copy exists and is different from the original
+        copy_doc = execute(get_docs_service().documents().get(documentId=copy_id, fields='documentId'))
+        verified_copy_id = copy_doc.get('documentId')
 
-    if verified_copy_id == original_id:
-        raise ValueError(f"Copy has the same ID as the original: {verified_copy_id}")
+        if verified_copy_id != copy_id:
+            raise ValueError(f"Copy document ID mismatch: expected {copy_id}, got {verified_copy_id}")
 
     return copy_id
 
+def create_document_copies(document_ids):
+    """
+    Create one copy of each of several Google Docs.
+
+    Copies are taken from the copy pool when possible; the other ones are
+    made with a single Drive batch request. In strict mode the copies are
+    made one by one, see create_document_copy().
+
+    Args:
+        document_ids (list): The IDs of the Google Docs to copy
+
+    Returns:
+        list: For each document, the ID of its copy or the exception raised
+            while copying it
+    """
+    if STRICT_TEMPLATE_CHECKS or GOOGLE_API_TRANSPORT == 'async':
+        copies = []
+        for document_id in document_ids:
+            try:
+                copies.append(create_document_copy(document_id))
+            except Exception as error:
+                copies.append(error)
+        return copies
+
+    copies = [None] * len(document_ids)
+    if COPY_POOL_SIZE > 0:
+        import copy_pool
+        for index, document_id in enumerate(document_ids):
+            copies[index] = copy_pool.take(document_id)
+
+    missing = [index for index, copy_id in enumerate(copies) if copy_id is None]
+    if missing:
+        drive_service = get_drive_service()
+        results = execute_batch(drive_service, [
+            drive_service.files().copy(fileId=document_ids[index], body=copy_body(), fields=COPY_FIELDS)
+            for index in missing
+        ])
+        for index, copied_file in zip(missing, results):
+            if not isinstance(copied_file, Exception):
+                try:
+                    copied_file = check_copy(copied_file, document_ids[index])
+                except ValueError as error:
+                    copied_file = error
+            copies[index] = copied_file
+    return copies
+
 def delete_document(document_id):
     """
     Delete a Google Doc.
@@ -65,49 +217,186 @@ def delete_document(document_id):
     Returns:
         None
     """
-    creds = get_credentials()
-    drive_service = build('drive', 'v3', credentials=creds)
+    if GOOGLE_API_TRANSPORT == 'async':
+        return _run_async('delete_document', document_id)
+
+    drive_service = get_drive_service()
+
+    execute(drive_service.files().delete(fileId=document_id))
+
+def delete_documents(document_ids):
+    """
+    Delete many Google Docs with Drive batch requests.
 
-    drive_service.files().delete(fileId=document_id).execute()
+    Documents that no longer exist count as deleted.
 
-def replace_variables(document_id, replacements, template_id=None):
+    Args:
+        document_ids (list): The IDs of the Google Docs to delete
+
+    Returns:
+        dict: Document ID -> exception, for the documents that could not be deleted
+    """
+    if not document_ids:
+        return {}
+
+    drive_service = get_drive_service()
+    results = execute_batch(drive_service, [drive_service.files().delete(fileId=document_id) for document_id in document_ids])
+    return {
+        document_id: result
+        for document_id, result in zip(document_ids, results)
+        if isinstance(result, Exception) and not (isinstance(result, HttpError) and result.resp.status == 404)
+    }
+
+@contextmanager
+def document_copy(document_id):
+    """
+    Create a copy of a Google Doc and delete it when the block exits, even
+    if the block raises.
+
+    Args:
+        document_id (str): The ID of the Google Doc to copy
+
+    Yields:
+        str: The ID of the copy
+    """
+    copy_id = create_document_copy(document_id)
+    try:
+        yield copy_id
+    finally:
+        try:
+            delete_document(copy_id)
+        except Exception as error:
+            # Do not hide the error of the block, the janitor reclaims the copy later
+            logger.warning(f"Could not delete copy {copy_id}: {error}")
+
+def replace_variables(document_id, replacements, template_id=None, strict=None):
     """
     Replace variables in a Google Doc with provided values.
 
+    With PLACEHOLDER_DISCOVERY and a template_id, only the variables whose
+    placeholder occurs in the template are sent, see placeholder_service.
+
     Args:
         document_id (str): The ID of the Google Doc to modify
         replacements (dict): Dictionary of variables and their replacement values
         template_id (str, optional): The ID of the template document, to ensure we're not modifying it
+        strict (bool, optional): Read the document back through the Docs API to verify its ID
+            before updating it. Defaults to STRICT_TEMPLATE_CHECKS.
 
     Returns:
-        None
+        dict: The 'missing' and 'unused' variables, see
+            placeholder_service.plan_replacements(), or None if the
+            placeholders of the template were not discovered
     """
-    creds = get_credentials()
-    docs_service = build('docs', 'v1', credentials=creds)
+    report = None
+    if template_id and PLACEHOLDER_DISCOVERY:
+        [(replacements, report)] = filter_replacements([(replacements, template_id)])
 
-    # First, verify we can access the document with the provided ID
-    doc = docs_service.documents().get(documentId=document_id).execute()
+    if GOOGLE_API_TRANSPORT == 'async':
+        _run_async('replace_variables', document_id, replacements, template_id, strict)
+        return report
 
-    # Ensure we're working with the correct document
-    doc_id = doc.get('documentId')
-    if doc_id != document_id:
-        raise ValueError(f"Document ID mismatch: expected {document_id}, got {doc_id}")
+    if strict is None:
+        strict = STRICT_TEMPLATE_CHECKS
+
+    docs_service = get_docs_service()
+
+    doc_id = document_id
+    if strict:
+        # First, verify we can access the document with the provided ID
+        doc = execute(docs_service.documents().get(documentId=document_id, fields='documentId'))
+
+        # Ensure we're working with the correct document
+        doc_id = doc.get('documentId')
+        if doc_id != document_id:
+            raise ValueError(f"Document ID mismatch: expected {document_id}, got {doc_id}")
 
     # If template_id is provided, ensure we're not modifying the template
     if template_id and doc_id == template_id:
         raise ValueError(f"Cannot modify template document: {template_id}")
 
+    # Use the verified document ID for the batch update
+    requests = build_replace_requests(replacements)
+    if requests:
+        execute(docs_service.documents().batchUpdate(documentId=doc_id, body={'requests': requests}))
+    return report
+
+def batch_replace_variables(jobs):
+    """
+    Replace variables in several Google Docs with a single Docs batch request.
+
+    Args:
+        jobs (list): (document_id, replacements, template_id) tuples, see
+            replace_variables()
+
+    Returns:
+        list: For each job, None or the exception raised while updating its
+            document
+    """
+    if STRICT_TEMPLATE_CHECKS or GOOGLE_API_TRANSPORT == 'async':
+        errors = []
+        for document_id, replacements, template_id in jobs:
+            try:
+                replace_variables(document_id, replacements, template_id=template_id)
+                errors.append(None)
+            except Exception as error:
+                errors.append(error)
+        return errors
+
+    errors = [None] * len(jobs)
+    if PLACEHOLDER_DISCOVERY:
+        planned = filter_replacements([(replacements, template_id) for _, replacements, template_id in jobs])
+        jobs = [(document_id, needed, template_id) for (document_id, _, template_id), (needed, _) in zip(jobs, planned)]
+
     requests = []
-    for key, value in replacements.items():
-        requests.append({
-            'replaceAllText': {
-                'containsText': {
-                    'text': f'{{{{ {key} }}}}',
-                    'matchCase': True,
-                },
-                'replaceText': value,
-            }
-        })
+    indexes = []
+    docs_service = get_docs_service()
+    for index, (document_id, replacements, template_id) in enumerate(jobs):
+        if template_id and document_id == template_id:
+            errors[index] = ValueError(f"Cannot modify template document: {template_id}")
+            continue
+        if not replacements:
+            # The template has no placeholder to fill
+            continue
+        requests.append(docs_service.documents().batchUpdate(
+            documentId=document_id,
+            body={'requests': build_replace_requests(replacements)}
+        ))
+        indexes.append(index)
 
-    # Use the verified document ID for the batch update
-    docs_service.documents().batchUpdate(documentId=doc_id, body={'requests': requests}).execute()
+    if requests:
+        for index, result in zip(indexes, execute_batch(docs_service, requests)):
+            if isinstance(result, Exception):
+                errors[index] = result
+    return errors
+
+def list_copies(older_than):
+    """
+    List the temporary Copy_<timestamp> documents created before a given age.
+
+    Args:
+        older_than (float): Minimum age of the copies, in seconds
+
+    Returns:
+        list: The matching files, as dicts with id, name and createdTime
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=older_than)).strftime('%Y-%m-%dT%H:%M:%S')
+    query = (
+        f"name contains '{COPY_NAME_PREFIX}' and mimeType = '{GOOGLE_DOC_MIME_TYPE}' "
+        f"and trashed = false and 'me' in owners and createdTime < '{cutoff}'"
+    )
+    drive_service = get_drive_service()
+    copies = []
+    page_token = None
+    while True:
+        response = execute(drive_service.files().list(
+            q=query,
+            fields='nextPageToken,files(id,name,createdTime)',
+            pageSize=1000,
+            pageToken=page_token
+        ))
+        # "contains" matches name prefixes, keep the exact Copy_<timestamp> names only
+        copies.extend(file for file in response.get('files', []) if _COPY_NAME.match(file['name']))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return copies
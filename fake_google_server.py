@@ -0,0 +1,380 @@
+"""
+Local stand-in for the Drive v3 and Docs v1 endpoints used by the application.
+
+Usage:
+    python fake_google_server.py [--port 8765] [--latency-ms 50] [--jitter-ms 20]
+                                 [--rate-limit-ratio 0.02] [--retry-after 1] [--pdf-kb 64]
+
+Point the application at it with GOOGLE_API_ENDPOINT=http://127.0.0.1:8765;
+both the googleapiclient and the async transports then send their requests
+here. Emulated methods: files.copy, files.get, files.list, files.delete,
+files.export (with Range requests), documents.get, documents.batchUpdate and
+the multipart batch endpoints of both APIs.
+
+Every HTTP round trip waits latency + random jitter before being answered,
+and every API call, batched or not, fails with a 429 rateLimitExceeded with
+probability rate_limit_ratio. Unknown document IDs are templates: they exist
+as soon as they are requested. GET /_stats returns the calls served, POST
+/_reset clears them.
+
+Access tokens are not checked. Only the standard library is used, so the
+server runs without the application's dependencies and configuration.
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import email.parser
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GOOGLE_DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+
+# Body of the templates, with the placeholders of the application's forms
+TEMPLATE_TEXT = (
+    "{{ entreprise }} - {{ poste }}\n"
+    "{{ base_line }}\n"
+    "{{ skill1 }}\n{{ skill2 }}\n{{ skill3 }}\n{{ skill4 }}\n{{ skill5 }}\n{{ skill6 }}\n"
+    "{{ description }}\n"
+)
+
+_RATE_LIMIT_ERROR = {
+    'error': {
+        'code': 429,
+        'message': 'Rate Limit Exceeded',
+        'errors': [{'domain': 'usageLimits', 'reason': 'rateLimitExceeded', 'message': 'Rate Limit Exceeded'}],
+    }
+}
+
+_REASONS = {200: 'OK', 204: 'No Content', 206: 'Partial Content', 400: 'Bad Request',
+            404: 'Not Found', 416: 'Range Not Satisfiable', 429: 'Too Many Requests'}
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _json(status, data):
+    return status, {'Content-Type': 'application/json; charset=UTF-8'}, json.dumps(data).encode('utf-8')
+
+def _not_found(document_id):
+    return _json(404, {'error': {'code': 404, 'message': f'File not found: {document_id}.',
+                                 'errors': [{'reason': 'notFound', 'message': f'File not found: {document_id}.'}]}})
+
+class FakeGoogle:
+    """
+    In-memory documents and call statistics of the fake server.
+
+    Args:
+        latency (float): Seconds waited before answering each round trip
+        jitter (float): Maximum random seconds added to latency
+        rate_limit_ratio (float): Probability of an API call failing with 429
+        retry_after (float, optional): Retry-After header of the 429 responses
+        pdf_size (int): Size in bytes of the exported PDFs
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=None, pdf_size=64 * 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.pdf_size = pdf_size
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._next_id = 0
+        self.reset()
+        self._routes = [
+            ('POST', re.compile(r'^/drive/v3/files/([^/]+)/copy$'), 'drive.files.copy', self._copy),
+            ('GET', re.compile(r'^/drive/v3/files/([^/]+)/export$'), 'drive.files.export', self._export),
+            ('GET', re.compile(r'^/drive/v3/files$'), 'drive.files.list', self._list),
+            ('GET', re.compile(r'^/drive/v3/files/([^/]+)$'), 'drive.files.get', self._get_file),
+            ('DELETE', re.compile(r'^/drive/v3/files/([^/]+)$'), 'drive.files.delete', self._delete),
+            ('GET', re.compile(r'^/v1/documents/([^/:]+)$'), 'docs.documents.get', self._get_document),
+            ('POST', re.compile(r'^/v1/documents/([^/:]+):batchUpdate$'), 'docs.documents.batchUpdate', self._batch_update),
+        ]
+
+    def reset(self):
+        """
+        Clear the call statistics.
+        """
+        with self._lock:
+            self.stats = {'calls': {}, 'request_bytes': {}, 'round_trips': 0, 'batches': 0, 'rate_limited': 0}
+
+    def get_stats(self):
+        """
+        Get the call statistics.
+
+        Returns:
+            dict: 'calls' and 'request_bytes' per API method id, 'round_trips',
+                'batches', 'rate_limited' (injected 429s) and 'documents'
+                (copies and templates currently stored)
+        """
+        with self._lock:
+            return dict(json.loads(json.dumps(self.stats)), documents=len(self._documents))
+
+    def _document(self, document_id, create=False):
+        # Called with the lock held
+        document = self._documents.get(document_id)
+        if document is None and create:
+            document = {'name': document_id, 'text': TEMPLATE_TEXT, 'version': 1,
+                        'modifiedTime': _now(), 'createdTime': _now(), 'template': True}
+            self._documents[document_id] = document
+        return document
+
+    def wait(self):
+        """
+        Wait the latency of one round trip.
+        """
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, method, target, headers, body):
+        """
+        Answer one API call.
+
+        Args:
+            method (str): HTTP method
+            target (str): Path and query string
+            headers (dict): Request headers, lowercase names
+            body (bytes): Request body
+
+        Returns:
+            tuple: (status, headers, body)
+        """
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        for route_method, pattern, method_id, handler in self._routes:
+            match = pattern.match(url.path)
+            if match is None or route_method != method:
+                continue
+            with self._lock:
+                self.stats['calls'][method_id] = self.stats['calls'].get(method_id, 0) + 1
+                self.stats['request_bytes'][method_id] = self.stats['request_bytes'].get(method_id, 0) + len(body)
+                rate_limited = random.random() < self.rate_limit_ratio
+                if rate_limited:
+                    self.stats['rate_limited'] += 1
+            if rate_limited:
+                status, response_headers, content = _json(429, _RATE_LIMIT_ERROR)
+                if self.retry_after is not None:
+                    response_headers['Retry-After'] = str(self.retry_after)
+                return status, response_headers, content
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                return _json(400, {'error': {'code': 400, 'message': 'Invalid JSON payload'}})
+            return handler(match.group(1) if match.groups() else None, query, headers, payload)
+        return _json(404, {'error': {'code': 404, 'message': f'Unknown method {method} {url.path}'}})
+
+    def _copy(self, document_id, query, headers, payload):
+        with self._lock:
+            source = self._document(document_id, create=True)
+            self._next_id += 1
+            copy_id = f'copy-{self._next_id}'
+            self._documents[copy_id] = {'name': payload.get('name') or f'Copy of {source["name"]}',
+                                        'text': source['text'], 'version': 1, 'modifiedTime': _now(),
+                                        'createdTime': _now(), 'template': False}
+        return _json(200, {'kind': 'drive#file', 'id': copy_id, 'mimeType': GOOGLE_DOC_MIME_TYPE})
+
+    def _get_file(self, document_id, query, headers, payload):
+        with self._lock:
+            document = self._document(document_id, create=True)
+            return _json(200, {'id': document_id, 'name': document['name'], 'mimeType': GOOGLE_DOC_MIME_TYPE,
+                               'version': str(document['version']), 'modifiedTime': document['modifiedTime']})
+
+    def _list(self, document_id, query, headers, payload):
+        with self._lock:
+            files = [{'id': file_id, 'name': document['name'], 'createdTime': document['createdTime']}
+                     for file_id, document in self._documents.items() if not document['template']]
+        return _json(200, {'files': files})
+
+    def _delete(self, document_id, query, headers, payload):
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document is None or document['template']:
+                return _not_found(document_id)
+            del self._documents[document_id]
+        return 204, {}, b''
+
+    def _export(self, document_id, query, headers, payload):
+        with self._lock:
+            document = self._document(document_id)
+            if document is None:
+                return _not_found(document_id)
+            text = document['text']
+        head = b'%PDF-1.4\n' + text.encode('utf-8')
+        content = head + b'\0' * max(self.pdf_size - len(head) - 6, 0) + b'\n%%EOF'
+
+        match = re.match(r'bytes=(\d+)-(\d*)$', headers.get('range', ''))
+        if match is None:
+            return 200, {'Content-Type': 'application/pdf'}, content
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+        if start >= len(content):
+            return 416, {'Content-Range': f'bytes */{len(content)}'}, b''
+        return 206, {'Content-Type': 'application/pdf',
+                     'Content-Range': f'bytes {start}-{end}/{len(content)}'}, content[start:end + 1]
+
+    def _get_document(self, document_id, query, headers, payload):
+        with self._lock:
+            document = self._document(document_id, create=True)
+            text = document['text']
+            revision = f"{document_id}-{document['version']}"
+        content = []
+        index = 1
+        for line in text.splitlines(keepends=True):
+            content.append({'startIndex': index, 'endIndex': index + len(line),
+                            'paragraph': {'elements': [{'startIndex': index, 'endIndex': index + len(line),
+                                                        'textRun': {'content': line}}]}})
+            index += len(line)
+        return _json(200, {'documentId': document_id, 'title': document_id, 'revisionId': revision,
+                           'body': {'content': content}})
+
+    def _batch_update(self, document_id, query, headers, payload):
+        replies = []
+        with self._lock:
+            document = self._document(document_id)
+            if document is None:
+                return _not_found(document_id)
+            for request in payload.get('requests', []):
+                replace = request.get('replaceAllText')
+                if replace is None:
+                    return _json(400, {'error': {'code': 400, 'message': f'Unsupported request: {list(request)}'}})
+                search = replace['containsText']['text']
+                occurrences = document['text'].count(search)
+                document['text'] = document['text'].replace(search, replace.get('replaceText', ''))
+                replies.append({'replaceAllText': {'occurrencesChanged': occurrences} if occurrences else {}})
+            document['version'] += 1
+            document['modifiedTime'] = _now()
+        return _json(200, {'documentId': document_id, 'replies': replies})
+
+    def handle_batch(self, content_type, body):
+        """
+        Answer a multipart/mixed batch request, one part per API call.
+
+        Args:
+            content_type (str): Content-Type of the request, with its boundary
+            body (bytes): Request body
+
+        Returns:
+            tuple: (status, headers, body)
+        """
+        with self._lock:
+            self.stats['batches'] += 1
+        message = email.parser.BytesParser().parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        boundary = f'batch_{random.getrandbits(64):016x}'
+        parts = []
+        for part in message.get_payload():
+            raw = part.get_payload()
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+            head, _, part_body = raw.replace('\r\n', '\n').partition('\n\n')
+            request_line, *header_lines = head.strip('\n').split('\n')
+            method, target, _ = request_line.split(' ', 2)
+            part_headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                part_headers[name.strip().lower()] = value.strip()
+
+            status, response_headers, content = self.handle(method, target, part_headers, part_body.encode('utf-8'))
+            response = f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+            for name, value in response_headers.items():
+                response += f'{name}: {value}\r\n'
+            response += f'Content-Length: {len(content)}\r\n\r\n'
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{part["Content-ID"].strip("<>")}>\r\n\r\n'.encode()
+                + response.encode() + content + b'\r\n'
+            )
+        return 200, {'Content-Type': f'multipart/mixed; boundary={boundary}'}, b''.join(parts) + f'--{boundary}--\r\n'.encode()
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the Google endpoints
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self):
+        google = self.server.google
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = urlsplit(self.path).path
+
+        if path == '/_stats':
+            status, headers, content = _json(200, google.get_stats())
+        elif path == '/_reset':
+            google.reset()
+            status, headers, content = 204, {}, b''
+        else:
+            google.wait()
+            with google._lock:
+                google.stats['round_trips'] += 1
+            if path in ('/batch', '/batch/drive/v3') and self.command == 'POST':
+                status, headers, content = google.handle_batch(self.headers.get('Content-Type', ''), body)
+            else:
+                headers = {name.lower(): value for name, value in self.headers.items()}
+                status, headers, content = google.handle(self.command, self.path, headers, body)
+
+        self.send_response(status, _REASONS.get(status))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_DELETE = do_PATCH = _respond
+
+def create_server(host='127.0.0.1', port=0, **options):
+    """
+    Create the fake server; call serve_forever() on it to start answering.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+        **options: Options of FakeGoogle
+
+    Returns:
+        ThreadingHTTPServer: The server, with its FakeGoogle state as
+            `google` and its root URL as `url`
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.google = FakeGoogle(**options)
+    server.url = f'http://{host}:{server.server_address[1]}'
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local fake of the Drive and Docs APIs.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on, 0 for any free port")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Latency of each round trip")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Maximum random latency added to each round trip")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0, help="Share of API calls failing with 429")
+    parser.add_argument('--retry-after', type=float, help="Retry-After of the 429 responses, in seconds")
+    parser.add_argument('--pdf-kb', type=int, default=64, help="Size of the exported PDFs")
+    args = parser.parse_args()
+
+    server = create_server(
+        args.host,
+        args.port,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+        pdf_size=args.pdf_kb * 1024,
+    )
+    # First line of output: the root URL, read by benchmark_pipeline.py
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+Orchestration of the document generation pipelines.
+
+Each template goes through copy -> replace -> export -> delete. The pipelines
+of different templates are independent network-bound chains, so they run in
+parallel on a bounded thread pool together with the database insert.
+
+With BATCH_HTTP_REQUESTS, the pipelines of all templates advance together
+instead: the copies, the batchUpdates and the deletes of every template are
+each sent in one HTTP batch request, and only the exports, which cannot be
+batched, run in parallel. With GOOGLE_API_TRANSPORT=async, the pipelines of
+all templates run together on the event loop of async_google_api instead.
+"""
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from document_service import (
+    replace_variables,
+    document_copy,
+    create_document_copies,
+    batch_replace_variables,
+    delete_documents,
+)
+from pdf_service import export_as_pdf
+from placeholder_service import filter_replacements
+from db_service import save_document
+from google_api import track_api_calls
+import tracing
+import render_cache
+import local_renderer
+from config import (
+    DOCUMENT_ID,
+    OUTPUT_FILENAME,
+    COVER_LETTER_DOCUMENT_ID,
+    COVER_LETTER_OUTPUT_FILENAME,
+    GENERATION_MAX_WORKERS,
+    RENDER_CACHE_ENABLED,
+    RENDER_BACKEND,
+    GOOGLE_API_TRANSPORT,
+    BATCH_HTTP_REQUESTS,
+    PLACEHOLDER_DISCOVERY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Templates rendered for every application
+TEMPLATES = [
+    {
+        'name': 'cv',
+        'label': 'CV',
+        'download_label': 'Télécharger le CV',
+        'template_id': DOCUMENT_ID,
+        'output_filename': OUTPUT_FILENAME,
+    },
+    {
+        'name': 'cover_letter',
+        'label': 'Lettre de Motivation',
+        'download_label': 'Télécharger la Lettre de Motivation',
+        'template_id': COVER_LETTER_DOCUMENT_ID,
+        'output_filename': COVER_LETTER_OUTPUT_FILENAME,
+    },
+]
+
+# Name of the result reported for the database insert
+DATABASE_RESULT = 'database'
+
+def render_template(template_id, variables, output_path, use_cache=RENDER_CACHE_ENABLED):
+    """
+    Render a template to PDF with the configured backend.
+
+    The 'google' backend copies the template, fills the copy, exports it and
+    deletes it; the 'local' backend fills a cached DOCX export instead, see
+    local_renderer. When the cache is enabled and the same template revision
+    was already rendered with the same variables, the cached PDF is reused.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+        variables (dict): Dictionary of variables and their replacement values
+        output_path (str): Path of the PDF file to write
+        use_cache (bool): Whether to use the render cache
+
+    Returns:
+        str: The path of the written PDF
+    """
+    with tracing.span('render_template', template_id=template_id, backend=RENDER_BACKEND) as render_span:
+        if use_cache:
+            revision = render_cache.get_template_revision(template_id)
+            key = render_cache.cache_key(template_id, revision, variables, backend=RENDER_BACKEND)
+            if render_cache.fetch(key, output_path):
+                render_span.set('cached', True)
+                return output_path
+
+        if RENDER_BACKEND == 'local':
+            local_renderer.render_template(template_id, variables, output_path)
+        else:
+            _render_with_google(template_id, variables, output_path)
+
+        if use_cache:
+            render_cache.store(key, output_path)
+
+        return output_path
+
+def _render_with_google(template_id, variables, output_path):
+    # Work on a copy of the template, deleted even if a step fails
+    with document_copy(template_id) as copy_id:
+        # Ensure copy_id is different from template_id
+        if copy_id == template_id:
+            raise ValueError(f"Copy ID is the same as template ID: {template_id}")
+
+        # Replace variables in the copy, not the template
+        replace_variables(copy_id, variables, template_id=template_id)
+
+        # Export the copy as PDF
+        export_as_pdf(copy_id, output_path)
+
+def render_templates(jobs, use_cache=RENDER_CACHE_ENABLED, on_done=None):
+    """
+    Render several templates with the 'google' backend, batching the
+    requests of their pipelines.
+
+    Cached PDFs are reused like in render_template(). For the other jobs,
+    with the httplib2 transport, the copies, the batchUpdates and the deletes
+    are each sent in one HTTP batch request and the exports run in parallel;
+    with the async transport, every pipeline is in flight at once on the
+    event loop of async_google_api.
+
+    Args:
+        jobs (list): (template_id, variables, output_path) tuples
+        use_cache (bool): Whether to use the render cache
+        on_done (callable, optional): Called from the calling thread with
+            the index of each job and None or its exception, as it finishes
+
+    Returns:
+        list: For each job, None or the exception raised while rendering it
+    """
+    with tracing.span('render_templates', size=len(jobs)):
+        return _render_templates(jobs, use_cache, on_done)
+
+def _render_templates(jobs, use_cache, on_done):
+    errors = [None] * len(jobs)
+    keys = {}
+    pending = list(range(len(jobs)))
+    if use_cache:
+        revisions = render_cache.get_template_revisions([template_id for template_id, _, _ in jobs])
+        for index, (template_id, variables, output_path) in enumerate(jobs):
+            keys[index] = render_cache.cache_key(template_id, revisions[template_id], variables, backend=RENDER_BACKEND)
+        pending = [index for index in pending if not render_cache.fetch(keys[index], jobs[index][2])]
+    if on_done is not None:
+        for index in sorted(set(range(len(jobs))) - set(pending)):
+            on_done(index, None)
+    if not pending:
+        return errors
+
+    if GOOGLE_API_TRANSPORT == 'async':
+        _render_on_event_loop(jobs, pending, errors, on_done)
+    else:
+        _render_batched(jobs, pending, errors)
+        if on_done is not None:
+            for index in pending:
+                on_done(index, errors[index])
+
+    if use_cache:
+        for index in pending:
+            if errors[index] is None:
+                render_cache.store(keys[index], jobs[index][2])
+    return errors
+
+def _render_on_event_loop(jobs, pending, errors, on_done):
+    # Imported here: httpx is only needed by the async transport
+    import async_google_api
+
+    replacements = {index: jobs[index][1] for index in pending}
+    if PLACEHOLDER_DISCOVERY:
+        planned = filter_replacements([(jobs[index][1], jobs[index][0]) for index in pending])
+        replacements = {index: needed for index, (needed, _) in zip(pending, planned)}
+
+    futures = {
+        async_google_api.submit(async_google_api.render_template(jobs[index][0], replacements[index], jobs[index][2])): index
+        for index in pending
+    }
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            future.result()
+        except Exception as error:
+            errors[index] = error
+        if on_done is not None:
+            on_done(index, errors[index])
+
+def _render_batched(jobs, pending, errors):
+    copies = create_document_copies([jobs[index][0] for index in pending])
+    copy_ids = [copy_id for copy_id in copies if not isinstance(copy_id, Exception)]
+    try:
+        for index, copy_id in zip(pending, copies):
+            if isinstance(copy_id, Exception):
+                errors[index] = copy_id
+        live = [(index, copy_id) for index, copy_id in zip(pending, copies) if errors[index] is None]
+
+        updates = batch_replace_variables([(copy_id, jobs[index][1], jobs[index][0]) for index, copy_id in live])
+        for (index, _), error in zip(live, updates):
+            errors[index] = error
+        live = [(index, copy_id) for index, copy_id in live if errors[index] is None]
+
+        # Media downloads cannot be batched; export in parallel instead, in
+        # the context of the caller so that the calls are tracked
+        with ThreadPoolExecutor(max_workers=max(len(live), 1), thread_name_prefix='export') as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, export_as_pdf, copy_id, jobs[index][2]): index
+                for index, copy_id in live
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    errors[futures[future]] = error
+    finally:
+        for copy_id, error in delete_documents(copy_ids).items():
+            # Left to the janitor
+            logger.warning(f"Could not delete copy {copy_id}: {error}")
+
+def _use_batched_pipeline(templates):
+    # HTTP batch requests are a googleapiclient feature; the async transport
+    # runs the pipelines together on its event loop instead
+    if RENDER_BACKEND != 'google' or len(templates) < 2:
+        return False
+    return GOOGLE_API_TRANSPORT == 'async' or BATCH_HTTP_REQUESTS
+
+def _run_template(template, variables, output_path):
+    start = time.monotonic()
+    result = {
+        'name': template['name'],
+        'label': template['label'],
+        'output_path': None,
+        'error': None,
+    }
+    with track_api_calls() as api_calls:
+        try:
+            logger.info(f"Processing {template['label']} document")
+            result['output_path'] = render_template(template['template_id'], variables, output_path)
+        except Exception as error:
+            logger.error(f"Error generating {template['label']}: {error}")
+            result['error'] = error
+    result['duration'] = time.monotonic() - start
+    result['api_calls'] = sum(api_calls.values())
+    logger.info(f"{template['label']} used {result['api_calls']} Google API calls: {api_calls}")
+    return result
+
+def _run_templates_batched(templates, variables, output_dir):
+    start = time.monotonic()
+    results = [
+        {
+            'name': template['name'],
+            'label': template['label'],
+            'output_path': None,
+            'error': None,
+        }
+        for template in templates
+    ]
+    jobs = [(template['template_id'], variables, os.path.join(output_dir, template['output_filename'])) for template in templates]
+    with track_api_calls() as api_calls:
+        logger.info(f"Processing {', '.join(template['label'] for template in templates)} documents together")
+        try:
+            errors = render_templates(jobs)
+        except Exception as error:
+            errors = [error] * len(jobs)
+    duration = time.monotonic() - start
+    for result, (_, _, output_path), error in zip(results, jobs, errors):
+        if error is not None:
+            logger.error(f"Error generating {result['label']}: {error}")
+            result['error'] = error
+        else:
+            result['output_path'] = output_path
+        result['duration'] = duration
+    logger.info(f"Templates used {sum(api_calls.values())} Google API calls in {api_calls.round_trips} HTTP round trips: {api_calls}")
+    return results
+
+def _tracked(api_calls, function, *args):
+    # Runs a task in a worker thread, counting its calls in api_calls too
+    if api_calls is None:
+        return function(*args)
+    with track_api_calls(api_calls):
+        return function(*args)
+
+def _run_save(variables):
+    start = time.monotonic()
+    result = {
+        'name': DATABASE_RESULT,
+        'label': 'Base de données',
+        'document_id': None,
+        'error': None,
+    }
+    try:
+        logger.info("Attempting to save document to database")
+        result['document_id'] = save_document(variables)
+    except Exception as error:
+        logger.error(f"Error saving document to database: {error}")
+        result['error'] = error
+    result['duration'] = time.monotonic() - start
+    return result
+
+def iter_generation(variables, output_dir, templates=None, save=True, max_workers=GENERATION_MAX_WORKERS, api_calls=None):
+    """
+    Run the template pipelines and the database insert in parallel.
+
+    Results are yielded as soon as each task finishes, so callers can report
+    progress per document; with batched pipelines, the template results come
+    together. A failing pipeline never aborts the other ones; its exception
+    is reported in the 'error' entry of its result.
+
+    Args:
+        variables (dict): Dictionary of variables and their replacement values
+        output_dir (str): Directory where the PDFs are written
+        templates (list, optional): Templates to render, defaults to TEMPLATES
+        save (bool): Whether to save the variables to the database
+        max_workers (int): Maximum number of tasks run at the same time
+        api_calls (ApiCallCounts, optional): Counters filled in with the
+            Google API calls and HTTP round trips of the whole generation
+
+    Yields:
+        dict: One result per template (name, label, output_path, error,
+            duration, and api_calls unless the pipelines are batched) and, if
+            save is True, one for the database insert (name, label,
+            document_id, error, duration)
+    """
+    if templates is None:
+        templates = TEMPLATES
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='generation') as executor:
+        # Tasks run in the context of the caller, so that their spans are
+        # children of its current one
+        futures = []
+        if _use_batched_pipeline(templates):
+            futures.append(executor.submit(contextvars.copy_context().run, _tracked, api_calls,
+                                           _run_templates_batched, templates, variables, output_dir))
+        else:
+            for template in templates:
+                output_path = os.path.join(output_dir, template['output_filename'])
+                futures.append(executor.submit(contextvars.copy_context().run, _tracked, api_calls,
+                                               _run_template, template, variables, output_path))
+        if save:
+            futures.append(executor.submit(contextvars.copy_context().run, _run_save, variables))
+
+        for future in as_completed(futures):
+            result = future.result()
+            if isinstance(result, list):
+                yield from result
+            else:
+                yield result
+
+def generate_documents(variables, output_dir, templates=None, save=True, max_workers=GENERATION_MAX_WORKERS, api_calls=None):
+    """
+    Run the generation and wait for every task to finish.
+
+    Args:
+        variables (dict): Dictionary of variables and their replacement values
+        output_dir (str): Directory where the PDFs are written
+        templates (list, optional): Templates to render, defaults to TEMPLATES
+        save (bool): Whether to save the variables to the database
+        max_workers (int): Maximum number of tasks run at the same time
+        api_calls (ApiCallCounts, optional): Counters filled in with the
+            Google API calls and HTTP round trips of the whole generation
+
+    Returns:
+        dict: Results keyed by name, see iter_generation()
+    """
+    with tracing.span('generation'):
+        return {
+            result['name']: result
+            for result in iter_generation(variables, output_dir, templates, save, max_workers, api_calls)
+        }
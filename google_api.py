@@ -0,0 +1,284 @@
+"""
+Process-wide registry of Google API service clients.
+
+Building a service client means loading credentials, parsing a discovery
+document and creating an HTTP transport. This module does that once per
+process and hands out the same `drive` v3 and `docs` v1 clients to every
+caller.
+
+googleapiclient's discovery module and the HTTP transport are slow to
+import, so they are imported on first use rather than with this module.
+
+Every request goes through api_scheduler, which paces it against the API
+quotas and retries transient errors, and runs in a tracing span named after
+its method id, retries and quota waits included.
+"""
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from auth import get_credentials
+import api_scheduler
+import tracing
+from config import DOWNLOAD_CHUNK_SIZE, GOOGLE_API_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+# Services used by the application: name -> version
+DRIVE = ('drive', 'v3')
+DOCS = ('docs', 'v1')
+
+# Maximum number of requests in one batch request
+BATCH_REQUEST_LIMIT = 100
+
+# Paths of the services and of their batch endpoint under the API root, used
+# when GOOGLE_API_ENDPOINT replaces the Google root URLs
+SERVICE_PATHS = {'drive': 'drive/v3/', 'docs': ''}
+BATCH_PATHS = {'drive': 'batch/drive/v3', 'docs': 'batch'}
+
+_lock = threading.RLock()
+_services = {}
+
+# httplib2.Http is not thread-safe, so each thread gets its own keep-alive
+# transport. All of them share the same in-memory credentials.
+_local = threading.local()
+
+# API call counters active in the current thread or task, see track_api_calls()
+api_call_trackers = contextvars.ContextVar('api_call_trackers', default=())
+# The same counters are shared by the worker threads of a generation
+_counts_lock = threading.Lock()
+
+class ApiCallCounts(dict):
+    """
+    API method id -> number of calls, plus the number of HTTP round trips
+    they took (a batch request carries many calls in one round trip).
+    """
+    round_trips = 0
+
+def get_shared_credentials():
+    """
+    Get the process-wide credentials, kept fresh by auth.
+
+    Returns:
+        Credentials: Valid Google API credentials
+    """
+    return get_credentials()
+
+def _authorized_http():
+    """
+    Get the calling thread's authorized keep-alive HTTP transport.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        import httplib2
+        import google_auth_httplib2
+        http = google_auth_httplib2.AuthorizedHttp(get_shared_credentials(), http=httplib2.Http())
+        _local.http = http
+    return http
+
+def _build_request(http, *args, **kwargs):
+    # Service objects are shared between threads; bind each request to the
+    # transport of the thread that builds it instead of the one used at build().
+    from googleapiclient.http import HttpRequest
+    return HttpRequest(_authorized_http(), *args, **kwargs)
+
+def get_service(name, version):
+    """
+    Get a shared Google API service client.
+
+    The client is built once from the discovery document bundled with
+    googleapiclient, so no discovery request is made.
+
+    Args:
+        name (str): API name, e.g. 'drive'
+        version (str): API version, e.g. 'v3'
+
+    Returns:
+        Resource: The service client
+    """
+    # Make sure the credentials are still valid before handing out a client
+    get_shared_credentials()
+    key = (name, version)
+    service = _services.get(key)
+    if service is None:
+        with _lock:
+            service = _services.get(key)
+            if service is None:
+                from googleapiclient.discovery import build
+                logger.info(f"Building Google API client for {name} {version}")
+                client_options = None
+                if GOOGLE_API_ENDPOINT:
+                    client_options = {'api_endpoint': f"{GOOGLE_API_ENDPOINT}/{SERVICE_PATHS[name]}"}
+                service = build(
+                    name,
+                    version,
+                    http=_authorized_http(),
+                    requestBuilder=_build_request,
+                    static_discovery=True,
+                    cache_discovery=False,
+                    client_options=client_options,
+                )
+                _services[key] = service
+    return service
+
+def get_drive_service():
+    """
+    Get the shared Drive v3 client.
+
+    Returns:
+        Resource: The Drive service client
+    """
+    return get_service(*DRIVE)
+
+def get_docs_service():
+    """
+    Get the shared Docs v1 client.
+
+    Returns:
+        Resource: The Docs service client
+    """
+    return get_service(*DOCS)
+
+def execute(request, **kwargs):
+    """
+    Execute a Google API request through the scheduler, counting every
+    attempt for track_api_calls().
+
+    Args:
+        request (HttpRequest): The request to execute
+        **kwargs: Passed through to request.execute()
+
+    Returns:
+        The deserialized response
+    """
+    def send():
+        record_api_call(request.methodId)
+        return request.execute(**kwargs)
+
+    with tracing.span(request.methodId):
+        return api_scheduler.call(request.methodId, send)
+
+def execute_batch(service, requests):
+    """
+    Execute Google API requests as multipart batch requests.
+
+    Up to BATCH_REQUEST_LIMIT requests share one HTTP round trip. Quota still
+    applies per request, so each of them is scheduled and counted.
+
+    Args:
+        service (Resource): The service client the requests were built from
+        requests (list): The requests to execute, all of the same method
+
+    Returns:
+        list: For each request, its deserialized response or the exception
+            it raised
+    """
+    results = []
+    for start in range(0, len(requests), BATCH_REQUEST_LIMIT):
+        group = requests[start:start + BATCH_REQUEST_LIMIT]
+        with tracing.span(f"{group[0].methodId}.batch", size=len(group)):
+            results.extend(api_scheduler.call_batch(group[0].methodId, group, lambda items: _send_batch(service, items)))
+    return results
+
+def _send_batch(service, requests):
+    responses = {}
+
+    def callback(request_id, response, exception):
+        responses[request_id] = exception if exception is not None else response
+
+    if GOOGLE_API_ENDPOINT:
+        # The batch URI of the discovery document ignores client_options
+        from googleapiclient.http import BatchHttpRequest
+        batch_path = BATCH_PATHS['drive' if requests[0].methodId.startswith('drive.') else 'docs']
+        batch = BatchHttpRequest(callback=callback, batch_uri=f"{GOOGLE_API_ENDPOINT}/{batch_path}")
+    else:
+        batch = service.new_batch_http_request(callback=callback)
+    for index, request in enumerate(requests):
+        record_api_call(request.methodId, round_trip=False)
+        batch.add(request, request_id=str(index))
+    record_round_trip()
+    batch.execute(http=_authorized_http())
+    return [responses.get(str(index)) for index in range(len(requests))]
+
+def download(request, file, chunksize=DOWNLOAD_CHUNK_SIZE):
+    """
+    Stream a media request (e.g. files().export_media) into a file object.
+
+    The response is written chunk by chunk, so the whole file is never held
+    in memory. Each chunk is one HTTP request, scheduled and counted as an
+    API call; a failed chunk is retried without restarting the download.
+
+    Args:
+        request (HttpRequest): The media request
+        file: A binary file object to write to
+        chunksize (int): Bytes requested per chunk
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    downloader = MediaIoBaseDownload(file, request, chunksize=chunksize)
+
+    def next_chunk():
+        record_api_call(request.methodId)
+        return downloader.next_chunk()
+
+    done = False
+    with tracing.span(request.methodId) as download_span:
+        chunks = 0
+        while not done:
+            _, done = api_scheduler.call(request.methodId, next_chunk)
+            chunks += 1
+        download_span.set('chunks', chunks)
+
+def record_api_call(method_id, round_trip=True):
+    """
+    Count one API call in every active track_api_calls() block.
+
+    Args:
+        method_id (str): API method id, e.g. 'drive.files.copy'
+        round_trip (bool): Whether the call is its own HTTP round trip,
+            False for the calls of a batch request
+    """
+    trackers = api_call_trackers.get()
+    if not trackers:
+        return
+    with _counts_lock:
+        for counts in trackers:
+            counts[method_id] = counts.get(method_id, 0) + 1
+            if round_trip:
+                counts.round_trips += 1
+
+def record_round_trip():
+    """
+    Count one HTTP round trip, e.g. a batch request, in every active
+    track_api_calls() block.
+    """
+    trackers = api_call_trackers.get()
+    if not trackers:
+        return
+    with _counts_lock:
+        for counts in trackers:
+            counts.round_trips += 1
+
+@contextmanager
+def track_api_calls(counts=None):
+    """
+    Count the Google API calls made by the calling thread inside the block.
+
+    Calls made through the async transport on behalf of this thread are
+    counted too, see async_google_api.run().
+
+    Args:
+        counts (ApiCallCounts, optional): Counters to add to, e.g. to sum the
+            calls of several threads. A new one is created by default.
+
+    Yields:
+        ApiCallCounts: API method id (e.g. 'drive.files.copy') -> number of
+            calls, and the number of HTTP round trips, filled in as calls are
+            made
+    """
+    if counts is None:
+        counts = ApiCallCounts()
+    token = api_call_trackers.set(api_call_trackers.get() + (counts,))
+    try:
+        yield counts
+    finally:
+        api_call_trackers.reset(token)
@@ -0,0 +1,63 @@
+"""
+Reclaim the temporary Copy_<timestamp> documents leaked in Drive.
+
+The leaked copies are found with one paged files.list query and deleted
+with Drive batch requests of up to 100 deletes each.
+
+Usage:
+    python janitor.py [--max-age 3600] [--dry-run]
+"""
+import time
+import argparse
+import logging
+from document_service import list_copies, delete_documents
+from config import COPY_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+def reclaim_copies(max_age=COPY_MAX_AGE, exclude=(), dry_run=False):
+    """
+    Delete the Copy_<timestamp> documents older than max_age.
+
+    Args:
+        max_age (float): Minimum age of the deleted copies, in seconds
+        exclude (iterable): IDs of copies to keep, e.g. the pooled ones
+        dry_run (bool): Only list the copies
+
+    Returns:
+        dict: 'found', 'reclaimed' and 'failed' numbers of copies and
+            'duration' in seconds
+    """
+    start = time.monotonic()
+    exclude = set(exclude)
+    copy_ids = [copy['id'] for copy in list_copies(max_age) if copy['id'] not in exclude]
+
+    errors = {} if dry_run else delete_documents(copy_ids)
+    for copy_id, error in errors.items():
+        logger.warning(f"Could not delete copy {copy_id}: {error}")
+
+    result = {
+        'found': len(copy_ids),
+        'reclaimed': 0 if dry_run else len(copy_ids) - len(errors),
+        'failed': len(errors),
+        'duration': time.monotonic() - start,
+    }
+    if result['found']:
+        logger.info(f"Janitor: {result['reclaimed']}/{result['found']} leaked copies reclaimed in {result['duration']:.1f}s")
+    return result
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Delete the temporary document copies leaked in Google Drive.")
+    parser.add_argument('--max-age', type=float, default=COPY_MAX_AGE, help="Minimum age of the deleted copies, in seconds")
+    parser.add_argument('--dry-run', action='store_true', help="Only count the leaked copies")
+    args = parser.parse_args()
+
+    result = reclaim_copies(args.max_age, dry_run=args.dry_run)
+    print(f"{result['found']} leaked copies found")
+    if not args.dry_run:
+        print(f"{result['reclaimed']} reclaimed, {result['failed']} failed in {result['duration']:.1f}s")
+    return 1 if result['failed'] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
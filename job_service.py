@@ -0,0 +1,229 @@
+"""
+Postgres-backed queue of generation jobs.
+
+The app enqueues a job per generation request; worker.py processes claim
+them with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can
+poll the same table without two of them claiming the same queued job. The
+worker running a job updates its heartbeat every JOB_HEARTBEAT_INTERVAL
+seconds; a job whose heartbeat stopped for JOB_TIMEOUT seconds is queued
+again. A job can then run more than once (e.g. when its first worker was
+only cut off from the database), so:
+
+- only the worker holding the latest attempt records the outcome, see
+  finish_job();
+- the document of a job is inserted once, see save_job_document().
+"""
+import logging
+import psycopg2
+from psycopg2.extras import Json
+from db_service import get_connection, insert_documents
+from config import JOB_TIMEOUT, JOB_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = ['id', 'status', 'variables', 'output_dir', 'result', 'error', 'attempts', 'worker', 'document_id',
+               'created_at', 'started_at', 'heartbeat_at', 'finished_at']
+
+def enqueue_job(variables, output_dir):
+    """
+    Queue a generation.
+
+    Args:
+        variables (dict): Dictionary of variables and their replacement values
+        output_dir (str): Directory where the worker writes the PDFs
+
+    Returns:
+        int: ID of the job, or None if an error occurred
+    """
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO generation_jobs (variables, output_dir) VALUES (%s, %s) RETURNING id",
+                (Json(variables), output_dir)
+            )
+            job_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+        logger.info(f"Queued generation job {job_id}")
+        return job_id
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error queueing generation job: {error}")
+        return None
+
+def claim_job(worker):
+    """
+    Claim the oldest queued job.
+
+    Args:
+        worker (str): Name of the claiming worker, recorded on the job
+
+    Returns:
+        dict: The claimed job, now running, or None if the queue is empty
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE generation_jobs
+            SET status = 'running', worker = %s, attempts = attempts + 1,
+                started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM generation_jobs
+                WHERE status = 'queued'
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {', '.join(JOB_COLUMNS)}
+        """, (worker,))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+def heartbeat_job(job):
+    """
+    Tell that the worker of a job is still running it.
+
+    Args:
+        job (dict): The job, as returned by claim_job()
+
+    Returns:
+        bool: False if the job was queued again meanwhile and no longer
+            belongs to this attempt
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE generation_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'running' AND worker = %s AND attempts = %s
+            """,
+            (job['id'], job['worker'], job['attempts'])
+        )
+        owned = cur.rowcount == 1
+        conn.commit()
+        cur.close()
+    return owned
+
+def finish_job(job, result=None, error=None):
+    """
+    Record the outcome of a job.
+
+    The outcome is only recorded if the job still belongs to this attempt,
+    so a worker that was presumed dead never overwrites the outcome of the
+    attempt that replaced it.
+
+    Args:
+        job (dict): The job, as returned by claim_job()
+        result (dict, optional): JSON-serializable result of the job
+        error (str, optional): Error message; the job is marked as failed if given
+
+    Returns:
+        bool: Whether the outcome was recorded
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE generation_jobs
+            SET status = %s, result = %s, error = %s, finished_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'running' AND worker = %s AND attempts = %s
+            """,
+            ('failed' if error else 'done', Json(result), error, job['id'], job['worker'], job['attempts'])
+        )
+        recorded = cur.rowcount == 1
+        conn.commit()
+        cur.close()
+    if not recorded:
+        logger.warning(f"Outcome of generation job {job['id']} attempt {job['attempts']} discarded: "
+                       f"the job was queued again")
+    return recorded
+
+def save_job_document(job):
+    """
+    Save the document of a job, once however many times the job runs.
+
+    The job row is locked while the document is inserted and its ID recorded
+    on the job, in one transaction.
+
+    Args:
+        job (dict): The job, as returned by claim_job()
+
+    Returns:
+        int: ID of the document, or None if an error occurred
+    """
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT document_id FROM generation_jobs WHERE id = %s FOR UPDATE", (job['id'],))
+            row = cur.fetchone()
+            if row is None:
+                raise ValueError(f"Generation job {job['id']} does not exist")
+            document_id = row[0]
+            if document_id is None:
+                [document_id] = insert_documents(cur, [job['variables']])
+                cur.execute("UPDATE generation_jobs SET document_id = %s WHERE id = %s", (document_id, job['id']))
+                logger.info(f"Saved document {document_id} of generation job {job['id']}")
+            else:
+                logger.info(f"Document {document_id} of generation job {job['id']} already saved")
+            conn.commit()
+            cur.close()
+        return document_id
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error saving document of generation job {job['id']}: {error}")
+        return None
+
+def get_job(job_id):
+    """
+    Get a job.
+
+    Args:
+        job_id (int): ID of the job
+
+    Returns:
+        dict: The job, or None if it does not exist or an error occurred
+    """
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM generation_jobs WHERE id = %s", (job_id,))
+            row = cur.fetchone()
+            cur.close()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error retrieving generation job {job_id}: {error}")
+        return None
+
+def requeue_abandoned_jobs(timeout=JOB_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Queue again the jobs left running by dead workers.
+
+    Jobs that already used max_attempts attempts are marked as failed.
+
+    Args:
+        timeout (float): Seconds without heartbeat after which a running job is abandoned
+        max_attempts (int): Attempts of a job before it fails
+
+    Returns:
+        int: Number of requeued or failed jobs
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE generation_jobs
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                error = CASE WHEN attempts >= %s THEN 'Abandoned by its worker' ELSE error END,
+                finished_at = CASE WHEN attempts >= %s THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE status = 'running'
+              AND coalesce(heartbeat_at, started_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """,
+            (max_attempts, max_attempts, max_attempts, timeout)
+        )
+        count = cur.rowcount
+        conn.commit()
+        cur.close()
+    if count:
+        logger.warning(f"Requeued or failed {count} abandoned generation jobs")
+    return count
@@ -0,0 +1,279 @@
+"""
+Local rendering backend.
+
+Instead of copying the template in Drive for every document, each template is
+exported once as DOCX and cached per revision. Placeholders are then replaced
+directly in the DOCX XML and the result is converted to PDF with a headless
+LibreOffice, so rendering makes no Google API call once the template is
+cached.
+"""
+import os
+import re
+import glob
+import shutil
+import hashlib
+import logging
+import tempfile
+import zipfile
+import threading
+import time
+import subprocess
+from bisect import bisect_right
+from xml.sax.saxutils import escape, unescape
+from google_api import get_drive_service, download
+from render_cache import get_template_revision
+from config import TEMPLATE_CACHE_DIR, TEMPLATE_CACHE_TTL, LIBREOFFICE_BINARY, LIBREOFFICE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Parts of a DOCX package that can hold placeholders
+_TEXT_PARTS = re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+# A <w:t> text node (self-closing <w:t/> nodes are empty and skipped)
+_TEXT_NODE = re.compile(r'(<w:t(?:\s[^>]*?)?(?<!/)>)(.*?)(</w:t>)', re.S)
+
+# Seconds between two cleanups of the exports of previous revisions
+_CLEANUP_INTERVAL = 60
+
+_template_locks = {}
+_template_locks_lock = threading.Lock()
+_cleanup_lock = threading.Lock()
+_last_cleanup = None
+
+def _template_lock(template_id):
+    with _template_locks_lock:
+        return _template_locks.setdefault(template_id, threading.Lock())
+
+def get_template_docx(template_id):
+    """
+    Get the local DOCX export of the current revision of a template.
+
+    The template is exported from Drive only when its revision changed since
+    the last export; older exports of the same template are removed by
+    cleanup_template_exports() once TEMPLATE_CACHE_TTL has passed.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+
+    Returns:
+        str: Path of the cached DOCX file
+    """
+    revision = get_template_revision(template_id)
+    revision_hash = hashlib.sha256(revision.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(TEMPLATE_CACHE_DIR, f"{template_id}-{revision_hash}.docx")
+    _maybe_cleanup()
+    if os.path.exists(path):
+        return path
+
+    with _template_lock(template_id):
+        if os.path.exists(path):
+            return path
+
+        logger.info(f"Exporting template {template_id} (revision {revision}) as DOCX")
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        request = get_drive_service().files().export_media(fileId=template_id, mimeType=DOCX_MIME_TYPE)
+        fd, temp_path = tempfile.mkstemp(dir=TEMPLATE_CACHE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                download(request, temp_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    return path
+
+def _maybe_cleanup():
+    global _last_cleanup
+    now = time.monotonic()
+    with _cleanup_lock:
+        if _last_cleanup is not None and now - _last_cleanup < _CLEANUP_INTERVAL:
+            return
+        _last_cleanup = now
+    cleanup_template_exports()
+
+def cleanup_template_exports(max_age=TEMPLATE_CACHE_TTL):
+    """
+    Remove the template exports superseded by a newer revision for max_age seconds.
+
+    The app and the worker processes share the cache directory, so a file
+    may be removed concurrently by another process; that is not an error.
+
+    Args:
+        max_age (float): Seconds an export is kept after a newer export of
+            the same template was written
+
+    Returns:
+        int: Number of removed exports
+    """
+    exports = {}
+    for path in glob.glob(os.path.join(TEMPLATE_CACHE_DIR, '*.docx')):
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        # <template_id>-<revision hash>.docx, the hash has no '-'
+        template_id = os.path.basename(path).rsplit('-', 1)[0]
+        exports.setdefault(template_id, []).append((mtime, path))
+
+    cutoff = time.time() - max_age
+    removed = 0
+    for paths in exports.values():
+        paths.sort()
+        # An export is superseded when the next newer one was written
+        for (_, path), (superseded_at, _) in zip(paths, paths[1:]):
+            if superseded_at >= cutoff:
+                continue
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    if removed:
+        logger.info(f"Removed {removed} exports of previous template revisions")
+    return removed
+
+def _placeholder_pattern(replacements):
+    # Longest placeholders first so that no placeholder shadows another one
+    placeholders = sorted((f'{{{{ {key} }}}}' for key in replacements), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(placeholder) for placeholder in placeholders))
+
+def _to_xml_text(text):
+    # Line breaks and tabs are separate elements in WordprocessingML
+    text = escape(text)
+    text = text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+    return text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+
+def substitute_placeholders(xml, replacements):
+    """
+    Replace the `{{ key }}` placeholders of a WordprocessingML part.
+
+    Word and Google Docs exports often split a placeholder over several runs,
+    so the text of all <w:t> nodes is matched as one string. Each replacement
+    value goes into the node where its placeholder starts and the rest of the
+    placeholder is removed from the following nodes; formatting of the first
+    run is kept, like replaceAllText does.
+
+    Args:
+        xml (str): The XML of the part
+        replacements (dict): Dictionary of variables and their replacement values
+
+    Returns:
+        str: The XML with the placeholders replaced
+    """
+    if not replacements:
+        return xml
+
+    nodes = list(_TEXT_NODE.finditer(xml))
+    texts = [unescape(node.group(2), {'&quot;': '"', '&apos;': "'"}) for node in nodes]
+    full_text = ''.join(texts)
+    matches = list(_placeholder_pattern(replacements).finditer(full_text))
+    if not matches:
+        return xml
+
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text)
+
+    new_texts = [[] for _ in nodes]
+
+    def copy_range(start, end):
+        # Copy the original text [start, end) to the nodes that own it
+        index = max(bisect_right(starts, start) - 1, 0)
+        while start < end:
+            node_end = starts[index] + len(texts[index])
+            if start < node_end:
+                chunk_end = min(end, node_end)
+                new_texts[index].append(full_text[start:chunk_end])
+                start = chunk_end
+            index += 1
+
+    position = 0
+    for match in matches:
+        copy_range(position, match.start())
+        key = match.group(0)[3:-3]
+        new_texts[bisect_right(starts, match.start()) - 1].append(str(replacements[key]))
+        position = match.end()
+    copy_range(position, len(full_text))
+
+    parts = []
+    position = 0
+    for node, text, new_text in zip(nodes, texts, new_texts):
+        new_text = ''.join(new_text)
+        if new_text == text:
+            continue
+        open_tag = node.group(1)
+        if 'xml:space=' not in open_tag:
+            open_tag = open_tag[:-1] + ' xml:space="preserve">'
+        parts.append(xml[position:node.start()])
+        parts.append(f"{open_tag}{_to_xml_text(new_text)}{node.group(3)}")
+        position = node.end()
+    parts.append(xml[position:])
+    return ''.join(parts)
+
+def fill_docx(template_path, replacements, output_path):
+    """
+    Write a copy of a DOCX file with its placeholders replaced.
+
+    Args:
+        template_path (str): Path of the DOCX template
+        replacements (dict): Dictionary of variables and their replacement values
+        output_path (str): Path of the DOCX file to write
+    """
+    with zipfile.ZipFile(template_path) as source, \
+            zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if _TEXT_PARTS.match(item.filename):
+                data = substitute_placeholders(data.decode('utf-8'), replacements).encode('utf-8')
+            target.writestr(item, data)
+
+def convert_to_pdf(docx_path, output_path):
+    """
+    Convert a DOCX file to PDF with headless LibreOffice.
+
+    Args:
+        docx_path (str): Path of the DOCX file
+        output_path (str): Path of the PDF file to write
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        # A private profile per conversion lets several conversions run at once
+        profile_url = 'file://' + os.path.join(work_dir, 'profile')
+        command = [
+            LIBREOFFICE_BINARY,
+            f'-env:UserInstallation={profile_url}',
+            '--headless',
+            '--convert-to', 'pdf',
+            '--outdir', work_dir,
+            docx_path,
+        ]
+        completed = subprocess.run(command, capture_output=True, timeout=LIBREOFFICE_TIMEOUT)
+        pdf_path = os.path.join(work_dir, os.path.splitext(os.path.basename(docx_path))[0] + '.pdf')
+        if completed.returncode != 0 or not os.path.exists(pdf_path):
+            raise RuntimeError(
+                f"LibreOffice conversion failed ({completed.returncode}): {completed.stderr.decode(errors='replace')}"
+            )
+        shutil.move(pdf_path, output_path)
+
+def render_template(template_id, variables, output_path):
+    """
+    Render a template to PDF locally.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+        variables (dict): Dictionary of variables and their replacement values
+        output_path (str): Path of the PDF file to write
+
+    Returns:
+        str: The path of the written PDF
+    """
+    template_path = get_template_docx(template_id)
+    with tempfile.TemporaryDirectory() as work_dir:
+        docx_path = os.path.join(work_dir, 'document.docx')
+        fill_docx(template_path, variables, docx_path)
+        convert_to_pdf(docx_path, output_path)
+    return output_path
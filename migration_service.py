@@ -0,0 +1,117 @@
+"""
+Versioned schema migrations.
+
+Migrations are the SQL files of the migrations/ directory, named
+<version>_<name>.sql and applied in version order. The version of the last
+applied migration is recorded in the schema_version table, so when the schema
+is current, startup costs a single query.
+"""
+import os
+import re
+import logging
+import psycopg2
+from psycopg2 import errors
+from db_service import get_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+_MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Arbitrary key of the advisory lock taken while migrating, so that several
+# processes starting at the same time do not apply the same migration twice
+_MIGRATION_LOCK_ID = 0x706f7374  # "post"
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """
+    List the migration files.
+
+    Args:
+        directory (str): Directory holding the migration files
+
+    Returns:
+        list: (version, name, path) tuples sorted by version
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}: {versions}")
+    return migrations
+
+def _current_version(cur):
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+def get_schema_version():
+    """
+    Get the version of the last applied migration.
+
+    Returns:
+        int: The schema version, 0 if no migration was ever applied
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            version = _current_version(cur)
+        except errors.UndefinedTable:
+            conn.rollback()
+            version = 0
+        cur.close()
+    return version
+
+def run_migrations():
+    """
+    Apply the pending migrations, each one exactly once.
+
+    All pending migrations run in a single transaction, so a failing migration
+    leaves the schema untouched.
+
+    Returns:
+        int: The schema version after migrating
+    """
+    migrations = load_migrations()
+    latest = migrations[-1][0] if migrations else 0
+
+    # Fast path: a single query when the schema is current
+    current = get_schema_version()
+    if current >= latest:
+        logger.info(f"Database schema is up to date (version {current})")
+        return current
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_ID,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Another process may have migrated while we waited for the lock
+            current = _current_version(cur)
+
+            for version, name, path in migrations:
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version:03d}_{name}")
+                with open(path, encoding='utf-8') as migration_file:
+                    cur.execute(migration_file.read())
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                current = version
+
+            conn.commit()
+            cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f"Error applying database migrations: {error}")
+        raise
+
+    logger.info(f"Database schema migrated to version {current}")
+    return current
@@ -0,0 +1,37 @@
+-- Documents table. Databases created before the migration framework may lack
+-- some of the columns, so they are added if missing.
+CREATE TABLE IF NOT EXISTS documents (
+    id SERIAL PRIMARY KEY,
+    entreprise TEXT NOT NULL,
+    poste TEXT NOT NULL,
+    source TEXT,
+    identifiant TEXT,
+    base_line TEXT,
+    salaire TEXT,
+    description TEXT,
+    skills_text TEXT,
+    skill1 TEXT,
+    skill2 TEXT,
+    skill3 TEXT,
+    skill4 TEXT,
+    skill5 TEXT,
+    skill6 TEXT,
+    url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE documents
+    ADD COLUMN IF NOT EXISTS source TEXT,
+    ADD COLUMN IF NOT EXISTS identifiant TEXT,
+    ADD COLUMN IF NOT EXISTS base_line TEXT,
+    ADD COLUMN IF NOT EXISTS salaire TEXT,
+    ADD COLUMN IF NOT EXISTS description TEXT,
+    ADD COLUMN IF NOT EXISTS skills_text TEXT,
+    ADD COLUMN IF NOT EXISTS skill1 TEXT,
+    ADD COLUMN IF NOT EXISTS skill2 TEXT,
+    ADD COLUMN IF NOT EXISTS skill3 TEXT,
+    ADD COLUMN IF NOT EXISTS skill4 TEXT,
+    ADD COLUMN IF NOT EXISTS skill5 TEXT,
+    ADD COLUMN IF NOT EXISTS skill6 TEXT,
+    ADD COLUMN IF NOT EXISTS url TEXT,
+    ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
@@ -0,0 +1,10 @@
+-- Keyset pagination of the Candidatures tab: ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS documents_created_at_id_idx ON documents (created_at DESC, id DESC);
+
+-- Lookups by company / position and by posting identifier
+CREATE INDEX IF NOT EXISTS documents_entreprise_poste_idx ON documents (entreprise, poste);
+CREATE INDEX IF NOT EXISTS documents_identifiant_idx ON documents (identifiant);
+
+-- Substring (LIKE / ILIKE) and similarity searches on the job description
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS documents_description_trgm_idx ON documents USING gin (description gin_trgm_ops);
@@ -0,0 +1,12 @@
+-- Full-text search over past applications, French configuration. The column
+-- is generated, so PostgreSQL keeps it up to date on every insert and update.
+ALTER TABLE documents
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('french', coalesce(entreprise, '')), 'A') ||
+        setweight(to_tsvector('french', coalesce(poste, '')), 'A') ||
+        setweight(to_tsvector('french', coalesce(skills_text, '')), 'B') ||
+        setweight(to_tsvector('french', coalesce(description, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS documents_search_idx ON documents USING gin (search_vector);
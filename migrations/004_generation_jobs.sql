@@ -0,0 +1,19 @@
+-- Queue of generation requests, executed by worker.py processes
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    variables JSONB NOT NULL,
+    output_dir TEXT NOT NULL,
+    result JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Workers claim the oldest queued job; keep that lookup on a small index
+CREATE INDEX IF NOT EXISTS generation_jobs_queued_idx ON generation_jobs (id) WHERE status = 'queued';
+-- Running jobs are scanned for workers that died mid-job
+CREATE INDEX IF NOT EXISTS generation_jobs_running_idx ON generation_jobs (started_at) WHERE status = 'running';
@@ -0,0 +1,8 @@
+-- The worker running a job updates heartbeat_at while it is alive; jobs whose
+-- heartbeat stopped are the ones abandoned by a dead worker
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+-- Document saved by the job, so that a job run again does not insert it twice
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS document_id INTEGER REFERENCES documents (id) ON DELETE SET NULL;
+
+DROP INDEX IF EXISTS generation_jobs_running_idx;
+CREATE INDEX IF NOT EXISTS generation_jobs_heartbeat_idx ON generation_jobs (heartbeat_at) WHERE status = 'running';
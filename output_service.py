@@ -0,0 +1,96 @@
+"""
+Per-request output directories.
+
+Every generation writes its files to a directory of its own, named with a
+random UUID, so that concurrent users never overwrite each other's PDFs.
+Directories older than OUTPUT_TTL are removed when new ones are created.
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import zipfile
+import threading
+from pdf_service import atomic_output
+from config import GENERATIONS_DIR, OUTPUT_TTL, DOWNLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two cleanups of the expired directories
+_CLEANUP_INTERVAL = 60
+
+_cleanup_lock = threading.Lock()
+_last_cleanup = None
+
+def create_output_dir(base_dir=GENERATIONS_DIR):
+    """
+    Create the output directory of a new request.
+
+    Args:
+        base_dir (str): Directory holding the request directories
+
+    Returns:
+        str: Path of the new, empty directory
+    """
+    global _last_cleanup
+    now = time.monotonic()
+    with _cleanup_lock:
+        cleanup = _last_cleanup is None or now - _last_cleanup >= _CLEANUP_INTERVAL
+        if cleanup:
+            _last_cleanup = now
+    if cleanup:
+        cleanup_output_dirs(base_dir)
+
+    path = os.path.join(base_dir, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+def cleanup_output_dirs(base_dir=GENERATIONS_DIR, max_age=OUTPUT_TTL):
+    """
+    Remove the request directories not modified for max_age seconds.
+
+    Args:
+        base_dir (str): Directory holding the request directories
+        max_age (float): Age in seconds after which a directory is removed
+
+    Returns:
+        int: Number of removed directories
+    """
+    if not os.path.isdir(base_dir):
+        return 0
+
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(base_dir):
+        try:
+            if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path)
+                removed += 1
+        except OSError as error:
+            # Removed concurrently by another process
+            logger.warning(f"Could not remove output directory {entry.path}: {error}")
+    if removed:
+        logger.info(f"Removed {removed} expired output directories")
+    return removed
+
+def write_zip(files, zip_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Bundle files into a ZIP archive, streaming each one chunk by chunk.
+
+    Files are stored without compression, PDFs being compressed already, and
+    never held in memory as a whole.
+
+    Args:
+        files (dict): Name in the archive -> path of the file
+        zip_path (str): Path of the ZIP archive to write
+        chunk_size (int): Bytes copied at a time
+
+    Returns:
+        str: The path of the written archive
+    """
+    with atomic_output(zip_path) as output, zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        for name, path in files.items():
+            with open(path, 'rb') as source, archive.open(name, 'w') as target:
+                shutil.copyfileobj(source, target, chunk_size)
+    return zip_path
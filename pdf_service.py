@@ -1,10 +1,43 @@
-from googleapiclient.discovery import build
-from auth import get_credentials
+import os
+import tempfile
+from contextlib import contextmanager
+from google_api import get_drive_service, download
+from config import GOOGLE_API_TRANSPORT
+
+PDF_MIME_TYPE = 'application/pdf'
+
+@contextmanager
+def atomic_output(output_filename):
+    """
+    Open a temporary file that replaces output_filename when the block succeeds.
+
+    The file is created next to output_filename and renamed atomically, so
+    readers never see a partially written PDF. It is removed if the block
+    raises.
+
+    Args:
+        output_filename (str): The name of the output file
+
+    Yields:
+        file: The temporary file, opened for binary writing
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_filename))
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix='.export-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(temp_path, output_filename)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
 
 def export_as_pdf(document_id, output_filename):
     """
     Export a Google Doc as PDF.
-    
+
+    The PDF is streamed to disk, see atomic_output().
+
     Args:
         document_id (str): The ID of the Google Doc
         output_filename (str): The name of the output PDF file
@@ -12,10 +45,14 @@ def export_as_pdf(document_id, output_filename):
     Returns:
         None
     """
-    creds = get_credentials()
-    drive_service = build('drive', 'v3', credentials=creds)
+    if GOOGLE_API_TRANSPORT == 'async':
+        # Imported here: async_google_api imports this module
+        import async_google_api
+        return async_google_api.run(async_google_api.export_as_pdf(document_id, output_filename))
+
+    drive_service = get_drive_service()
 
     request = drive_service.files().export_media(fileId=document_id,
-                                               mimeType='application/pdf')
-    with open(output_filename, 'wb') as f:
-        f.write(request.execute())
\ No newline at end of file
+                                               mimeType=PDF_MIME_TYPE)
+    with atomic_output(output_filename) as f:
+        download(request, f)
@@ -0,0 +1,170 @@
+"""
+Discovery of the `{{ key }}` placeholders of the templates.
+
+replaceAllText makes Google scan the whole document once per request, so
+sending one request per variable when the template only uses some of them
+wastes work and payload. The placeholders of a template are read once per
+template revision with a documents.get limited to the document text, and only
+the variables the template uses are then sent. Variables without placeholder
+and placeholders without variable are reported.
+
+The documents.get costs one more round trip when a template revision is seen
+for the first time, e.g. on the first generation of a process; later
+generations only pay the revision lookup.
+
+Revisions come from render_cache.get_template_revisions(), so a template
+edited less than RENDER_CACHE_REVISION_TTL seconds ago may still be served
+the placeholders of its previous revision.
+"""
+import re
+import logging
+import threading
+from google_api import get_docs_service, execute, execute_batch
+from render_cache import get_template_revisions
+
+logger = logging.getLogger(__name__)
+
+# Placeholders as written by document_service.build_replace_requests()
+PLACEHOLDER_PATTERN = re.compile(r'\{\{ (.+?) \}\}')
+
+# Fields of documents.get holding text: replaceAllText also applies to the
+# headers, footers and footnotes. The revision comes from render_cache, which
+# other steps share.
+DOCUMENT_FIELDS = 'body(content),headers,footers,footnotes'
+
+# Template ID -> (revision, placeholders)
+_placeholders = {}
+_placeholders_lock = threading.Lock()
+
+def _paragraph_texts(content):
+    # Structural elements nest through tables and tables of contents
+    for element in content or []:
+        if 'paragraph' in element:
+            yield ''.join(run.get('textRun', {}).get('content', '') for run in element['paragraph'].get('elements', []))
+        elif 'table' in element:
+            for row in element['table'].get('tableRows', []):
+                for cell in row.get('tableCells', []):
+                    yield from _paragraph_texts(cell.get('content'))
+        elif 'tableOfContents' in element:
+            yield from _paragraph_texts(element['tableOfContents'].get('content'))
+
+def find_placeholders(document):
+    """
+    Find the placeholders of a document.
+
+    Paragraph text is joined before matching, so a placeholder split over
+    several text runs (e.g. partly bold) is still found, like replaceAllText
+    does.
+
+    Args:
+        document (dict): documents.get response, with DOCUMENT_FIELDS
+
+    Returns:
+        dict: Placeholder key -> {section: number of occurrences}, sections
+            being 'body', 'headers', 'footers' and 'footnotes'
+    """
+    sections = {'body': [document.get('body', {}).get('content')]}
+    for section in ('headers', 'footers', 'footnotes'):
+        sections[section] = [part.get('content') for part in (document.get(section) or {}).values()]
+
+    placeholders = {}
+    for section, contents in sections.items():
+        for content in contents:
+            for text in _paragraph_texts(content):
+                for match in PLACEHOLDER_PATTERN.finditer(text):
+                    occurrences = placeholders.setdefault(match.group(1), {})
+                    occurrences[section] = occurrences.get(section, 0) + 1
+    return placeholders
+
+def get_template_placeholders(template_ids):
+    """
+    Get the placeholders of templates, reading each template revision once.
+
+    The revisions are looked up in one batch, then the templates whose
+    revision changed are read in one batch.
+
+    Args:
+        template_ids (list): The IDs of the Google Doc templates
+
+    Returns:
+        dict: Template ID -> placeholders, see find_placeholders()
+    """
+    template_ids = list(dict.fromkeys(template_ids))
+    revisions = get_template_revisions(template_ids)
+    result = {}
+    with _placeholders_lock:
+        for template_id in template_ids:
+            cached = _placeholders.get(template_id)
+            if cached is not None and cached[0] == revisions[template_id]:
+                result[template_id] = cached[1]
+    expired = [template_id for template_id in template_ids if template_id not in result]
+    if not expired:
+        return result
+
+    docs_service = get_docs_service()
+    requests = [docs_service.documents().get(documentId=template_id, fields=DOCUMENT_FIELDS) for template_id in expired]
+    documents = [execute(requests[0])] if len(requests) == 1 else execute_batch(docs_service, requests)
+    for template_id, document in zip(expired, documents):
+        if isinstance(document, Exception):
+            raise document
+        placeholders = find_placeholders(document)
+        logger.info(f"Template {template_id} revision {revisions[template_id]} uses {len(placeholders)} placeholders")
+        with _placeholders_lock:
+            _placeholders[template_id] = (revisions[template_id], placeholders)
+        result[template_id] = placeholders
+    return result
+
+def plan_replacements(placeholders, replacements):
+    """
+    Keep the replacements a template actually uses.
+
+    Args:
+        placeholders (dict): Placeholders of the template, see find_placeholders()
+        replacements (dict): Dictionary of variables and their replacement values
+
+    Returns:
+        tuple: (replacements to send, report) where report holds 'missing'
+            (placeholders without variable, left as is in the document) and
+            'unused' (variables without placeholder), both sorted lists
+    """
+    needed = {key: value for key, value in replacements.items() if key in placeholders}
+    report = {
+        'missing': sorted(key for key in placeholders if key not in replacements),
+        'unused': sorted(key for key in replacements if key not in placeholders),
+    }
+    return needed, report
+
+def filter_replacements(jobs):
+    """
+    Keep, for each job, the replacements its template uses.
+
+    Discovery errors are logged and the job keeps all its replacements, so a
+    failed lookup never leaves placeholders unreplaced.
+
+    Args:
+        jobs (list): (replacements, template_id) tuples; jobs without
+            template ID keep all their replacements
+
+    Returns:
+        list: For each job, (replacements to send, report or None), see
+            plan_replacements()
+    """
+    template_ids = [template_id for _, template_id in jobs if template_id]
+    try:
+        placeholders = get_template_placeholders(template_ids) if template_ids else {}
+    except Exception as error:
+        logger.warning(f"Could not discover the placeholders of {template_ids}, sending every variable: {error}")
+        placeholders = {}
+
+    planned = []
+    for replacements, template_id in jobs:
+        if template_id not in placeholders:
+            planned.append((replacements, None))
+            continue
+        needed, report = plan_replacements(placeholders[template_id], replacements)
+        if report['missing']:
+            logger.warning(f"Template {template_id} placeholders without variable: {', '.join(report['missing'])}")
+        if report['unused']:
+            logger.info(f"Template {template_id} does not use the variables: {', '.join(report['unused'])}")
+        planned.append((needed, report))
+    return planned
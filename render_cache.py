@@ -0,0 +1,203 @@
+"""
+Content-addressed cache of generated PDFs.
+
+A rendered PDF only depends on the template content and on the variables, so
+it is stored on disk under a key derived from (template ID, template revision,
+variables). Editing the template changes its revision, which changes the key:
+stale entries are never served and simply age out of the LRU.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from google_api import get_drive_service, execute, execute_batch
+from config import RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES, RENDER_CACHE_REVISION_TTL
+
+logger = logging.getLogger(__name__)
+
+# template ID -> (revision, time it was fetched)
+_revisions = {}
+_revisions_lock = threading.Lock()
+_eviction_lock = threading.Lock()
+
+# Fields of files().get identifying a template revision
+REVISION_FIELDS = 'version,modifiedTime,headRevisionId'
+
+def _revision(metadata):
+    # Native Google Docs have no headRevisionId; version is bumped on every edit
+    return metadata.get('headRevisionId') or f"{metadata.get('version')}:{metadata.get('modifiedTime')}"
+
+def _cached_revision(template_id, now, max_age):
+    with _revisions_lock:
+        cached = _revisions.get(template_id)
+    if cached is not None and now - cached[1] < max_age:
+        return cached[0]
+    return None
+
+def get_template_revision(template_id, max_age=RENDER_CACHE_REVISION_TTL):
+    """
+    Get a string identifying the current revision of a template.
+
+    Lookups are remembered for max_age seconds, so repeated generations within
+    that window do not call the Drive API at all.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+        max_age (float): Seconds a previous lookup is trusted
+
+    Returns:
+        str: The template revision
+    """
+    now = time.monotonic()
+    revision = _cached_revision(template_id, now, max_age)
+    if revision is not None:
+        return revision
+
+    revision = _revision(execute(get_drive_service().files().get(fileId=template_id, fields=REVISION_FIELDS)))
+
+    with _revisions_lock:
+        _revisions[template_id] = (revision, now)
+    return revision
+
+def get_template_revisions(template_ids, max_age=RENDER_CACHE_REVISION_TTL):
+    """
+    Get the current revisions of several templates, looking up the expired
+    ones in a single batch request.
+
+    Args:
+        template_ids (list): The IDs of the Google Doc templates
+        max_age (float): Seconds a previous lookup is trusted
+
+    Returns:
+        dict: Template ID -> revision
+    """
+    now = time.monotonic()
+    revisions = {template_id: _cached_revision(template_id, now, max_age) for template_id in template_ids}
+    expired = [template_id for template_id, revision in revisions.items() if revision is None]
+    if len(expired) == 1:
+        revisions[expired[0]] = get_template_revision(expired[0], max_age)
+    elif expired:
+        drive_service = get_drive_service()
+        results = execute_batch(drive_service, [
+            drive_service.files().get(fileId=template_id, fields=REVISION_FIELDS) for template_id in expired
+        ])
+        for template_id, metadata in zip(expired, results):
+            if isinstance(metadata, Exception):
+                raise metadata
+            revisions[template_id] = _revision(metadata)
+            with _revisions_lock:
+                _revisions[template_id] = (revisions[template_id], now)
+    return revisions
+
+def cache_key(template_id, revision, variables, backend='google'):
+    """
+    Compute the cache key of a rendered template.
+
+    Args:
+        template_id (str): The ID of the Google Doc template
+        revision (str): The template revision, see get_template_revision()
+        variables (dict): Dictionary of variables and their replacement values
+        backend (str): The rendering backend, as backends do not produce
+            byte-identical PDFs
+
+    Returns:
+        str: Hex digest identifying the rendered PDF
+    """
+    canonical = json.dumps(
+        {'template_id': template_id, 'revision': revision, 'backend': backend, 'variables': variables},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _entry_path(key):
+    return os.path.join(RENDER_CACHE_DIR, key[:2], f"{key}.pdf")
+
+def fetch(key, output_path):
+    """
+    Copy a cached PDF to output_path.
+
+    Args:
+        key (str): The cache key, see cache_key()
+        output_path (str): Path of the PDF file to write
+
+    Returns:
+        bool: True on a cache hit, False otherwise
+    """
+    entry = _entry_path(key)
+    try:
+        # Touch the entry so it becomes the most recently used one
+        os.utime(entry)
+        shutil.copyfile(entry, output_path)
+    except FileNotFoundError:
+        return False
+    logger.info(f"Render cache hit: {key}")
+    return True
+
+def store(key, pdf_path):
+    """
+    Add a rendered PDF to the cache, then evict old entries if needed.
+
+    Args:
+        key (str): The cache key, see cache_key()
+        pdf_path (str): Path of the rendered PDF
+    """
+    entry = _entry_path(key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    # Write under a temporary name first so readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file, open(pdf_path, 'rb') as source:
+            shutil.copyfileobj(source, temp_file)
+        os.replace(temp_path, entry)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    logger.info(f"Render cache stored: {key}")
+    evict()
+
+def evict(max_bytes=RENDER_CACHE_MAX_BYTES):
+    """
+    Remove the least recently used entries until the cache fits in max_bytes.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached PDFs
+
+    Returns:
+        int: Number of evicted entries
+    """
+    with _eviction_lock:
+        entries = []
+        total = 0
+        for root, _, files in os.walk(RENDER_CACHE_DIR):
+            for name in files:
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+    if evicted:
+        logger.info(f"Render cache evicted {evicted} entries")
+    return evicted
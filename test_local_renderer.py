@@ -0,0 +1,40 @@
+"""
+Test script to verify placeholder substitution of the local rendering backend.
+"""
+from local_renderer import substitute_placeholders
+
+def test_substitute_placeholders():
+    """
+    Test that placeholders are replaced even when split across runs.
+    """
+    print("Testing placeholder substitution...")
+
+    xml = (
+        '<w:p><w:r><w:t>Poste : {{ po</w:t></w:r>'
+        '<w:r><w:t xml:space="preserve">ste }} chez </w:t></w:r>'
+        '<w:r><w:t>{{ entreprise }}</w:t></w:r>'
+        '<w:r><w:t>{{ unknown }}</w:t></w:r></w:p>'
+    )
+    result = substitute_placeholders(xml, {
+        "poste": "Dev\nOps",
+        "entreprise": "A & B",
+    })
+
+    expected = (
+        '<w:p><w:r><w:t xml:space="preserve">Poste : Dev</w:t><w:br/><w:t xml:space="preserve">Ops</w:t></w:r>'
+        '<w:r><w:t xml:space="preserve"> chez </w:t></w:r>'
+        '<w:r><w:t xml:space="preserve">A &amp; B</w:t></w:r>'
+        '<w:r><w:t>{{ unknown }}</w:t></w:r></w:p>'
+    )
+    if result != expected:
+        print(f"✗ Unexpected substitution result: {result}")
+        return False
+
+    print("✓ Placeholder substitution successful")
+    return True
+
+if __name__ == "__main__":
+    if test_substitute_placeholders():
+        print("All tests passed!")
+    else:
+        print("Tests failed!")
@@ -1,8 +1,12 @@
 """
 Test script to verify that the refactored modules work correctly.
+
+The variables are replaced in a temporary copy of the template, never in the
+template itself. Set GOOGLE_API_ENDPOINT to run it against
+fake_google_server.py instead of Google.
 """
 import os
-from document_service import replace_variables
+from document_service import replace_variables, document_copy
 from pdf_service import export_as_pdf
 from config import DOCUMENT_ID, OUTPUT_FILENAME
 
@@ -21,21 +25,22 @@ def test_document_generation():
         "description": "This is a test description."
     }
     
-    # Replace variables in the document
-    try:
-        replace_variables(DOCUMENT_ID, test_variables)
-        print("✓ Variable replacement successful")
-    except Exception as e:
-        print(f"✗ Variable replacement failed: {e}")
-        return False
-    
-    # Export as PDF
-    try:
-        export_as_pdf(DOCUMENT_ID, "test_output.pdf")
-        print("✓ PDF export successful")
-    except Exception as e:
-        print(f"✗ PDF export failed: {e}")
-        return False
+    with document_copy(DOCUMENT_ID) as copy_id:
+        # Replace variables in the copy
+        try:
+            replace_variables(copy_id, test_variables, template_id=DOCUMENT_ID)
+            print("✓ Variable replacement successful")
+        except Exception as e:
+            print(f"✗ Variable replacement failed: {e}")
+            return False
+
+        # Export as PDF
+        try:
+            export_as_pdf(copy_id, "test_output.pdf")
+            print("✓ PDF export successful")
+        except Exception as e:
+            print(f"✗ PDF export failed: {e}")
+            return False
     
     # Check if the file exists
     if os.path.exists("test_output.pdf"):
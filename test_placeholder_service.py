@@ -0,0 +1,61 @@
+"""
+Test script to verify placeholder discovery of the Google Docs templates.
+"""
+from placeholder_service import find_placeholders, plan_replacements
+
+def _paragraph(*runs):
+    return {'paragraph': {'elements': [{'textRun': {'content': run}} for run in runs]}}
+
+def test_find_placeholders():
+    """
+    Test that placeholders are found across runs, tables and headers.
+    """
+    print("Testing placeholder discovery...")
+
+    document = {
+        'body': {'content': [
+            _paragraph('Poste : {{ po', 'ste }} chez {{ entreprise }}\n'),
+            {'table': {'tableRows': [{'tableCells': [{'content': [_paragraph('{{ entreprise }} {entreprise}\n')]}]}]}},
+        ]},
+        'headers': {'kix.header': {'content': [_paragraph('{{ identifiant }}\n')]}},
+    }
+    result = find_placeholders(document)
+
+    expected = {
+        'poste': {'body': 1},
+        'entreprise': {'body': 2},
+        'identifiant': {'headers': 1},
+    }
+    if result != expected:
+        print(f"✗ Unexpected placeholders: {result}")
+        return False
+
+    print("✓ Placeholder discovery successful")
+    return True
+
+def test_plan_replacements():
+    """
+    Test that only the used variables are kept and the others are reported.
+    """
+    print("Testing replacement planning...")
+
+    needed, report = plan_replacements(
+        {'poste': {'body': 1}, 'entreprise': {'body': 2}, 'identifiant': {'headers': 1}},
+        {'poste': 'Dev', 'entreprise': 'ACME', 'salaire': '50k'},
+    )
+    if needed != {'poste': 'Dev', 'entreprise': 'ACME'}:
+        print(f"✗ Unexpected replacements: {needed}")
+        return False
+    if report != {'missing': ['identifiant'], 'unused': ['salaire']}:
+        print(f"✗ Unexpected report: {report}")
+        return False
+
+    print("✓ Replacement planning successful")
+    return True
+
+if __name__ == "__main__":
+    results = [test_find_placeholders(), test_plan_replacements()]
+    if all(results):
+        print("All tests passed!")
+    else:
+        print("Tests failed!")
@@ -0,0 +1,293 @@
+"""
+Lightweight tracing of the generation pipeline steps.
+
+Every external call (Google API requests, token refreshes, database queries)
+and every pipeline step runs in a span. A finished span adds its duration to
+the histogram of its name and, if TRACING_EXPORT_FILE is set, is appended to
+that file as one JSON line. Spans carry OpenTelemetry-style trace, span and
+parent IDs, so the lines of one generation can be put back together.
+
+The histograms are served in the Prometheus text format on
+TRACING_METRICS_PORT (see start_metrics_server()) and returned by
+get_histograms().
+
+Tracing is off unless TRACING_ENABLED is set: span() then returns a shared
+no-op object, which costs one flag check per call.
+"""
+import json
+import time
+import random
+import logging
+import functools
+import threading
+import contextvars
+from config import TRACING_ENABLED, TRACING_EXPORT_FILE, TRACING_METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Name of the Prometheus metrics
+METRIC_NAME = 'postulator_span_duration_seconds'
+ERRORS_METRIC_NAME = 'postulator_span_errors_total'
+
+_enabled = TRACING_ENABLED
+# Innermost open span of the current thread or task, parent of the next one
+current_span = contextvars.ContextVar('current_span', default=None)
+
+# Span name -> {'buckets': counts per bucket (not cumulative), 'count', 'sum', 'max', 'errors'}
+_histograms = {}
+_lock = threading.Lock()
+_export_file = None
+_export_lock = threading.Lock()
+_metrics_server = None
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """
+    A timed step, used as a context manager, see span().
+    """
+    __slots__ = ('name', 'attributes', 'trace_id', 'span_id', 'parent_id', 'start', '_start', '_token')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, key, value):
+        """
+        Set an attribute of the span.
+
+        Args:
+            key (str): Attribute name
+            value: JSON-serializable attribute value
+        """
+        self.attributes[key] = value
+
+    def __enter__(self):
+        parent = current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else f'{random.getrandbits(128):032x}'
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self._token = current_span.set(self)
+        self.start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._start
+        current_span.reset(self._token)
+        _record(self, duration, exc_type.__name__ if exc_type is not None else None)
+        return False
+
+def span(name, **attributes):
+    """
+    Time a block of code.
+
+    Spans opened inside the block, in the same thread or task, are its
+    children.
+
+    Args:
+        name (str): Step name, e.g. 'drive.files.copy'; one histogram per name
+        **attributes: JSON-serializable attributes of the span
+
+    Returns:
+        A context manager yielding the span (a no-op one when tracing is off)
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def traced(name):
+    """
+    Decorator running every call of a function in a span.
+
+    Args:
+        name (str): Step name of the span
+
+    Returns:
+        callable: The decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_enabled(enabled):
+    """
+    Turn tracing on or off for the whole process.
+
+    Args:
+        enabled (bool): Whether spans are recorded
+    """
+    global _enabled
+    _enabled = enabled
+
+def is_enabled():
+    """
+    Check whether spans are recorded.
+
+    Returns:
+        bool: True if tracing is on
+    """
+    return _enabled
+
+def _record(finished_span, duration, error):
+    with _lock:
+        histogram = _histograms.get(finished_span.name)
+        if histogram is None:
+            histogram = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0}
+            _histograms[finished_span.name] = histogram
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                histogram['buckets'][index] += 1
+                break
+        histogram['count'] += 1
+        histogram['sum'] += duration
+        histogram['max'] = max(histogram['max'], duration)
+        if error is not None:
+            histogram['errors'] += 1
+
+    logger.debug(f"{finished_span.name} took {duration * 1000:.1f}ms{f' ({error})' if error else ''}")
+    if TRACING_EXPORT_FILE:
+        _export({
+            'name': finished_span.name,
+            'trace_id': finished_span.trace_id,
+            'span_id': finished_span.span_id,
+            'parent_id': finished_span.parent_id,
+            'start': finished_span.start,
+            'duration': duration,
+            'error': error,
+            'attributes': finished_span.attributes,
+        })
+
+def _export(record):
+    global _export_file
+    line = json.dumps(record, default=str) + '\n'
+    try:
+        with _export_lock:
+            if _export_file is None:
+                # Line buffered and appended to, so several processes can share the file
+                _export_file = open(TRACING_EXPORT_FILE, 'a', buffering=1, encoding='utf-8')
+            _export_file.write(line)
+    except OSError as error:
+        logger.error(f"Error exporting span to {TRACING_EXPORT_FILE}: {error}")
+
+def get_histograms():
+    """
+    Get the duration histograms of the finished spans.
+
+    Returns:
+        dict: Span name -> 'buckets' (upper bound in seconds -> cumulative
+            count), 'count', 'sum', 'mean' and 'max' in seconds, and 'errors'
+    """
+    with _lock:
+        histograms = {name: dict(histogram, buckets=list(histogram['buckets'])) for name, histogram in _histograms.items()}
+    report = {}
+    for name, histogram in sorted(histograms.items()):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            cumulative += count
+            buckets[bound] = cumulative
+        report[name] = {
+            'buckets': buckets,
+            'count': histogram['count'],
+            'sum': histogram['sum'],
+            'mean': histogram['sum'] / histogram['count'] if histogram['count'] else 0.0,
+            'max': histogram['max'],
+            'errors': histogram['errors'],
+        }
+    return report
+
+def reset():
+    """
+    Clear the histograms.
+    """
+    with _lock:
+        _histograms.clear()
+
+def render_prometheus():
+    """
+    Render the histograms in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics
+    """
+    lines = [
+        f'# HELP {METRIC_NAME} Duration of the traced pipeline steps.',
+        f'# TYPE {METRIC_NAME} histogram',
+    ]
+    histograms = get_histograms()
+    for name, histogram in histograms.items():
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        for bound, count in histogram['buckets'].items():
+            lines.append(f'{METRIC_NAME}_bucket{{span="{label}",le="{bound}"}} {count}')
+        lines.append(f'{METRIC_NAME}_bucket{{span="{label}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{span="{label}"}} {histogram["sum"]}')
+        lines.append(f'{METRIC_NAME}_count{{span="{label}"}} {histogram["count"]}')
+    lines.append(f'# HELP {ERRORS_METRIC_NAME} Traced pipeline steps that raised an exception.')
+    lines.append(f'# TYPE {ERRORS_METRIC_NAME} counter')
+    for name, histogram in histograms.items():
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        lines.append(f'{ERRORS_METRIC_NAME}{{span="{label}"}} {histogram["errors"]}')
+    return '\n'.join(lines) + '\n'
+
+def start_metrics_server(port=TRACING_METRICS_PORT):
+    """
+    Serve the histograms on http://0.0.0.0:<port>/metrics from a background
+    thread, once per process.
+
+    Args:
+        port (int): Port to listen on, 0 to not serve the metrics
+
+    Returns:
+        ThreadingHTTPServer: The server, or None if it is not started
+    """
+    global _metrics_server
+    if not port or not _enabled:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            content = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    with _lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+            except OSError as error:
+                logger.error(f"Could not serve the tracing metrics on port {port}: {error}")
+                return None
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name='tracing-metrics', daemon=True).start()
+            logger.info(f"Serving tracing metrics on port {port}")
+    return _metrics_server
@@ -0,0 +1,200 @@
+"""
+Worker processes running the queued generation jobs.
+
+Usage:
+    python worker.py [--processes 2]
+
+Each process claims jobs from the generation_jobs table (see job_service)
+and runs the same pipelines as the Streamlit app. Throughput grows with the
+number of processes, up to the Google API quotas. SIGTERM or Ctrl+C stops
+the workers once their current job is finished. While a job runs, a thread
+of its process updates the job heartbeat, so jobs of dead workers can be told
+apart from long ones.
+"""
+import os
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+from config import (
+    WORKER_PROCESSES,
+    JOB_POLL_INTERVAL,
+    JOB_HEARTBEAT_INTERVAL,
+    BUNDLE_FILENAME,
+    TRACING_METRICS_PORT,
+    RENDER_BACKEND,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two looks for jobs abandoned by dead workers
+_REQUEUE_INTERVAL = 60
+
+def run_job(job):
+    """
+    Run a generation job.
+
+    The document is saved through job_service.save_job_document(), so a job
+    run again after its worker was presumed dead does not save it twice.
+
+    Args:
+        job (dict): The claimed job, see job_service.claim_job()
+
+    Returns:
+        tuple: (result, error) where result is the JSON-serializable outcome
+            of every task and error the message of the failed templates, or None
+    """
+    from generation_service import generate_documents, TEMPLATES, DATABASE_RESULT
+    from google_api import ApiCallCounts
+    from output_service import write_zip
+    from job_service import save_job_document
+
+    os.makedirs(job['output_dir'], exist_ok=True)
+    api_calls = ApiCallCounts()
+    results = generate_documents(job['variables'], job['output_dir'], save=False, api_calls=api_calls)
+
+    start = time.monotonic()
+    document_id = save_job_document(job)
+    results[DATABASE_RESULT] = {
+        'name': DATABASE_RESULT,
+        'label': 'Base de données',
+        'document_id': document_id,
+        'error': "Le document n'a pas pu être enregistré" if document_id is None else None,
+        'duration': time.monotonic() - start,
+    }
+
+    result = {
+        'results': {
+            name: {
+                'label': task['label'],
+                'output_path': task.get('output_path'),
+                'document_id': task.get('document_id'),
+                'error': str(task['error']) if task['error'] is not None else None,
+                'duration': task['duration'],
+            }
+            for name, task in results.items()
+        },
+        'api_calls': sum(api_calls.values()),
+        'round_trips': api_calls.round_trips,
+    }
+
+    errors = [f"{results[template['name']]['label']}: {results[template['name']]['error']}"
+              for template in TEMPLATES if results[template['name']]['error'] is not None]
+    if not errors:
+        result['bundle'] = write_zip(
+            {template['output_filename']: results[template['name']]['output_path'] for template in TEMPLATES},
+            os.path.join(job['output_dir'], BUNDLE_FILENAME),
+        )
+    return result, '; '.join(errors) or None
+
+def _heartbeat(job, done):
+    # Runs until the job is done or was queued again by another worker
+    from job_service import heartbeat_job
+
+    while not done.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            if not heartbeat_job(job):
+                logger.warning(f"Job {job['id']} attempt {job['attempts']} was queued again")
+                return
+        except Exception as error:
+            # Database unavailable: the next heartbeat may get through
+            logger.error(f"Error updating the heartbeat of job {job['id']}: {error}")
+
+def worker_loop(name, stop, metrics_port=0):
+    """
+    Claim and run jobs until stop is set.
+
+    Args:
+        name (str): Name of the worker, recorded on its jobs
+        stop (Event): Set to stop the worker after its current job
+        metrics_port (int): Port of the tracing metrics of this process, 0 for none
+    """
+    from job_service import claim_job, finish_job, requeue_abandoned_jobs
+    from generation_service import TEMPLATES
+    import copy_pool
+    import tracing
+
+    logging.basicConfig(level=logging.INFO)
+    tracing.start_metrics_server(metrics_port)
+    # Keep ready copies of the templates, like the app does without the job queue
+    if RENDER_BACKEND == 'google':
+        copy_pool.warm([template['template_id'] for template in TEMPLATES])
+    # The parent process handles Ctrl+C and tells the workers to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    last_requeue = None
+    while not stop.is_set():
+        try:
+            if last_requeue is None or time.monotonic() - last_requeue >= _REQUEUE_INTERVAL:
+                last_requeue = time.monotonic()
+                requeue_abandoned_jobs()
+
+            job = claim_job(name)
+            if job is None:
+                stop.wait(JOB_POLL_INTERVAL)
+                continue
+
+            logger.info(f"Worker {name} running job {job['id']} (attempt {job['attempts']})")
+            start = time.monotonic()
+            done = threading.Event()
+            threading.Thread(target=_heartbeat, args=(job, done), name=f"heartbeat-{job['id']}", daemon=True).start()
+            try:
+                result, error = run_job(job)
+            except Exception as job_error:
+                result, error = None, str(job_error)
+            finally:
+                done.set()
+            finish_job(job, result, error)
+            logger.info(f"Worker {name} finished job {job['id']} in {time.monotonic() - start:.1f}s"
+                        f"{f' with errors: {error}' if error else ''}")
+        except Exception as error:
+            # Database unavailable: wait before trying again
+            logger.error(f"Worker {name} error: {error}")
+            stop.wait(JOB_POLL_INTERVAL)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run the queued generation jobs.")
+    parser.add_argument('--processes', type=int, default=WORKER_PROCESSES, help="Number of worker processes")
+    args = parser.parse_args()
+
+    # Create the queue table before the workers poll it
+    from db_service import init_db, close_pool
+    init_db()
+    close_pool()
+
+    # Spawned, not forked: every worker opens its own database and HTTP connections
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    host = socket.gethostname()
+    processes = [
+        context.Process(
+            target=worker_loop,
+            args=(f"{host}-{index}", stop, TRACING_METRICS_PORT + index if TRACING_METRICS_PORT else 0),
+            name=f"worker-{index}",
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} worker processes")
+
+    try:
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(timeout=1)
+    except KeyboardInterrupt:
+        logger.info("Stopping the workers after their current job")
+        stop.set()
+        for process in processes:
+            process.join()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())